@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.utils import DatabaseError
+
+# The index follows browser_text (external content): triggers keep it up to date
+TEXT_INDEX_SQL = [
+    """CREATE VIRTUAL TABLE browser_text_fts USING fts5(
+         fileName, genre, date, title, author, subtype,
+         content='browser_text', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER browser_text_fts_insert AFTER INSERT ON browser_text BEGIN
+         INSERT INTO browser_text_fts(rowid, fileName, genre, date, title, author, subtype)
+           VALUES (new.id, new.fileName, new.genre, new.date, new.title, new.author, new.subtype);
+       END""",
+    """CREATE TRIGGER browser_text_fts_delete AFTER DELETE ON browser_text BEGIN
+         INSERT INTO browser_text_fts(browser_text_fts, rowid, fileName, genre, date, title, author, subtype)
+           VALUES ('delete', old.id, old.fileName, old.genre, old.date, old.title, old.author, old.subtype);
+       END""",
+    """CREATE TRIGGER browser_text_fts_update AFTER UPDATE ON browser_text BEGIN
+         INSERT INTO browser_text_fts(browser_text_fts, rowid, fileName, genre, date, title, author, subtype)
+           VALUES ('delete', old.id, old.fileName, old.genre, old.date, old.title, old.author, old.subtype);
+         INSERT INTO browser_text_fts(rowid, fileName, genre, date, title, author, subtype)
+           VALUES (new.id, new.fileName, new.genre, new.date, new.title, new.author, new.subtype);
+       END""",
+    """INSERT INTO browser_text_fts(browser_text_fts) VALUES ('rebuild')"""
+]
+
+def create_text_index(apps, schema_editor):
+    """Create the index, provided this is SQLite with FTS5 and the trigram tokenizer (3.34+)"""
+
+    connection = schema_editor.connection
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.browser_text_fts_check USING fts5(x, tokenize='trigram')")
+            cursor.execute("DROP TABLE temp.browser_text_fts_check")
+        except DatabaseError:
+            # Without the index the texts are searched with regular expressions only
+            return
+        for sSql in TEXT_INDEX_SQL:
+            cursor.execute(sSql)
+
+def drop_text_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for sName in ['insert', 'delete', 'update']:
+            cursor.execute("DROP TRIGGER IF EXISTS browser_text_fts_{}".format(sName))
+        cursor.execute("DROP TABLE IF EXISTS browser_text_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('browser', '0026_auto_20210610_1022'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_text_index, drop_text_index),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.utils import DatabaseError
+
+# The index follows browser_sentence (external content): triggers keep it up to date
+SENTENCE_INDEX_SQL = [
+    """CREATE VIRTUAL TABLE browser_sentence_fts USING fts5(
+         sent, content='browser_sentence', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER browser_sentence_fts_insert AFTER INSERT ON browser_sentence BEGIN
+         INSERT INTO browser_sentence_fts(rowid, sent) VALUES (new.id, new.sent);
+       END""",
+    """CREATE TRIGGER browser_sentence_fts_delete AFTER DELETE ON browser_sentence BEGIN
+         INSERT INTO browser_sentence_fts(browser_sentence_fts, rowid, sent) VALUES ('delete', old.id, old.sent);
+       END""",
+    """CREATE TRIGGER browser_sentence_fts_update AFTER UPDATE ON browser_sentence BEGIN
+         INSERT INTO browser_sentence_fts(browser_sentence_fts, rowid, sent) VALUES ('delete', old.id, old.sent);
+         INSERT INTO browser_sentence_fts(rowid, sent) VALUES (new.id, new.sent);
+       END""",
+    """INSERT INTO browser_sentence_fts(browser_sentence_fts) VALUES ('rebuild')"""
+]
+
+def create_sentence_index(apps, schema_editor):
+    """Create the index, provided this is SQLite with FTS5"""
+
+    connection = schema_editor.connection
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.browser_sentence_fts_check USING fts5(x)")
+            cursor.execute("DROP TABLE temp.browser_sentence_fts_check")
+        except DatabaseError:
+            # Without the index the sentences are searched with icontains
+            return
+        for sSql in SENTENCE_INDEX_SQL:
+            cursor.execute(sSql)
+
+def drop_sentence_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for sName in ['insert', 'delete', 'update']:
+            cursor.execute("DROP TRIGGER IF EXISTS browser_sentence_fts_{}".format(sName))
+        cursor.execute("DROP TABLE IF EXISTS browser_sentence_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('browser', '0027_text_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sentence_index, drop_sentence_index),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('browser', '0028_sentence_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='status',
+            name='cancel',
+            field=models.BooleanField(default=False, verbose_name='Cancel requested'),
+        ),
+    ]
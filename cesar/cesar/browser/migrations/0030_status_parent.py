@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('browser', '0029_status_cancel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='status',
+            name='key',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Job key'),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='browser.Status'),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='saved',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='status',
+            constraint=models.UniqueConstraint(condition=models.Q(models.Q(_negated=True, key=''), models.Q(_negated=True, status__in=['done', 'error', 'cancelled'])), fields=('key',), name='status_running_key'),
+        ),
+    ]
@@ -4,17 +4,21 @@ The browser allows browsing through XML files that are part of a corpus.
 A corpus is in a particular language and according to a particular tagset.
 The information here mirrors (and extends) the information in the crp-info.json file.
 """
-from django.db import models, transaction
+from django.db import models, transaction, connection, IntegrityError
 from django.contrib.auth.models import User
 from django.db.models import Q
 from django.db.models.functions import Lower
-from datetime import datetime
+from django.utils.html import escape
+from django.utils import timezone
+from datetime import datetime, timedelta
 from cesar.utils import *
 from cesar.browser.services import *
-from cesar.settings import APP_PREFIX
+from cesar.settings import APP_PREFIX, SENTENCE_WARMUP_WORKERS, SYNC_WORKERS
 import sys
 import copy
 import json
+import re
+from concurrent.futures import wait, FIRST_COMPLETED
 
 MAX_IDENTIFIER_LEN = 10
 MAX_TEXT_LEN = 200
@@ -27,6 +31,18 @@ VARIABLE_TYPE = "variable.type"
 VARIABLE_LOC = "variable.loc"
 LANGUAGE = "language"
 
+# Full-text index (SQLite FTS5, trigram tokenizer) over the metadata of the texts
+TEXT_INDEX_TABLE = "browser_text_fts"
+TEXT_INDEX_FIELDS = ['fileName', 'genre', 'date', 'title', 'author', 'subtype']
+TEXT_INDEX_MINLEN = 3       # Trigrams: shorter literal parts cannot be looked up
+# Full-text index (SQLite FTS5, word tokens) over the cached sentences
+SENTENCE_INDEX_TABLE = "browser_sentence_fts"
+SENTENCE_SEARCH_LIMIT = 500 # Maximum number of sentences a search returns
+# Status values of a synchronisation that is no longer running
+SYNC_FINISHED = ['done', 'error', 'cancelled']
+SYNC_HEARTBEAT = 60         # Seconds between two signs of life of a running synchronisation
+SYNC_STALE = 900            # Seconds without any sign of life after which a synchronisation counts as dead
+
 # ============================= LOCAL CLASSES ======================================
 errHandle = ErrHandle()
 
@@ -287,6 +303,20 @@ class Status(models.Model):
     user = models.CharField("User", max_length=255, default="")
     # [0-1] Error message (if any)
     msg = models.TextField("Error message", blank=True, null=True)
+    # [1] The user asked to stop this (background) process
+    cancel = models.BooleanField("Cancel requested", default=False)
+    # [0-1] What is being synchronised (e.g. "texts:<part>:<format>"): only one unfinished job per key
+    key = models.CharField("Job key", max_length=255, blank=True, default="")
+    # [0-1] The job this one is part of: only the parent reaches a final state for the whole job
+    parent = models.ForeignKey("self", blank=True, null=True, on_delete=models.CASCADE, related_name="children")
+    # [0-1] The last time the process showed a sign of life
+    saved = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key'], name='status_running_key',
+                                    condition=~Q(key="") & ~Q(status__in=SYNC_FINISHED))
+            ]
 
     def __str__(self):
         # Refresh the DB connection
@@ -294,13 +324,67 @@ class Status(models.Model):
         # Only now provide the status
         return self.status
 
+    def save(self, force_insert = False, force_update = False, using = None, update_fields = None):
+        # Adapt the save date: it shows that the process is alive
+        self.saved = timezone.now()
+        if update_fields != None:
+            update_fields = list(update_fields) + ['saved']
+        return super(Status, self).save(force_insert, force_update, using, update_fields)
+
     def set(self, sStatus, oCount = None, msg = None):
         self.status = sStatus
         if oCount != None:
             self.count = json.dumps(oCount)
         if msg != None:
             self.msg = msg
-        self.save()
+        if self.id == None:
+            self.save()
+        else:
+            # Never overwrite a cancel request that has been made in the meantime
+            self.save(update_fields=['status', 'count', 'msg'])
+
+    def heartbeat(self):
+        """Show that the process is alive while it waits (at most once every SYNC_HEARTBEAT seconds)"""
+
+        now = timezone.now()
+        if self.id != None and (self.saved == None or (now - self.saved).total_seconds() >= SYNC_HEARTBEAT):
+            self.saved = now
+            Status.objects.filter(id=self.id).update(saved=now)
+
+    def cancelled(self):
+        """Has the user asked to stop the process that reports to this status?"""
+        if self.id == None:
+            return False
+        # Stopping the parent job stops all of its children
+        return Status.objects.filter(Q(id=self.id) | Q(id=self.parent_id), cancel=True).exists()
+
+    def is_running(self):
+        return not self.status in SYNC_FINISHED
+
+    def is_stale(self):
+        """Is this process still unfinished, but without any sign of life for SYNC_STALE seconds?"""
+        return self.is_running() and (self.saved == None or 
+                                      (timezone.now() - self.saved).total_seconds() > SYNC_STALE)
+
+    def get_stale(qs = None):
+        """The unfinished processes (in [qs]) that are no longer alive, e.g. because the server was restarted"""
+
+        if qs == None:
+            qs = Status.objects.all()
+        threshold = timezone.now() - timedelta(seconds=SYNC_STALE)
+        return qs.exclude(status__in=SYNC_FINISHED).filter(Q(saved__isnull=True) | Q(saved__lt=threshold))
+
+    def release_stale(qs = None, sStatus = "error"):
+        """Finish the processes (in [qs]) that are no longer alive, so that their job keys are free again"""
+
+        msg = "No sign of life for {} seconds: the job no longer runs".format(SYNC_STALE)
+        lId = list(Status.get_stale(qs).values_list('id', flat=True))
+        if len(lId) == 0:
+            return 0
+        # The parts of a job that is no longer running do not run either
+        Status.objects.filter(parent__in=lId).exclude(status__in=SYNC_FINISHED).update(
+            status=sStatus, msg=msg, saved=timezone.now())
+        return Status.objects.filter(id__in=lId).update(status=sStatus, msg=msg, saved=timezone.now())
 
 def chunks(l, n):
     """Yield successive n-sized chunks from l."""
@@ -350,10 +434,22 @@ def sort_texts_from_txtlist(oTxtList):
 
 
 def process_textlist(oTxtlist, part, sFormat, oStatus, options):
-    """Update our own models with the information in [oCorpusInfo]"""
+    """Update our own models with the information in [oTxtlist]
+
+    The texts of this part/format are synchronised with the list in one go: the existing texts
+    are read with one query, and the sets of new, changed and missing texts are determined in
+    memory. These are written with bulk_create, bulk_update and set-based deletes.
+
+    Options:
+        nodeleting      - keep texts that are no longer in [oTxtlist]
+        updating        - only update existing texts (nothing is added or deleted)
+        update_field    - with [updating]: the one field to be updated (e.g. 'words')
+    """
 
     oBack = {}      # What we return
     lOblig = ['name', 'size', 'words', 'title', 'date', 'author', 'genre', 'subtype']
+    # The fields that are compared (and updated)
+    lField = ['title', 'lines', 'words', 'date', 'author', 'genre', 'subtype']
     bNoDeleting = False
     bUpdating = False
     sUpdateField = ""
@@ -361,6 +457,8 @@ def process_textlist(oTxtlist, part, sFormat, oStatus, options):
     # Get the value for format
     format_choice = choice_value(CORPUS_FORMAT, sFormat)
 
+    if not isinstance(options, dict):
+        options = {}
     if 'nodeleting' in options:
         bNoDeleting = options['nodeleting']
     if 'updating' in options:
@@ -374,6 +472,9 @@ def process_textlist(oTxtlist, part, sFormat, oStatus, options):
                 return False
         return True
 
+    def get_str(value):
+        return None if value == None else str(value)
+
     try:
         # Debugging
         errHandle.Status("Process_textlist nodeleting={} updating={} update_field={}".format(bNoDeleting, bUpdating, sUpdateField))
@@ -397,208 +498,96 @@ def process_textlist(oTxtlist, part, sFormat, oStatus, options):
         # Initialise what we return
         oBack = {'result': False, 'parts': 0, 
                  'paths': oTxtlist['paths'],
-                 'total': oTxtlist['count']}
+                 'total': oTxtlist['count'],
+                 'language': part.corpus.get_lng_display(),
+                 'part': part.name,
+                 'format': sFormat,
+                 'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'skipped': 0}
+        oStatus.set("comparing", oBack)
+
+        # What /crpp has: {fileName: {field: value}}
+        oCrpp = {}
+        for oPath in oTxtlist['txtlist']:
+            for oText in oPath['list']:
+                # Validate
+                if has_oblig_fields(oText):
+                    try:
+                        # Use the types of the model fields, so that the comparison is fair
+                        oCrpp[oText['name']] = dict(title=get_str(oText['title']), lines=int(oText['size']), 
+                                                    words=int(oText['words']), date=get_str(oText['date']), 
+                                                    author=get_str(oText['author']), genre=get_str(lGenre[oText['genre']]), 
+                                                    subtype=get_str(lSubtype[oText['subtype']]))
+                    except (IndexError, TypeError, ValueError):
+                        oBack['skipped'] += 1
+                        oBack['note'] = "Unknown genre or subtype in {} [{}]".format(oText['name'], sFormat)
+                else:
+                    # Not all fields were there in the [oText] we encountered
+                    oBack['skipped'] += 1
+                    oBack['note'] = "Did not find all obl fields in {} [{}]".format(oText.get('name', ''), sFormat)
+
+        # What we have: {fileName: Text}, plus any duplicates
+        oExisting = {}
+        lDuplicate = []
+        for text in Text.objects.filter(part=part, format=format_choice).only('id', 'fileName', *lField).order_by('id'):
+            if text.fileName in oExisting:
+                lDuplicate.append(text.id)
+            else:
+                oExisting[text.fileName] = text
 
-        # Prepare 
-        qs_texts = Text.objects.filter(format=format_choice,part=part).order_by(Lower('fileName'))
-        if qs_texts.count() == 0:
+        # Without existing texts, only updating makes no sense
+        if len(oExisting) == 0:
             bUpdating = False
-
-        if bUpdating :
-            # ================= ONLY UPDATE EXISTING ================
-            oBack['language'] =  part.corpus.get_lng_display()
-            oBack['format']   = sFormat
-            oStatus.set("bulk update", oBack)
-
-            # Look for the texts that need to be visited
-            qs_iter = qs_texts.iterator()
-
-            # Sort the texts in oTxtList in an array
-            arList = sort_texts_from_txtlist(oTxtlist)
-            idx_list = 0
-
-            # Establish the chunk parameters
-            iChunk = 0
-            iChunkSize = 100
-            iChunkLen = qs_texts.count() // iChunkSize + 1
-            iNum = 0
-
-            # Iterate through the Text instances
-            text = next(qs_iter)
-            for chunk_this in range(iChunkLen):
-                iChunk += 1
-                # Walk this chunk
-                sChunkMsg = "process_textlist u {} (of {})".format(iChunk, iChunkLen)
-                oBack['chunk'] = sChunkMsg
-
-                # ====== DEBUG ========
-                # Log what we are doing in the output
-                errHandle.Status(sChunkMsg)
-                # =====================
-
-                # Show what is going on
-                oStatus.set("updating", oBack)
-                with transaction.atomic():
-                    for idx in range(iChunkSize):
-                        if text != None:
-                            # Find this text in [oTxtlist]
-                            oText, idx_list = get_text_from_txtlist(arList, text.fileName, idx_list)
-                            if oText == None:
-                                oStatus.set("error")
-                                errHandle.DoError("Cannot find text ["+text.fileName+"]")
-                                return oBack
-                            else:
-                                if sUpdateField == "":
-                                    # No idea what to do now
-                                    pass
-                                elif sUpdateField == "words" and text.words == 0:
-                                    text.words = oText['words']
-                                    text.save()
-                                    oBack['file'] = text.fileName
-                                    iNum += 1
-                                    oBack['updated'] = iNum
-
-                            # Get to the next text
-                            try:
-                                text = next(qs_iter)
-                            except StopIteration as e:
-                                break
-                # Show what is going on
+        if bUpdating and sUpdateField != "":
+            lField = [sUpdateField]
+
+        # Determine the sets
+        lInsert = []
+        lUpdate = []
+        # The updated texts whose content has changed: the sentences that were fetched of them are outdated
+        lOutdated = []
+        for sName, oValues in oCrpp.items():
+            text = oExisting.get(sName)
+            if text == None:
+                if not bUpdating:
+                    lInsert.append(Text(fileName=sName, format=format_choice, part=part, **oValues))
+            else:
+                bChanged = False
+                bContent = False
+                for sField in lField:
+                    if getattr(text, sField) != oValues[sField]:
+                        setattr(text, sField, oValues[sField])
+                        bChanged = True
+                        bContent = bContent or sField in ['lines', 'words']
+                if bChanged:
+                    lUpdate.append(text)
+                else:
+                    oBack['unchanged'] += 1
+                if bContent:
+                    lOutdated.append(text.id)
+        lDelete = []
+        if not bUpdating and not bNoDeleting:
+            lDelete = [text.id for sName, text in oExisting.items() if not sName in oCrpp] + lDuplicate
+
+        # Apply them
+        with transaction.atomic():
+            if len(lInsert) > 0:
+                oStatus.set("adding", oBack)
+                Text.objects.bulk_create(lInsert)
+                oBack['inserted'] = len(lInsert)
+            if len(lUpdate) > 0:
                 oStatus.set("updating", oBack)
-
-            sChunkMsg = "process_textlist updated the wordcounts of {} texts".format(iNum)
-            errHandle.Status(sChunkMsg)
-        else:
-            
-            # Walk all the different paths
-            for oPath in oTxtlist['txtlist']:
-                # Process this patth
-                sPath = oPath['path']
-                iPathCount = oPath['count']
-                arList = oPath['list']
-
-                # Debugging
-                errHandle.Status("Process_textlist path={} ".format(sPath))
-
-                # Remove all texts adhering to the specifications
-                lstText = []
-                oBack['part'] = part.name
-                oBack['format'] = sFormat
+                Text.objects.bulk_update(lUpdate, lField)
+                oBack['updated'] = len(lUpdate)
+                # They are fetched again when needed (see Text.get_sentences)
+                for chunk_this in chunks(lOutdated, 500):
+                    Sentence.objects.filter(text__id__in=chunk_this).delete()
+            if len(lDelete) > 0:
                 oStatus.set("deleting", oBack)
-                # Do the deleting in chunks of 100
-                lenArList = len(arList)
-                # chunk_arList = chunks(arList, 100)
-
-                # ================ DELETE OLD STUFF =========================
-                if not bNoDeleting:
-                    for chunk_this in chunks(arList, 100):
-
-                        with transaction.atomic():
-                            for oText in chunk_this:
-
-                                # Debugging
-                                errHandle.Status("Process_textlist deleting step #1 {}".format(oText['name']))
-
-                                # Validate
-                                if has_oblig_fields(oText):
-                                    # check if it is in [Text] already
-                                    lMatches = Text.objects.filter(fileName=oText['name'], format=format_choice,
-                                                    part=part, title=oText['title'], lines=oText['size'],
-                                                    words=oText['words'], date=oText['date'], author=oText['author'],
-                                                    genre=lGenre[oText['genre']], subtype=lSubtype[oText['subtype']])
-                                    oBack['file'] = oText['name']
-                                    # Walk through all results
-                                    for oMatch in lMatches:
-                                        # Debugging
-                                        errHandle.Status("Process_textlist deleting step #2 {} Text.id={}".format(oText['name'], oMatch.id))
-
-                                        # Delete this result (this also includes deleting the related [Sentence] entry)
-                                        oMatch.delete()
-                        # Show what is happening
-                        oStatus.set("deleting", oBack)
-
-                if bUpdating:
-                    # ================= ONLY UPDATE EXISTING ================
-                    oBack['language'] =  part.corpus.get_lng_display()
-                    oBack['part'] =  "{}: {}".format(part.dir, sPath)
-                    oBack['format'] = sFormat
-                    oStatus.set("bulk update", oBack)
-                    iChunk = 0
-                    iChunkLen = len(arList) // 100 + 1
-                    for chunk_this in chunks(arList, 100):
-                        iChunk += 1
-                        oBack['chunk'] = "{} (of {})".format(iChunk, iChunkLen)
-                        with transaction.atomic():
-                            for oText in chunk_this:
-                                # Validate
-                                if has_oblig_fields(oText):
-                                    # Find the instance to be updated
-                                    instance = Text.objects.filter(fileName=oText['name'], format=format_choice,part=part).first()
-                                    if instance == None:
-                                        oStatus.set("error")
-                                        errHandle.DoError("Cannot find text ["+oText['name']+"]")
-                                        return oBack
-                                    else:
-                                        if sUpdateField == "":
-                                            # No idea what to do now
-                                            pass
-                                        elif sUpdateField == "words":
-                                            instance.words = oText['words']
-                                            instance.save()
-                                            oBack['file'] = oText['name']
-                                else:
-                                    # Not all fields were there in the [oText] we encountered
-                                    oBack['note'] = "Did not find all obl fields in {} [{}]".format(oText['name'], sFormat)
-                                    oStatus.set("error", oBack)
-                        # Show what is going on
-                        oStatus.set("updating", oBack)
-                    # We are ready with this part
-                    oBack['parts'] += 1
-                    oBack['paths'] += 1
-
-                else:
-                    # ================= BULK CREATE NEW =====================
-                    # Keep the transactions together in a bulk edit
-                    lstText = []
-                    oBack['language'] =  part.corpus.get_lng_display()
-                    oBack['part'] =  "{}: {}".format(part.dir, sPath)
-                    oBack['format'] = sFormat
-                    oStatus.set("bulk add", oBack)
-                    iChunk = 0
-                    iChunkLen = len(arList) // 100
-                    for chunk_this in chunks(arList, 100):
-                        iChunk += 1
-                        oBack['chunk'] = "{} (of {})".format(iChunk, iChunkLen)
-                        with transaction.atomic():
-                            for oText in chunk_this:
-                                # Validate
-                                if has_oblig_fields(oText):
-                                    # if 'name' in oText and 'size' in oText and 'title' in oText and 'date' in oText and 'author' in oText and 'genre' in oText and 'subtype' in oText:
-                                    try:
-                                        oNew = Text(fileName=oText['name'], format=format_choice,
-                                                    part=part, title=oText['title'], lines=oText['size'],
-                                                    words=oText['words'], date=oText['date'], author=oText['author'],
-                                                    genre=lGenre[oText['genre']], subtype=lSubtype[oText['subtype']])
-                                    except:
-                                        oStatus.set("error")
-                                        errHandle.DoError("process_textlist [new]", True)
-                                        return oBack
-                                    oBack['file'] = oText['name']
-                                    # Now add the object to the list of objects
-                                    lstText.append(oNew)
-                                else:
-                                    # Not all fields were there in the [oText] we encountered
-                                    oBack['note'] = "Did not find all obl fields in {} [{}]".format(oText['name'], sFormat)
-                                    oStatus.set("error", oBack)
-
-                        # Show what is going on
-                        oStatus.set("adding", oBack)
-
-                    # We are ready with this part
-                    oBack['parts'] += 1
-                    # Save what we have so far
-                    Text.objects.bulk_create(lstText)
-                    oBack['paths'] += 1
+                # This also deletes the sentences of these texts (in chunks that stay below the SQL parameter limit)
+                for chunk_this in chunks(lDelete, 500):
+                    Text.objects.filter(id__in=chunk_this).delete()
+                oBack['deleted'] = len(lDelete)
+        oBack['parts'] += 1
 
         # We are done!
         oStatus.set("part", oBack)
@@ -845,6 +834,180 @@ def process_corpusinfo(oStatus, oCorpusInfo):
         errHandle.DoError("process_corpusinfo", True)
         return oBack
 
+def sync_corpora(status_id):
+    """Background job: synchronise the corpora and meta variables with /crpp/serverinfo"""
+
+    oErr = ErrHandle()
+    oStatus = Status.objects.filter(id=status_id).first()
+    if oStatus == None:
+        return None
+    try:
+        oStatus.set("contacting", msg="Obtaining data from /crpp")
+        crpp_info = get_crpp_info()
+        if oStatus.cancelled():
+            oStatus.set("cancelled", msg="Stopped on request")
+            return None
+
+        # Update the models with the new information: this sets the status to 'done' itself
+        oStatus.set("loading")
+        return process_corpusinfo(oStatus, crpp_info)
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("sync_corpora")
+        oStatus.set("error", msg=msg)
+        return None
+
+def sync_part_texts(oStatus, part, sFormat, options):
+    """Get the /crpp/txtlist of one part/format combination and bring the Text objects in line with it
+    
+    Returns the result of process_textlist(), or an object with 'result' False.
+    """
+
+    sLng = choice_english(CORPUS_LANGUAGE, part.corpus.lng)
+    sFormat = choice_english(CORPUS_FORMAT, sFormat)
+    oStatus.set("contacting", msg="Obtaining data from /crpp")
+
+    # Get the data from the CRPP api: this waits for the /crpp job to finish
+    crpp_texts = get_crpp_texts(sLng, part.dir, sFormat, oStatus)
+    if 'status' in crpp_texts and crpp_texts['status'] == 'error' and not 'cancelled' in crpp_texts:
+        return {'result': False, 'part': part.name, 'format': sFormat, 'msg': json.dumps(crpp_texts)}
+    if oStatus.cancelled():
+        return {'result': False, 'part': part.name, 'format': sFormat, 'cancelled': True}
+
+    # Update the models with the /crpp/txtlist information
+    oStatus.set("loading", msg="Updating the existing models with this new information")
+    oResult = process_textlist(crpp_texts, part, sFormat, oStatus, options)
+    # The sentence information that was kept for this part may be outdated now
+    sentinfo_cache.clear_part(sLng, part.dir)
+    if oResult == None or not 'total' in oResult:
+        oResult = {'result': False, 'part': part.name, 'format': sFormat}
+    return oResult
+
+def sync_texts(status_id, part_id, sFormat, options):
+    """Background job: synchronise the texts of one part/format combination with /crpp"""
+
+    oErr = ErrHandle()
+    oStatus = Status.objects.filter(id=status_id).first()
+    if oStatus == None:
+        return None
+    try:
+        part = Part.objects.filter(id=part_id).first()
+        if part == None:
+            oStatus.set("error", msg="Cannot find [part] information")
+            return None
+        oResult = sync_part_texts(oStatus, part, sFormat, options)
+        if oResult.get('cancelled', False):
+            oStatus.set("cancelled", oResult, msg="Stopped on request")
+        elif oResult['result'] == False:
+            oStatus.set("error", oResult, msg=oResult.get('msg'))
+        else:
+            # Completely ready
+            oStatus.set("done", oResult)
+        return oResult
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("sync_texts")
+        oStatus.set("error", msg=msg)
+        return None
+
+def get_texts_key(part_id, sFormat):
+    """The job key of synchronising the texts of one part/format combination"""
+    return "texts:{}:{}".format(part_id, sFormat)
+
+def sync_part_job(status_id, part_id, sFormat, options):
+    """Part of [sync_alltexts]: one part/format combination, reporting to its own child status object"""
+
+    oStatus = Status.objects.filter(id=status_id).first()
+    if oStatus == None or not oStatus.is_running():
+        # E.g. released while it was waiting (see Status.release_stale)
+        return None
+    if oStatus.cancelled():
+        oStatus.set("cancelled", msg="Stopped on request")
+        return {'result': False, 'cancelled': True}
+    return sync_texts(oStatus.id, part_id, sFormat, options)
+
+def sync_alltexts(status_id, lFormat, iWorkers = None):
+    """Background job: delete all texts and get them again for all parts and formats
+    
+    At most [iWorkers] part/format combinations are synchronised at the same time.
+    """
+
+    oErr = ErrHandle()
+    if iWorkers == None:
+        iWorkers = SYNC_WORKERS
+    oStatus = Status.objects.filter(id=status_id).first()
+    if oStatus == None:
+        return None
+    oBack = dict(parts=0, failed=0, alltexts=0, errors=[])
+    try:
+        # ================ IMPORTANT ===========================
+        # Delete everything that is already there
+        oStatus.set("deleting")
+        Text.objects.all().delete()
+
+        # Only now do we start in full
+        oStatus.set("continuing")
+        options = {'nodeleting': True, 'updating': False}
+        # Each part/format combination reports to a child status object of its own
+        oChild = {}
+        for part in Part.objects.all():
+            for sFormat in lFormat:
+                sFormat = choice_value(CORPUS_FORMAT, sFormat)
+                sLabel = "{}/{}".format(part.name, choice_english(CORPUS_FORMAT, sFormat))
+                child = Status(user=oStatus.user, type="{}_part".format(oStatus.type), status="queued", 
+                               key=get_texts_key(part.id, sFormat), parent=oStatus)
+                try:
+                    with transaction.atomic():
+                        child.save()
+                except IntegrityError:
+                    # Another job is synchronising this combination right now
+                    oBack['failed'] += 1
+                    oBack['errors'].append("{}: already being synchronised".format(sLabel))
+                    continue
+                future = run_in_background("sync_part", sync_part_job, child.id, part.id, sFormat, options, iWorkers=iWorkers)
+                oChild[future] = (child, sLabel)
+        lFuture = set(oChild.keys())
+        while len(lFuture) > 0:
+            done, lFuture = wait(lFuture, timeout=SYNC_HEARTBEAT, return_when=FIRST_COMPLETED)
+            # The parent and the combinations that are still waiting in the queue show they are alive
+            oStatus.heartbeat()
+            oStatus.children.filter(status="queued").update(saved=timezone.now())
+            for future in done:
+                if future.cancelled():
+                    continue
+                oResult = future.result()
+                if oStatus.cancelled():
+                    # Combinations that have not started yet are not started anymore
+                    for future_this in lFuture:
+                        future_this.cancel()
+                elif oResult == None or oResult['result'] == False:
+                    # The child status object has the details
+                    child, sLabel = oChild[future]
+                    child.refresh_from_db()
+                    oBack['failed'] += 1
+                    oBack['errors'].append("{}: {}".format(sLabel, child.msg))
+                    oStatus.set("okay", oBack)
+                else:
+                    oBack['parts'] += 1
+                    oBack['alltexts'] += oResult['total']
+                    oBack.update({k: oResult[k] for k in ['lng', 'part', 'format'] if k in oResult})
+                    oStatus.set("okay", oBack)
+        # Combinations that never started are finished as well
+        oStatus.children.exclude(status__in=SYNC_FINISHED).update(status="cancelled")
+        # Completely ready: only the parent reports the final state of the whole job
+        if oStatus.cancelled():
+            oStatus.set("cancelled", oBack, msg="Stopped on request")
+        elif oBack['failed'] > 0:
+            oStatus.set("error", oBack, msg="{} part/format combination(s) failed".format(oBack['failed']))
+        else:
+            oStatus.set("done", oBack)
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("sync_alltexts")
+        oStatus.children.exclude(status__in=SYNC_FINISHED).update(cancel=True)
+        oStatus.set("error", oBack, msg=msg)
+    return oBack
+
 
 class HelpChoice(models.Model):
     """Define the URL to link to for the help-text"""
@@ -1156,6 +1319,24 @@ class Download(models.Model):
         return "{}_{}".format(self.part.name, choice_english(CORPUS_FORMAT, self.format))
 
 
+# Which full-text indexes exist: {table: True/False}
+fts_index_state = {}
+
+def fts_index_exists(sTable):
+    """Check (once per process) whether the full-text index [sTable] has been created by the migrations"""
+
+    if not sTable in fts_index_state:
+        bExists = False
+        try:
+            if connection.vendor == "sqlite":
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=%s", [sTable])
+                    bExists = (cursor.fetchone() != None)
+        except:
+            bExists = False
+        fts_index_state[sTable] = bExists
+    return fts_index_state[sTable]
+
 class Text(models.Model):
     """One text that belongs to a Part of a Corpus"""
 
@@ -1228,6 +1409,39 @@ class Text(models.Model):
         #sName = sName.replace(".psdx", "")
         return sName
 
+    def index_exists():
+        """Check (once) whether the full-text index over the text metadata is available"""
+        return fts_index_exists(TEXT_INDEX_TABLE)
+
+    def index_terms(sPattern):
+        """Get the literal parts of wildcard pattern [sPattern] that can be looked up in the index"""
+
+        lTerm = []
+        for sPart in re.split(r"\*|\?|\[[^\]]*\]", sPattern.strip()):
+            if len(sPart) >= TEXT_INDEX_MINLEN:
+                lTerm.append(sPart)
+        return lTerm
+
+    def index_filter(qs, oSearch):
+        """Restrict [qs] to the texts that the index finds for the wildcard patterns in [oSearch]
+
+        [oSearch] is an object {field: pattern}. The index only narrows the selection down
+        (it looks for the literal parts of the patterns), so the exact wildcard matching 
+        must still be done on [qs]. If the index cannot help, [qs] is returned as it is.
+        """
+
+        if not Text.index_exists():
+            return qs
+        lMatch = []
+        for sField, sPattern in oSearch.items():
+            if sField in TEXT_INDEX_FIELDS:
+                for sTerm in Text.index_terms(sPattern):
+                    lMatch.append('{} : "{}"'.format(sField, sTerm.replace('"', '""')))
+        if len(lMatch) == 0:
+            return qs
+        sWhere = '"browser_text"."id" IN (SELECT rowid FROM {0} WHERE {0} MATCH %s)'.format(TEXT_INDEX_TABLE)
+        return qs.extra(where=[sWhere], params=[" AND ".join(lMatch)])
+
     def find_text(part, format, sName):
         """Find the text [sName] within the part/format combination"""
         sName = Text.strip_ext(sName)
@@ -1238,13 +1452,22 @@ class Text(models.Model):
         qs = Text.objects.filter(part=part, format=format).order_by('fileName')
         return qs
 
+    def get_text_index(part, format):
+        """Provide a dictionary {fileName: (id, lines, words, genre, subtype)} of all texts in this part/format combination"""
+
+        qs = Text.objects.filter(part=part, format=format).values_list('fileName', 'id', 'lines', 'words', 'genre', 'subtype')
+        oIndex = {}
+        for sName, iId, iLines, iWords, sGenre, sSubtype in qs:
+            oIndex[sName] = (iId, iLines, iWords, sGenre, sSubtype)
+        return oIndex
+
     def get_sentences(self):
         """Get the sentences belonging to this text"""
 
         # Initialize return object
         oBack = {'status': 'ok'}
         # Check if they have been fetched
-        if self.sentences.count() == 0:
+        if not self.sentences.exists():
             # Need to fetch them
             oBack = get_crpp_text(self.part.corpus.get_lng_display(), 
                                   self.part.dir, 
@@ -1253,20 +1476,9 @@ class Text(models.Model):
             # Validate what we receive
             if oBack == None or oBack['status'] == 'error':
                 return oBack
-            # Process what we received into [Sentence] objects
-            lstSent = []
-            iOrder = 1
-            with transaction.atomic():
-                for oSent in oBack['line']:
-                    # Create a new Sentence object
-                    oNew = Sentence(identifier=oSent['id'],
-                                    order=iOrder,
-                                    sent=oSent['text'],
-                                    text=self)
-                    lstSent.append(oNew)
-                    iOrder += 1
-            # Save what we have so far
-            Sentence.objects.bulk_create(lstSent)
+            # Process what we received into [Sentence] objects and save them,
+            # unless warmup_sentences() or another request has stored them in the meantime
+            warmup_store(Sentence.from_lines(self.id, oBack['line']), [self.id])
         # At this point we HAVE all the sentences, so we only need to return the lot together
         # But this needs to be in a QUERYSET
         qs = Sentence.objects.filter(text__id=self.id).distinct().select_related().order_by('order')
@@ -1303,3 +1515,191 @@ class Sentence(models.Model):
 
     def get_fileName(self):
         return self.text.fileName
+
+    def from_lines(text_id, lLine):
+        """Create (unsaved) Sentence objects for the lines [{id, text}] that /crpp/txt returns for a text"""
+        return [Sentence(identifier=oSent['id'], order=iOrder, sent=oSent['text'], text_id=text_id) 
+                for iOrder, oSent in enumerate(lLine, 1)]
+
+    def index_words(sQuery):
+        """Get the words of [sQuery]; a word may end with '*' to look for a prefix"""
+        return re.findall(r"[^\s\"*]+\*?", sQuery)
+
+    def index_query(sQuery):
+        """Turn the words in [sQuery] into an FTS5 query: all words must occur, 'word*' looks for a prefix"""
+
+        lTerm = []
+        for sWord in Sentence.index_words(sQuery):
+            if sWord.endswith("*"):
+                lTerm.append('"{}" *'.format(sWord[:-1]))
+            else:
+                lTerm.append('"{}"'.format(sWord))
+        return " AND ".join(lTerm)
+
+    def search(sQuery, part=None, format=None, limit=100):
+        """Find the cached sentences containing all the words in [sQuery], best matches first
+
+        Returns a list of hits {id, identifier, order, snippet, rank, text, fileName, part, partname},
+        where [snippet] is HTML with the matching words in bold. Without the full-text index
+        the sentences are searched with icontains, and they all get rank 0.
+        """
+
+        lHit = []
+        limit = max(1, min(int(limit), SENTENCE_SEARCH_LIMIT))
+        sMatch = Sentence.index_query(sQuery)
+        if sMatch == "":
+            return lHit
+        lWhere = []
+        lParam = []
+        if part != None and part != "":
+            lWhere.append("t.part_id = %s")
+            lParam.append(part)
+        if format != None and format != "":
+            lWhere.append("t.format = %s")
+            lParam.append(format)
+        if fts_index_exists(SENTENCE_INDEX_TABLE):
+            # Mark the hits with control characters, so that the sentence itself can be escaped
+            sSql = """SELECT s.id, s.identifier, s."order", 
+                             snippet({0}, 0, char(2), char(3), '...', 16), bm25({0}),
+                             t.id, t."fileName", p.id, p.name
+                      FROM {0} f JOIN browser_sentence s ON s.id = f.rowid
+                           JOIN browser_text t ON t.id = s.text_id
+                           JOIN browser_part p ON p.id = t.part_id
+                      WHERE {0} MATCH %s {1}
+                      ORDER BY bm25({0}) LIMIT %s""".format(
+                SENTENCE_INDEX_TABLE, "".join(" AND " + x for x in lWhere))
+            with connection.cursor() as cursor:
+                cursor.execute(sSql, [sMatch] + lParam + [limit])
+                lRow = cursor.fetchall()
+        else:
+            lstQ = [Q(sent__icontains=x.rstrip("*")) for x in Sentence.index_words(sQuery)]
+            if part != None and part != "":
+                lstQ.append(Q(text__part=part))
+            if format != None and format != "":
+                lstQ.append(Q(text__format=format))
+            qs = Sentence.objects.filter(*lstQ).order_by('text__part__name', 'text__fileName', 'order')
+            lRow = [(x[0], x[1], x[2], x[3], 0.0, x[4], x[5], x[6], x[7]) for x in qs.values_list(
+                'id', 'identifier', 'order', 'sent', 'text__id', 'text__fileName', 'text__part__id', 
+                'text__part__name')[:limit]]
+        for iId, sIdentifier, iOrder, sSnippet, fRank, iText, sFileName, iPart, sPartName in lRow:
+            sSnippet = escape(sSnippet).replace("\x02", "<b>").replace("\x03", "</b>")
+            lHit.append(dict(id=iId, identifier=sIdentifier, order=iOrder, snippet=sSnippet, 
+                             rank=round(fRank, 4), text=iText, fileName=sFileName, 
+                             part=iPart, partname=sPartName))
+        return lHit
+
+    def search_grouped(sQuery, part=None, format=None, limit=100):
+        """Search like Sentence.search(), with the hits grouped by part and then by text
+
+        Parts and texts come in the order of their best hit.
+        """
+
+        lPart = []
+        oPart = {}
+        oText = {}
+        for oHit in Sentence.search(sQuery, part, format, limit):
+            if not oHit['part'] in oPart:
+                oPart[oHit['part']] = dict(part=oHit['part'], name=oHit['partname'], texts=[])
+                lPart.append(oPart[oHit['part']])
+            if not oHit['text'] in oText:
+                oText[oHit['text']] = dict(text=oHit['text'], fileName=oHit['fileName'], hits=[])
+                oPart[oHit['part']]['texts'].append(oText[oHit['text']])
+            oText[oHit['text']]['hits'].append({x: oHit[x] for x in ['id', 'identifier', 'order', 'snippet', 'rank']})
+        return lPart
+
+
+def warmup_sentences(lCombi, status_id, iWorkers = None):
+    """Background job: cache the sentences of all texts that do not have them yet
+
+    [lCombi] is a list of (part id, format) combinations. At most [iWorkers] /crpp/txt requests
+    run at the same time. The sentences are written in bulk, and the progress is kept in the 
+    Status object [status_id]. Texts that already have sentences are skipped, so a job that has
+    been interrupted can simply be started again.
+    """
+
+    oErr = ErrHandle()
+    if iWorkers == None:
+        iWorkers = SENTENCE_WARMUP_WORKERS
+    oStatus = Status.objects.filter(id=status_id).first()
+    if oStatus == None:
+        return None
+    oCount = dict(part="", format="", total=0, cached=0, fetched=0, failed=0, sentences=0)
+    bCancel = False
+    try:
+        for part_id, format in lCombi:
+            part = Part.objects.filter(id=part_id).first()
+            if part == None:
+                continue
+            oCount['part'] = part.name
+            oCount['format'] = choice_english(CORPUS_FORMAT, format)
+            sLng = part.corpus.get_lng_display()
+            qs = Text.objects.filter(part=part, format=format)
+            oCount['total'] += qs.count()
+            # Which texts still need their sentences?
+            cached = set(Sentence.objects.filter(text__part=part, text__format=format).values_list('text_id', flat=True).distinct())
+            lText = [(iId, sName) for iId, sName in qs.order_by('id').values_list('id', 'fileName') if not iId in cached]
+            oCount['cached'] += len(cached)
+            oStatus.set("fetching", oCount)
+
+            lSent = []
+            lTextId = []
+            pending = set()
+            idx = 0
+            while idx < len(lText) or len(pending) > 0:
+                # Once stopped, only the requests that are under way are finished
+                bCancel = bCancel or oStatus.cancelled()
+                # Keep the pool busy, but do not queue more than a few requests per worker
+                while idx < len(lText) and len(pending) < 2 * iWorkers and not bCancel:
+                    iId, sName = lText[idx]
+                    future = run_in_background("sentence_warmup", get_crpp_text, sLng, part.dir, oCount['format'], sName,
+                                               iWorkers=iWorkers)
+                    future.text_id = iId
+                    pending.add(future)
+                    idx += 1
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    oBack = future.result()
+                    if oBack == None or oBack['status'] == 'error':
+                        oCount['failed'] += 1
+                        if oBack != None and 'code' in oBack:
+                            oCount['error'] = str(oBack['code'])
+                    else:
+                        lSent.extend(Sentence.from_lines(future.text_id, oBack['line']))
+                        lTextId.append(future.text_id)
+                # Write a batch of sentences
+                bLast = (idx >= len(lText) or bCancel) and len(pending) == 0
+                if len(lSent) >= 5000 or bLast:
+                    warmup_store(lSent, lTextId, oCount)
+                    lSent = []
+                    lTextId = []
+                    oStatus.set("fetching", oCount)
+                if bLast:
+                    break
+            if bCancel:
+                # What has been fetched so far is kept: starting again continues from here
+                oStatus.set("cancelled", oCount, msg="Stopped on request")
+                return oCount
+        oStatus.set("done", oCount)
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("warmup_sentences")
+        oStatus.set("error", oCount, msg=msg)
+    return oCount
+
+def warmup_store(lSent, lTextId, oCount = None):
+    """Write the sentences of the texts [lTextId], except for texts that meanwhile got their sentences elsewhere
+    
+    The texts are locked (where the database supports that) while checking, so that two writers
+    cannot both conclude that a text has no sentences yet.
+    """
+
+    with transaction.atomic():
+        list(Text.objects.select_for_update().filter(id__in=lTextId).order_by('id').values_list('id', flat=True))
+        present = set(Sentence.objects.filter(text_id__in=lTextId).values_list('text_id', flat=True).distinct())
+        lNew = [x for x in lSent if not x.text_id in present]
+        Sentence.objects.bulk_create(lNew)
+    if oCount != None:
+        oCount['fetched'] += len(lTextId) - len(present)
+        oCount['cached'] += len(present)
+        oCount['sentences'] += len(lNew)
+    return len(lNew)
@@ -1,27 +1,206 @@
 import os
+import hashlib
 import json
+import random
 import requests
+import shutil
 import sys
 import time
 import threading
-from cesar.settings import CRPP_HOME
-from cesar.utils import ErrHandle
+import zlib
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from cesar.settings import CRPP_HOME, WRITABLE_DIR
+from cesar.utils import ErrHandle, LruCache
+
+# Timeouts (connect, read) in seconds for the /crpp commands
+CRPP_TIMEOUTS = {'default':  (5, 60),
+                 'dbget':    (5, 600),
+                 'txtlist':  (5, 300),
+                 'exe':      (5, 120),
+                 'crpset':   (5, 120)}
+# Commands that only read: they are sent again after a timeout or a broken connection.
+#   Other commands (e.g. crpset, exe, txtlist) start work at /crpp, and are only sent again when
+#   the connection could not be made at all. The (slow) dbget is not sent again after a timeout.
+CRPP_IDEMPOTENT = ['serverinfo', 'statusxq', 'statusxl', 'dbinfo', 'txt']
+# Cache of sentence information (e.g. syntax trees): items in memory, files on disk
+SENTINFO_CACHE_DIR = os.path.abspath(os.path.join(WRITABLE_DIR, "../sentinfo/"))
+SENTINFO_MEMORY_SIZE = 200
+SENTINFO_DISK_SIZE = 20000
 
 def get_exc_message():
     exc_type, exc_value = sys.exc_info()[:2]
     sMsg = "Handling {} exception with message '{}'".format(exc_type.__name__, exc_value)
     return sMsg
 
+def is_connect_error(e):
+    """Did the request fail before it could be sent (i.e. no connection could be made)?"""
+
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], 'reason', None) if len(e.args) > 0 else None
+    return isinstance(reason, NewConnectionError)
+
+class CrppClient():
+    """Shared HTTP client for all calls to the /crpp back-end
+
+    One requests.Session keeps a pool of keep-alive connections. Every command
+    gets its own timeout, failed requests are retried with a jittered delay 
+    (see CRPP_IDEMPOTENT), and the latency of each command is counted.
+    """
+
+    def __init__(self, home = CRPP_HOME, timeouts = None, retries = 2, pool_size = 10):
+        self.home = home
+        self.timeouts = CRPP_TIMEOUTS if timeouts == None else timeouts
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def get_timeout(self, sCommand):
+        return self.timeouts.get(sCommand, self.timeouts['default'])
+
+    def get(self, sCommand, oParams = None, **kwargs):
+        """GET /crpp/{sCommand}?{oParams}"""
+        url = self.home + '/' + sCommand
+        if oParams != None:
+            url += '?' + json.dumps(oParams)
+        return self.request(sCommand, "GET", url, **kwargs)
+
+    def post(self, sCommand, oData, **kwargs):
+        """POST the JSON object [oData] to /crpp/{sCommand}"""
+        url = self.home + '/' + sCommand
+        return self.request(sCommand, "POST", url, json=oData, **kwargs)
+
+    def request(self, sCommand, sMethod, url, **kwargs):
+        """Send the request; raises the last exception if the back-end cannot be reached"""
+
+        iAttempts = self.retries + 1
+        kwargs.setdefault('timeout', self.get_timeout(sCommand))
+        for iAttempt in range(iAttempts):
+            fStart = time.time()
+            try:
+                r = self.session.request(sMethod, url, **kwargs)
+                self.add_stat(sCommand, time.time() - fStart, r.status_code >= 500)
+                return r
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.add_stat(sCommand, time.time() - fStart, True)
+                if iAttempt + 1 >= iAttempts:
+                    raise
+                if not sCommand in CRPP_IDEMPOTENT and not is_connect_error(e):
+                    # The request may have reached /crpp: sending it again could start the work twice
+                    raise
+                # Wait a little before trying again (with jitter, so that parallel callers spread out)
+                time.sleep((0.2 * 2 ** iAttempt) * (0.5 + random.random()))
+
+    def add_stat(self, sCommand, fSeconds, bError):
+        with self.lock:
+            oStat = self.stats.get(sCommand)
+            if oStat == None:
+                oStat = dict(count=0, errors=0, total=0.0, max=0.0)
+                self.stats[sCommand] = oStat
+            oStat['count'] += 1
+            oStat['total'] += fSeconds
+            oStat['max'] = max(oStat['max'], fSeconds)
+            if bError:
+                oStat['errors'] += 1
+
+    def get_stats(self):
+        """Provide the latency counters per command (times in milliseconds)"""
+        oBack = {}
+        with self.lock:
+            for sCommand, oStat in self.stats.items():
+                oBack[sCommand] = dict(count=oStat['count'], 
+                                       errors=oStat['errors'],
+                                       avg_ms=round(1000 * oStat['total'] / oStat['count'], 1) if oStat['count'] > 0 else 0,
+                                       max_ms=round(1000 * oStat['max'], 1))
+        return oBack
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {}
+
+
+# The client that is shared by all /crpp calls
+crpp_client = CrppClient()
+
+
+class CrppPoller():
+    """Wait between two status requests to /crpp without keeping a CPU core busy
+
+    The waiting time follows the 'checkAgainMs' hint of the server if there is one,
+    otherwise it grows exponentially from [initial] up to [maximum] seconds.
+    After [timeout] seconds in total the poller gives up.
+    """
+
+    def __init__(self, initial = 0.2, maximum = 5.0, factor = 1.5, timeout = 3600):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.timeout = timeout
+        self.delay = initial
+        self.started = time.time()
+        self.poll_count = 0         # Number of times we have waited for the next poll
+        self.wait_time = 0.0        # Total time spent waiting (seconds)
+
+    def get_hint(self, *lObjects):
+        """Find the 'checkAgainMs' hint (if any) in one of the reply objects"""
+        for oThis in lObjects:
+            if isinstance(oThis, dict) and 'checkAgainMs' in oThis:
+                try:
+                    return int(oThis['checkAgainMs']) / 1000
+                except:
+                    pass
+        return None
+
+    def wait(self, *lObjects):
+        """Sleep until the next poll is due. Returns False if the overall timeout has been reached"""
+
+        fWait = self.next_delay(*lObjects)
+        if fWait == None:
+            return False
+        time.sleep(fWait)
+        return True
+
+    def next_delay(self, *lObjects):
+        """The number of seconds until the next poll is due (without sleeping), or None after the overall timeout"""
+
+        fHint = self.get_hint(*lObjects)
+        if fHint != None and fHint > 0:
+            fWait = min(fHint, self.maximum)
+        else:
+            fWait = self.delay
+            self.delay = min(self.delay * self.factor, self.maximum)
+        # Check the overall timeout
+        fLeft = self.timeout - self.elapsed()
+        if fLeft <= 0:
+            return None
+        fWait = min(fWait, fLeft)
+        self.poll_count += 1
+        self.wait_time += fWait
+        return fWait
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def get_stats(self):
+        """Provide the poll statistics as an object"""
+        return dict(polls=self.poll_count, 
+                    wait=round(self.wait_time, 3), 
+                    elapsed=round(self.elapsed(), 3))
+
+
 def get_crpp_info():
     """Read the list of available corpora from the /crpp service (if available)"""
 
-    # Set the correct URL
-    url = CRPP_HOME + "/serverinfo"
     # Default reply
     oBack = {}
     # Get the data from the CRPP api
     try:
-        r = requests.get(url)
+        r = crpp_client.get("serverinfo")
     except:
         # Getting an exception here probably means that the back-end is not reachable (down)
         oBack['status'] = 'error'
@@ -63,7 +242,7 @@ def get_crpp_texts(sLng, sPart, sFormat, status):
         oBack = {}
         # Get the data from the CRPP api
         try:
-            r = requests.get(url)
+            r = crpp_client.get("txtlist", oTxtList)
         except:
             # Getting an exception here probably means that the back-end is not reachable (down)
             oBack['status'] = 'error'
@@ -82,14 +261,28 @@ def get_crpp_texts(sLng, sPart, sFormat, status):
                 # Now continue to ask for the status
                 oTxtListStatus = {'userid': "erwin", 'jobid': sJobId}
                 url = CRPP_HOME + '/statusxl?' + json.dumps(oTxtListStatus)
+                poller = CrppPoller()
                 bDone = False
                 while not bDone:
+                    # The synchronisation may have been stopped by the user
+                    if status.cancelled():
+                        oBack['status'] = 'error'
+                        oBack['code'] = "get_crpp_texts(): stopped on request"
+                        oBack['cancelled'] = True
+                        break
+                    # Show that this synchronisation is still alive while /crpp works
+                    status.heartbeat()
                     # Get the data from the CRPP api
                     try:
-                        r = requests.get(url)
+                        r = crpp_client.get("statusxl", oTxtListStatus)
                     except:
-                        error_info = sys.exc_info()
-                        iStop = True
+                        # The back-end may be temporarily unreachable: try again after waiting
+                        oErr.Status("get_crpp_texts: {}".format(get_exc_message()))
+                        if not poller.wait():
+                            oBack['status'] = 'error'
+                            oBack['code'] = "get_crpp_texts(): no reply from /crpp/statusxl within {} seconds".format(poller.timeout)
+                            bDone = True
+                        continue
                     # Action depends on what we receive
                     if r.status_code == 200:
                         # Convert the reply to JSON
@@ -102,6 +295,7 @@ def get_crpp_texts(sLng, sPart, sFormat, status):
                             # There is an error
                             oBack['status'] = 'error'
                             oBack['code'] = oContent['code'] + oContent['msg']
+                            oBack['poll'] = poller.get_stats()
                             bDone = True
                             # Need to store this status!!!
                             status.set("crpp", oBack)
@@ -117,15 +311,19 @@ def get_crpp_texts(sLng, sPart, sFormat, status):
                             oBack['paths'] = oTextList['paths']
                             oBack['txtlist'] = oTextList['list']
                             oBack['status'] = 'ok'
+                            oBack['poll'] = poller.get_stats()
 
                             # What we show in the end is not what needs to be returned
                             oShow = dict(count=oTextList['texts'],
                                          subtype=oTextList['subtype'],
-                                         paths=oTextList['paths'])
+                                         paths=oTextList['paths'],
+                                         poll=oBack['poll'])
                             oShow['status'] = 'ok'
                             oShow['status.code'] = oStatus['code']
                             # Need to store this status!!!
                             status.set("crpp", oShow)
+                            oErr.Status("get_crpp_texts: ready after {polls} polls, {wait}s waiting, {elapsed}s in total".format(
+                                **oBack['poll']))
                         else:
                             # Update the synchronisation object that contains all relevant information
                             oBack['lng'] = sLng
@@ -134,6 +332,7 @@ def get_crpp_texts(sLng, sPart, sFormat, status):
                             oBack['count'] = oContent['total']
                             oBack['status.code'] = oStatus['code']
                             oBack['last.url'] = url
+                            oBack['poll'] = poller.get_stats()
                             status.set("crpp", oBack)
 
                             # DEBUGGING
@@ -145,12 +344,10 @@ def get_crpp_texts(sLng, sPart, sFormat, status):
                             oErr.Status(sMsg)
 
                             # Make sure we wait some time before making the next request
-                            period = 0.400
-                            nexttime = time.time() + period
-                            bReady = False
-                            while not bReady:
-                                now = time.time()
-                                bReady = (now > nexttime)
+                            if not poller.wait(oStatus, oContent):
+                                oBack['status'] = 'error'
+                                oBack['code'] = "get_crpp_texts(): /crpp/statusxl not finished within {} seconds".format(poller.timeout)
+                                bDone = True
                             
                     else:
                         # There is an error
@@ -185,13 +382,11 @@ def get_crpp_text(sLng, sPart, sFormat, sName):
     # Possibly add 'dir'
     if sPart != None and sPart != "":
         oTxtReq['dir'] = sPart
-    # Set the correct URL
-    url = CRPP_HOME + '/txt?' + json.dumps(oTxtReq)
     # Default reply
     oBack = {}
     # Get the data from the CRPP api
     try:
-        r = requests.get(url)
+        r = crpp_client.get("txt", oTxtReq)
     except:
         # Getting an exception here probably means that the back-end is not reachable (down)
         oBack['status'] = 'error'
@@ -214,15 +409,142 @@ def get_crpp_text(sLng, sPart, sFormat, sName):
     # REturn what we have
     return oBack
 
+class SentInfoCache():
+    """Cache for the sentence information that /crpp/txt returns
+
+    Recently used items are kept in memory as JSON, so that every caller gets its own copy.
+    All items are also stored on disk as zlib-compressed JSON, one file per item, in one
+    directory per corpus part; when there are more than [disk_size] files, the least
+    recently used ones are removed.
+    """
+
+    def __init__(self, dir = SENTINFO_CACHE_DIR, memory_size = SENTINFO_MEMORY_SIZE, disk_size = SENTINFO_DISK_SIZE):
+        self.dir = dir
+        self.disk_size = disk_size
+        self.memory = LruCache(memory_size)
+        self.lock = threading.Lock()
+        self.disk_count = None
+
+    def get_part_key(self, sLng, sDir):
+        """The part of the key that identifies the corpus part"""
+
+        return hashlib.sha1("{}|{}".format(sLng, sDir).encode("utf-8")).hexdigest()[:16]
+
+    def get_key(self, options):
+        """The key consists of everything that determines the sentence information"""
+
+        lKey = [str(options.get(x, "")) for x in ['lng', 'dir', 'ext', 'name', 'locs', 'locw', 'type']]
+        sKey = hashlib.sha1("|".join(lKey).encode("utf-8")).hexdigest()
+        return (self.get_part_key(options.get('lng', ""), options.get('dir', "")), sKey)
+
+    def get_file(self, key):
+        sPartKey, sKey = key
+        return os.path.join(self.dir, sPartKey, sKey[:2], sKey + ".json.z")
+
+    def get(self, options):
+        """Get a copy of the cached information for [options], or None"""
+
+        oErr = ErrHandle()
+        key = self.get_key(options)
+        sInfo = self.memory.get(key)
+        if sInfo == None:
+            sFile = self.get_file(key)
+            try:
+                if os.path.exists(sFile):
+                    with open(sFile, "rb") as f:
+                        sInfo = zlib.decompress(f.read()).decode("utf-8")
+                    # Mark the file as recently used
+                    os.utime(sFile)
+                    self.memory.set(key, sInfo)
+            except:
+                oErr.Status("SentInfoCache/get: {}".format(get_exc_message()))
+                sInfo = None
+        return None if sInfo == None else json.loads(sInfo)
+
+    def set(self, options, oInfo):
+        """Keep [oInfo] as the information for [options]"""
+
+        oErr = ErrHandle()
+        key = self.get_key(options)
+        # Serialize right away: the caller may change [oInfo] afterwards
+        sInfo = json.dumps(oInfo)
+        self.memory.set(key, sInfo)
+        sFile = self.get_file(key)
+        try:
+            os.makedirs(os.path.dirname(sFile), exist_ok=True)
+            sTemp = "{}.{}.tmp".format(sFile, threading.get_ident())
+            with open(sTemp, "wb") as f:
+                f.write(zlib.compress(sInfo.encode("utf-8")))
+            bNew = not os.path.exists(sFile)
+            os.replace(sTemp, sFile)
+            if bNew:
+                self.add_count()
+        except:
+            oErr.Status("SentInfoCache/set: {}".format(get_exc_message()))
+
+    def get_files(self):
+        lFile = []
+        for root, dirs, files in os.walk(self.dir):
+            for sName in files:
+                if sName.endswith(".json.z"):
+                    lFile.append(os.path.join(root, sName))
+        return lFile
+
+    def add_count(self):
+        """Count a new file, and remove the least recently used files if there are too many"""
+
+        with self.lock:
+            if self.disk_count == None:
+                self.disk_count = len(self.get_files())
+            else:
+                self.disk_count += 1
+            if self.disk_count > self.disk_size:
+                # Remove the oldest tenth, so that this does not happen at every addition
+                lFile = sorted(self.get_files(), key=lambda x: os.path.getmtime(x))
+                iRemove = len(lFile) - self.disk_size + self.disk_size // 10
+                for sFile in lFile[:iRemove]:
+                    try:
+                        os.remove(sFile)
+                    except OSError:
+                        pass
+                self.disk_count = len(lFile) - iRemove
+
+    def clear(self):
+        self.memory.clear()
+        with self.lock:
+            for sFile in self.get_files():
+                os.remove(sFile)
+            self.disk_count = 0
+
+    def clear_part(self, sLng, sDir):
+        """Remove the information of one corpus part, e.g. when its texts have been synchronised again"""
+
+        sPartKey = self.get_part_key(sLng, sDir)
+        self.memory.delete_where(lambda key: key[0] == sPartKey)
+        with self.lock:
+            shutil.rmtree(os.path.join(self.dir, sPartKey), ignore_errors=True)
+            # Have the files counted again when needed
+            self.disk_count = None
+
+
+# The cache used by get_crpp_sent_info()
+sentinfo_cache = SentInfoCache()
+
+
 def get_crpp_sent_info(options):
     """Retrieve the information belonging to the sentence defined in [options]"""
     oBack = {}
 
+    # The sentence information does not change: first look in the cache
+    oContent = sentinfo_cache.get(options)
+    if oContent != None:
+        oBack['info'] = oContent
+        oBack['status'] = 'ok'
+        return oBack
+
     try:
-        # Set the correct URL
-        url = CRPP_HOME + "/txt?" + json.dumps(options)
         # Get the data from the CRPP api
-        r = requests.get(url)
+        r = crpp_client.get("txt", options)
         # Action depends on what we receive
         if r.status_code == 200:
             # Convert to JSON (and replace any tabs to a space)
@@ -232,6 +554,10 @@ def get_crpp_sent_info(options):
             # Define the lists
             oBack['info'] = oContent
             oBack['status'] = 'ok'
+            # Keep it, unless /crpp reports an error
+            oStatus = reply.get('status')
+            if not isinstance(oStatus, dict) or oStatus.get('code') != "error":
+                sentinfo_cache.set(options, oContent)
         else:
             oBack['status'] = 'error'
             oBack['code'] = "The server returns error {}: {}".format(r.status_code, r.reason)
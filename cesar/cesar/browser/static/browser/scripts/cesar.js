@@ -27,7 +27,8 @@ var ru = (function ($, ru) {
     // Define variables for ru.collbank here
     var loc_example = "",
         loc_divErr = "sentdetails_err",
-        oSyncTimer = null;
+        oSyncTimer = null,
+        oSyncJob = {};        // The job id of the synchronisation that is followed, per sync type
 
 
     // Private methods specification
@@ -241,6 +242,7 @@ var ru = (function ($, ru) {
 
         // Indicate that we are starting
         $("#sync_progress_" + sSyncType).html("Synchronization is starting: " + sSyncType);
+        delete oSyncJob[sSyncType];
 
         // Make sure that at the end: we stop
         oData = { 'type': sSyncType };
@@ -256,6 +258,11 @@ var ru = (function ($, ru) {
               oData[arKV[0]] = arKV[1];
             }
             break;
+          case "sentences":
+            // Several parts and formats may be selected
+            oData['parts'] = ($("#id_warmup_parts").val() || []).join(",");
+            oData['formats'] = ($("#id_warmup_formats").val() || []).join(",");
+            break;
         }
 
         // Start looking only after some time
@@ -272,6 +279,15 @@ var ru = (function ($, ru) {
           data: oData,      // This sends the parameters in the data object
           cache: false,
           success: function (json) {
+            if (json.jobid !== undefined) {
+              // Follow this particular job: other synchronisations may run at the same time
+              oSyncJob[sSyncType] = json.jobid;
+            }
+            if (json.status === "started") {
+              // The job runs in the background: keep following its progress
+              $("#sync_progress_" + sSyncType).html("Started in the background: " + sSyncType);
+              return;
+            }
             $("#sync_details_" + sSyncType).html("start >> sync_stop");
             ru.cesar.sync_stop(sSyncType, json);
           },
@@ -292,6 +308,9 @@ var ru = (function ($, ru) {
             sUrl = "";
 
         oData = { 'type': sSyncType };
+        if (oSyncJob.hasOwnProperty(sSyncType)) {
+          oData['jobid'] = oSyncJob[sSyncType];
+        }
         sUrl = $("#sync_start_" + sSyncType).attr('sync-progress');
         $.ajax({
           url: sUrl,
@@ -337,6 +356,7 @@ var ru = (function ($, ru) {
             return;
           case "done":
           case "finished":
+          case "cancelled":
             // Default action is to show the status
             $("#sync_progress_" + sSyncType).html(json.status);
             $("#sync_details_" + sSyncType).html(ru.cesar.sync_details(json));
@@ -367,6 +387,41 @@ var ru = (function ($, ru) {
 
       },
 
+      /**
+       *  sync_cancel
+       *      Ask the background synchronisation to stop
+       *
+       */
+      sync_cancel: function (sSyncType) {
+        var oData = {},
+            sUrl = "";
+
+        oData = { 'type': sSyncType };
+        if (oSyncJob.hasOwnProperty(sSyncType)) {
+          oData['jobid'] = oSyncJob[sSyncType];
+        }
+        sUrl = $("#sync_start_" + sSyncType).attr('sync-stop');
+        $.ajax({
+          url: sUrl,
+          type: "GET",
+          async: true,
+          dataType: "json",
+          data: oData,
+          cache: false,
+          success: function (json) {
+            if (json.status === "error") {
+              $("#sync_details_" + sSyncType).html(json.msg);
+            } else {
+              // The progress calls show when the job has actually stopped
+              $("#sync_progress_" + sSyncType).html("Stopping: " + sSyncType);
+            }
+          },
+          failure: function () {
+            $("#sync_details_" + sSyncType).html("Ajax failure");
+          }
+        });
+      },
+
       /**
        *  sync_details
        *      Return a string with synchronisation details
@@ -6,7 +6,21 @@ Replace this with more appropriate tests for your application.
 """
 
 import django
-from django.test import TestCase
+import json
+import requests
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from django.test import TestCase, SimpleTestCase
+from django.utils import timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from cesar.browser.models import FieldChoice, Metavar, Corpus, Part, Text, Sentence, Status, CORPUS_FORMAT, \
+     warmup_store, warmup_sentences, process_textlist, sync_alltexts, get_texts_key, SYNC_STALE
+from cesar.browser.services import CrppClient
 
 # TODO: Configure your database in settings.py and sync before running tests.
 
@@ -26,3 +40,444 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class CrppStubHandler(BaseHTTPRequestHandler):
+    """Answers every /crpp command with an empty reply, after the delay that the server asks for"""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def handle_request(self):
+        sCommand = self.path.split("?")[0].strip("/")
+        with self.server.lock:
+            self.server.requests[sCommand] = self.server.requests.get(sCommand, 0) + 1
+            fDelay = self.server.delays.pop(0) if len(self.server.delays) > 0 else 0
+        if "Content-Length" in self.headers:
+            self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(fDelay)
+        sReply = json.dumps({'status': {'code': "completed"}, 'content': {}}).encode("utf-8")
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(sReply)))
+            self.end_headers()
+            self.wfile.write(sReply)
+        except OSError:
+            # The client has given up waiting
+            pass
+
+    do_GET = handle_request
+    do_POST = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CrppClientTest(SimpleTestCase):
+    """The shared /crpp client against a local stub server"""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), CrppStubHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = {}
+        self.server.delays = []
+        self.server.connections = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.home = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.client = CrppClient(home=self.home, timeouts={'default': (1, 0.5)}, retries=2)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        """Consecutive requests use the same connection"""
+        for idx in range(5):
+            self.assertEqual(self.client.post("dbinfo", {'start': idx}).status_code, 200)
+        self.assertEqual(self.server.requests['dbinfo'], 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_read_retried_after_timeout(self):
+        """A command that only reads is sent again when the reply is too late"""
+        self.server.delays = [1.0]
+        self.assertEqual(self.client.post("statusxq", {'jobid': 1}).status_code, 200)
+        self.assertEqual(self.server.requests['statusxq'], 2)
+
+    def test_no_resend_after_timeout(self):
+        """Commands that start work at /crpp, and dbget, are sent only once when the reply is too late"""
+        for sCommand in ['txtlist', 'crpset', 'exe', 'dbget']:
+            self.server.delays = [1.0]
+            with self.assertRaises(requests.Timeout):
+                self.client.post(sCommand, {})
+            self.assertEqual(self.server.requests[sCommand], 1, sCommand)
+
+    def test_retry_without_connection(self):
+        """Any command is tried again when no connection can be made"""
+        # Take a free port that nobody listens on
+        oSocket = socket.socket()
+        oSocket.bind(("127.0.0.1", 0))
+        iPort = oSocket.getsockname()[1]
+        oSocket.close()
+        client = CrppClient(home="http://127.0.0.1:{}".format(iPort), timeouts={'default': (1, 0.5)}, retries=2)
+        with self.assertRaises(requests.ConnectionError):
+            client.post("crpset", {})
+        self.assertEqual(client.get_stats()['crpset']['errors'], 3)
+
+
+def run_now(sPool, fn, *args, iWorkers = None, **kwargs):
+    """Stand-in for run_in_background() that runs [fn] right away, in this thread"""
+
+    future = Future()
+    future.set_result(fn(*args, **kwargs))
+    return future
+
+
+class PartTestCase(TestCase):
+    """Tests on the texts of one corpus part"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for idx, sFormat in enumerate(['psdx', 'folia']):
+            FieldChoice.objects.create(field=CORPUS_FORMAT, english_name=sFormat, dutch_name=sFormat,
+                                       abbr=sFormat, machine_value=idx)
+        metavar = Metavar.objects.create(name="test")
+        corpus = Corpus.objects.create(name="test", lng="0", eth="0", metavar=metavar, status="0")
+        cls.part = Part.objects.create(name="test", dir="TEST", corpus=corpus, metavar=metavar)
+
+
+class TextIndexTest(PartTestCase):
+    """Text.index_filter narrows the metadata search down with the trigram index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for sName, sTitle, sAuthor in [("povest", "Повесть временных лет", "Нестор"),
+                                       ("slovo", "Слово о полку Игореве", "Неизвестный"),
+                                       ("beowulf", "Beowulf", "Unknown"),
+                                       ("chronicle", "The Anglo-Saxon Chronicle", "Various")]:
+            Text.objects.create(fileName=sName, format="0", part=cls.part, title=sTitle, author=sAuthor)
+
+    def get_names(self, oSearch):
+        qs = Text.index_filter(Text.objects.filter(part=self.part), oSearch)
+        return sorted(qs.values_list('fileName', flat=True))
+
+    def test_index_exists(self):
+        self.assertTrue(Text.index_exists())
+
+    def test_cyrillic(self):
+        """Cyrillic literal parts are found, regardless of case"""
+        self.assertEqual(self.get_names({'title': "*временн*"}), ["povest"])
+        self.assertEqual(self.get_names({'title': "*ИГОРЕВ*"}), ["slovo"])
+
+    def test_prefix(self):
+        """A pattern 'abc*' finds the texts that contain its literal part"""
+        self.assertEqual(self.get_names({'author': "Нес*"}), ["povest"])
+        self.assertEqual(self.get_names({'fileName': "beo*"}), ["beowulf"])
+
+    def test_combined(self):
+        """All fields must match"""
+        self.assertEqual(self.get_names({'title': "*wulf*", 'author': "Unk*"}), ["beowulf"])
+        self.assertEqual(self.get_names({'title': "*Chron*", 'author': "Unk*"}), [])
+
+    def test_not_narrowed(self):
+        """Patterns without a literal part of three characters, and unknown fields, leave the selection as it is"""
+        lAll = ["beowulf", "chronicle", "povest", "slovo"]
+        self.assertEqual(self.get_names({'title': "*ов*"}), lAll)
+        self.assertEqual(self.get_names({'author': "Не*"}), lAll)
+        self.assertEqual(self.get_names({'lines': "123"}), lAll)
+
+
+class SentenceSearchTest(PartTestCase):
+    """Sentence.search finds the cached sentences through the full-text index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        metavar = Metavar.objects.get(name="test")
+        cls.other = Part.objects.create(name="other", dir="OTHER", corpus=cls.part.corpus, metavar=metavar)
+        for part, sName, lLine in [
+                (cls.part, "povest", ["Се повести временных лет", "откуда есть пошла Русская земля",
+                                      "Временные годы и времена"]),
+                (cls.part, "beowulf", ["Hwæt we Gardena in geardagum", "The king <b>Hrothgar</b> built a hall"]),
+                (cls.other, "slovo", ["Не лепо ли ны бяшетъ братие", "Русская земля за холмом"])]:
+            text = Text.objects.create(fileName=sName, format="0", part=part)
+            Sentence.objects.bulk_create(Sentence.from_lines(text.id, [{'id': "s{}".format(idx), 'text': sLine} 
+                                                                       for idx, sLine in enumerate(lLine, 1)]))
+
+    def get_hits(self, sQuery, **kwargs):
+        return [(oHit['fileName'], oHit['identifier']) for oHit in Sentence.search(sQuery, **kwargs)]
+
+    def test_cyrillic(self):
+        """Cyrillic words are found regardless of case"""
+        self.assertEqual(self.get_hits("временных"), [("povest", "s1")])
+        self.assertEqual(sorted(self.get_hits("РУССКАЯ")), sorted(self.get_hits("русская")))
+        self.assertEqual(sorted(self.get_hits("русская")), [("povest", "s2"), ("slovo", "s2")])
+
+    def test_prefix(self):
+        """A word ending in '*' is looked up as a prefix"""
+        self.assertEqual(sorted(self.get_hits("врем*")), [("povest", "s1"), ("povest", "s3")])
+        self.assertEqual(self.get_hits("врем"), [])
+        self.assertEqual(self.get_hits("Hroth*"), [("beowulf", "s2")])
+
+    def test_all_words(self):
+        """Every word must occur in the sentence"""
+        self.assertEqual(self.get_hits("русская холмом"), [("slovo", "s2")])
+        self.assertEqual(self.get_hits("русская hall"), [])
+        self.assertEqual(self.get_hits("  "), [])
+
+    def test_part(self):
+        self.assertEqual(self.get_hits("русская", part=self.other.id), [("slovo", "s2")])
+        self.assertEqual(self.get_hits("русская", part=self.part.id, format="0"), [("povest", "s2")])
+        self.assertEqual(self.get_hits("русская", format="1"), [])
+
+    def test_snippet(self):
+        """The sentence is escaped, and only the words that were found are in bold"""
+        oHit = Sentence.search("built")[0]
+        self.assertEqual(oHit['snippet'], "The king &lt;b&gt;Hrothgar&lt;/b&gt; <b>built</b> a hall")
+        self.assertEqual((oHit['part'], oHit['partname'], oHit['order']), (self.part.id, "test", 2))
+
+    def test_rank(self):
+        """Better matches come first"""
+        lHit = Sentence.search("врем*")
+        self.assertEqual([oHit['identifier'] for oHit in lHit], ["s3", "s1"])
+        self.assertLessEqual(lHit[0]['rank'], lHit[1]['rank'])
+
+    def test_grouped(self):
+        lPart = Sentence.search_grouped("русская")
+        self.assertEqual(sorted((oPart['name'], [oText['fileName'] for oText in oPart['texts']]) for oPart in lPart),
+                         [("other", ["slovo"]), ("test", ["povest"])])
+
+    def test_without_index(self):
+        """Without the index the sentences are searched with icontains, ordered by part and text"""
+        with patch('cesar.browser.models.fts_index_exists', return_value=False):
+            self.assertEqual(self.get_hits("Русская земля"), [("slovo", "s2"), ("povest", "s2")])
+            self.assertEqual(self.get_hits("Hroth*"), [("beowulf", "s2")])
+            self.assertEqual(Sentence.search("Hroth*")[0]['rank'], 0)
+
+
+class SentenceWarmupTest(PartTestCase):
+    """Fetching the sentences ahead skips the texts that already have them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.cached = Text.objects.create(fileName="cached", format="0", part=cls.part)
+        cls.empty = Text.objects.create(fileName="empty", format="0", part=cls.part)
+        Text.objects.create(fileName="other", format="1", part=cls.part)
+        Sentence.objects.create(text=cls.cached, identifier="s1", order=1, sent="Already there")
+
+    def get_lines(self, sName):
+        return [{'id': "s{}".format(idx), 'text': "Line {} of {}".format(idx, sName)} for idx in range(1, 4)]
+
+    def get_crpp_text(self, sLng, sDir, sFormat, sName):
+        self.fetched.append(sName)
+        return {'status': "ok", 'line': self.get_lines(sName)}
+
+    def test_store(self):
+        """Sentences of a text that has them are not written again"""
+        lSent = Sentence.from_lines(self.cached.id, self.get_lines("cached")) + \
+                Sentence.from_lines(self.empty.id, self.get_lines("empty"))
+        oCount = dict(fetched=0, cached=0, sentences=0)
+        self.assertEqual(warmup_store(lSent, [self.cached.id, self.empty.id], oCount), 3)
+        self.assertEqual(oCount, dict(fetched=1, cached=1, sentences=3))
+        self.assertEqual(list(self.cached.sentences.values_list('sent', flat=True)), ["Already there"])
+        self.assertEqual(self.empty.sentences.count(), 3)
+        # Storing them once more changes nothing
+        self.assertEqual(warmup_store(Sentence.from_lines(self.empty.id, self.get_lines("empty")), [self.empty.id]), 0)
+        self.assertEqual(self.empty.sentences.count(), 3)
+
+    def test_warmup(self):
+        """Only the texts without sentences are fetched from /crpp"""
+        self.fetched = []
+        oStatus = Status.objects.create(type="sentences", user="test", status="queued")
+        with patch('cesar.browser.models.run_in_background', run_now), \
+             patch('cesar.browser.models.get_crpp_text', self.get_crpp_text):
+            oCount = warmup_sentences([(self.part.id, "0")], oStatus.id)
+            self.assertEqual(self.fetched, ["empty"])
+            self.assertEqual((oCount['total'], oCount['cached'], oCount['fetched'], oCount['sentences']), (2, 1, 1, 3))
+            self.assertEqual(self.empty.sentences.order_by('order').first().sent, "Line 1 of empty")
+            oStatus.refresh_from_db()
+            self.assertEqual(oStatus.status, "done")
+
+            # Once everything is there, nothing is fetched anymore
+            self.fetched = []
+            oCount = warmup_sentences([(self.part.id, "0")], oStatus.id)
+            self.assertEqual(self.fetched, [])
+            self.assertEqual((oCount['cached'], oCount['fetched']), (2, 0))
+
+    def test_cancel(self):
+        """A job that is stopped fetches nothing more"""
+        self.fetched = []
+        oStatus = Status.objects.create(type="sentences", user="test", status="queued", cancel=True)
+        with patch('cesar.browser.models.run_in_background', run_now), \
+             patch('cesar.browser.models.get_crpp_text', self.get_crpp_text):
+            warmup_sentences([(self.part.id, "0")], oStatus.id)
+        self.assertEqual(self.fetched, [])
+        oStatus.refresh_from_db()
+        self.assertEqual(oStatus.status, "cancelled")
+        self.assertFalse(self.empty.sentences.exists())
+
+
+class ProcessTextlistTest(PartTestCase):
+    """process_textlist determines the texts to insert, update and delete in one go"""
+
+    def setUp(self):
+        for sName, iWords in [("alpha", 100), ("beta", 200), ("gamma", 300), ("alpha", 100)]:
+            text = Text.objects.create(fileName=sName, format="0", part=self.part, lines=10, words=iWords, 
+                                       title=sName.title(), date="1600", author="A", genre="prose", subtype="original")
+            Sentence.objects.create(text=text, identifier="s1", order=1, sent="A sentence of {}".format(sName))
+        self.status = Status.objects.create(type="texts", user="test", status="queued")
+
+    def get_item(self, sName, iWords, sTitle = None, iGenre = 0):
+        return dict(name=sName, title=sName.title() if sTitle == None else sTitle, size=10, words=iWords, 
+                    date=1600, author="A", genre=iGenre, subtype=0)
+
+    def get_txtlist(self, lItem):
+        return {'paths': 1, 'count': len(lItem), 'genre': ["prose", "poetry"], 'subtype': ["original"],
+                'txtlist': [{'list': lItem}]}
+
+    def process(self, lItem, **options):
+        return process_textlist(self.get_txtlist(lItem), self.part, "psdx", self.status, options)
+
+    def get_texts(self):
+        return sorted(Text.objects.filter(part=self.part).values_list('fileName', 'words', 'title'))
+
+    def test_sets(self):
+        """New texts are added, changed ones updated, and missing ones and duplicates deleted"""
+        oBack = self.process([self.get_item("alpha", 100), self.get_item("beta", 250), self.get_item("delta", 400)])
+        self.assertTrue(oBack['result'])
+        self.assertEqual((oBack['inserted'], oBack['updated'], oBack['deleted'], oBack['unchanged']), (1, 1, 2, 1))
+        self.assertEqual(self.get_texts(), [("alpha", 100, "Alpha"), ("beta", 250, "Beta"), ("delta", 400, "Delta")])
+        self.assertEqual(Text.objects.get(fileName="delta").genre, "prose")
+        # The sentences of the changed text are outdated, those of the unchanged one are kept
+        self.assertEqual(sorted(Sentence.objects.values_list('text__fileName', flat=True)), ["alpha"])
+        self.status.refresh_from_db()
+        self.assertEqual(self.status.status, "part")
+
+    def test_unchanged(self):
+        """Processing the same list again changes nothing"""
+        lItem = [self.get_item("alpha", 100), self.get_item("beta", 250)]
+        self.process(lItem)
+        oBack = self.process(lItem)
+        self.assertEqual((oBack['inserted'], oBack['updated'], oBack['deleted'], oBack['unchanged']), (0, 0, 0, 2))
+
+    def test_nodeleting(self):
+        oBack = self.process([self.get_item("beta", 200), self.get_item("delta", 400)], nodeleting=True)
+        self.assertEqual((oBack['inserted'], oBack['updated'], oBack['deleted']), (1, 0, 0))
+        self.assertEqual([x[0] for x in self.get_texts()], ["alpha", "alpha", "beta", "delta", "gamma"])
+
+    def test_updating(self):
+        """Only the one field of the existing texts is updated"""
+        oBack = self.process([self.get_item("beta", 250, sTitle="Other"), self.get_item("delta", 400)], 
+                             updating=True, update_field="words")
+        self.assertEqual((oBack['inserted'], oBack['updated'], oBack['deleted']), (0, 1, 0))
+        self.assertEqual(Text.objects.filter(fileName="beta").values_list('words', 'title').first(), (250, "Beta"))
+        self.assertFalse(Text.objects.filter(fileName="delta").exists())
+
+    def test_skipped(self):
+        """Texts with missing fields or an unknown genre are skipped"""
+        oItem = self.get_item("delta", 400)
+        del oItem['author']
+        oBack = self.process([self.get_item("alpha", 100), oItem, self.get_item("epsilon", 1, iGenre=5)], nodeleting=True)
+        self.assertEqual((oBack['inserted'], oBack['skipped']), (0, 2))
+        self.assertIn("epsilon", oBack['note'])
+
+
+class SyncAlltextsTest(PartTestCase):
+    """sync_alltexts reports per part/format in a child status, and only the parent reaches the final state"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        metavar = Metavar.objects.get(name="test")
+        cls.other = Part.objects.create(name="other", dir="OTHER", corpus=cls.part.corpus, metavar=metavar)
+
+    def setUp(self):
+        Text.objects.create(fileName="old", format="0", part=self.part)
+        self.status = Status.objects.create(type="alltexts", user="test", status="queued")
+        self.requested = []
+        self.failing = []
+        self.cancelling = False
+
+    def get_crpp_texts(self, sLng, sDir, sFormat, oStatus):
+        self.requested.append(sDir)
+        if self.cancelling:
+            # The user stops the whole job while the first part is being fetched
+            Status.objects.filter(id=self.status.id).update(cancel=True)
+        if sDir in self.failing:
+            return {'status': "error", 'code': "no such part"}
+        lItem = [dict(name="{}_{}".format(sDir.lower(), idx), title="Text", size=10, words=100, date="1600",
+                      author="A", genre=0, subtype=0) for idx in range(3)]
+        return {'paths': 1, 'count': len(lItem), 'genre': ["prose"], 'subtype': ["original"], 'txtlist': [{'list': lItem}]}
+
+    def sync(self):
+        with patch('cesar.browser.models.run_in_background', run_now), \
+             patch('cesar.browser.models.get_crpp_texts', self.get_crpp_texts):
+            oBack = sync_alltexts(self.status.id, ["psdx"])
+        self.status.refresh_from_db()
+        return oBack
+
+    def get_children(self):
+        return sorted(self.status.children.values_list('key', 'status'))
+
+    def test_done(self):
+        oBack = self.sync()
+        self.assertEqual((oBack['parts'], oBack['failed'], oBack['alltexts']), (2, 0, 6))
+        self.assertEqual(self.status.status, "done")
+        self.assertEqual(self.get_children(), sorted([(get_texts_key(self.part.id, "0"), "done"), 
+                                                      (get_texts_key(self.other.id, "0"), "done")]))
+        self.assertEqual(sorted(Text.objects.values_list('fileName', flat=True)), 
+                         ["other_0", "other_1", "other_2", "test_0", "test_1", "test_2"])
+
+    def test_failed_part(self):
+        """A part that fails is reported by its child, the others are still synchronised"""
+        self.failing = ["OTHER"]
+        oBack = self.sync()
+        self.assertEqual((oBack['parts'], oBack['failed']), (1, 1))
+        self.assertEqual(self.status.status, "error")
+        self.assertIn("no such part", oBack['errors'][0])
+        child = self.status.children.get(key=get_texts_key(self.other.id, "0"))
+        self.assertEqual(child.status, "error")
+        self.assertEqual(self.status.children.get(key=get_texts_key(self.part.id, "0")).status, "done")
+
+    def test_cancel(self):
+        """Stopping the parent stops the part under way and the parts that have not started"""
+        self.cancelling = True
+        oBack = self.sync()
+        self.assertEqual(len(self.requested), 1)
+        self.assertEqual(oBack['parts'], 0)
+        self.assertEqual(self.status.status, "cancelled")
+        self.assertEqual([x[1] for x in self.get_children()], ["cancelled", "cancelled"])
+        self.assertFalse(Text.objects.exists())
+
+    def test_key_taken(self):
+        """A part/format combination that another job synchronises is not started twice"""
+        sKey = get_texts_key(self.other.id, "0")
+        running = Status.objects.create(type="texts", user="other", status="loading", key=sKey)
+        oBack = self.sync()
+        self.assertEqual(self.requested, ["TEST"])
+        self.assertEqual((oBack['parts'], oBack['failed']), (1, 1))
+        self.assertIn("already being synchronised", oBack['errors'][0])
+        self.assertEqual(self.get_children(), [(get_texts_key(self.part.id, "0"), "done")])
+        running.refresh_from_db()
+        self.assertEqual(running.status, "loading")
+
+    def test_release_stale(self):
+        """A job without any sign of life is finished together with its children, which frees the job key"""
+        child = Status.objects.create(type="alltexts_part", user="test", status="loading", parent=self.status,
+                                      key=get_texts_key(self.part.id, "0"))
+        self.assertEqual(Status.release_stale(Status.objects.filter(id=self.status.id)), 0)
+        Status.objects.filter(id=self.status.id).update(saved=timezone.now() - timedelta(seconds=SYNC_STALE + 1))
+        self.status.refresh_from_db()
+        self.assertTrue(self.status.is_stale())
+        self.assertEqual(Status.release_stale(Status.objects.filter(id=self.status.id), "cancelled"), 1)
+        self.status.refresh_from_db()
+        child.refresh_from_db()
+        self.assertEqual((self.status.status, child.status), ("cancelled", "cancelled"))
+        # The key can be used again
+        Status.objects.create(type="texts", user="test", status="loading", key=get_texts_key(self.part.id, "0"))
@@ -7,6 +7,7 @@ from django.contrib.auth import login, authenticate
 from django.contrib.auth.models import Group
 from django.urls import reverse
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db import transaction, IntegrityError
 from django.db.models import Q
 from django.db.models.functions import Lower
 from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
@@ -19,11 +20,11 @@ from django.views.generic import ListView, View
 from datetime import datetime
 from time import sleep
 
-from cesar.settings import APP_PREFIX, WRITABLE_DIR
+from cesar.settings import APP_PREFIX, WRITABLE_DIR, SYNC_WORKERS
 from cesar.browser.services import *
 from cesar.browser.models import *
 from cesar.browser.forms import *
-from cesar.utils import ErrHandle
+from cesar.utils import ErrHandle, run_in_background
 from cesar.viewer.models import NewsItem
 from cesar.basic.views import BasicDetails
 import fnmatch
@@ -416,138 +417,93 @@ def sync_crpp_start(request):
             data['status'] = 'no sync type specified'
 
         else:
-            # Remove previous status objects for this combination of user/type
+            # Remove previous status objects for this combination of user/type, unless they are still running
             lstQ = []
             lstQ.append(Q(user=username))
             lstQ.append(Q(type=synctype))
             qs = Status.objects.filter(*lstQ)
-            qs.delete()
-
-            # Create a status object for this combination of synctype/user
-            oStatus = Status(user=username, type=synctype, status="preparing")
-            oStatus.save()
+            qs.filter(status__in=SYNC_FINISHED).delete()
+
+            # Only one job at a time may synchronise the same thing
+            sKey = ""
+            if synctype == "texts":
+                sKey = get_texts_key(get.get('part', ""), get.get('format', ""))
+            elif synctype == "corpora" or (allow_delete_all and synctype == "alltexts"):
+                sKey = synctype
+            oRunning = None
+            if sKey != "":
+                # A job that no longer shows any sign of life does not hold its key anymore
+                Status.release_stale(Status.objects.filter(key=sKey))
+                oRunning = Status.objects.filter(key=sKey).exclude(status__in=SYNC_FINISHED).first()
+            if oRunning != None and oRunning.user == username and oRunning.type == synctype:
+                # Follow the job that is already running
+                data['jobid'] = oRunning.id
+                data['status'] = 'started'
+                return JsonResponse(data)
+            elif oRunning != None:
+                data['status'] = 'error'
+                data['msg'] = "This is already being synchronised by another job"
+                return JsonResponse(data)
+
+            # Create a status object for this synchronisation: its id is the job id
+            oStatus = Status(user=username, type=synctype, status="preparing", key=sKey)
+            try:
+                with transaction.atomic():
+                    oStatus.save()
+            except IntegrityError:
+                # Another request has just started the same synchronisation
+                data['status'] = 'error'
+                data['msg'] = "This is already being synchronised by another job"
+                return JsonResponse(data)
+            data['jobid'] = oStatus.id
 
             # Formulate a response
             data['status'] = 'done'
 
             if synctype == "corpora":
-                # Get the data from the CRPP api
-                crpp_info = get_crpp_info()
-
-                # Use the synchronisation object that contains all relevant information
-                oStatus.set("loading")
-
-                # Update the models with the new information
-                oResult = process_corpusinfo(oStatus, crpp_info)
-                if oResult == None or oResult['result'] == False:
-                    data.status = 'error'
-                elif oResult != None:
-                    data['count'] = oResult
+                # Get the data from the CRPP api and update the models in the background
+                oStatus.set("queued", msg="Waiting to contact /crpp")
+                run_in_background("sync", sync_corpora, oStatus.id, iWorkers=SYNC_WORKERS)
+                data['status'] = 'started'
 
             elif synctype == "texts":
                 # Update texts from a particular part and a particular format
                 part = Part.objects.filter(id=get['part']).first()
                 if part != None:
-                    sPart = part.dir
-                    sLng = choice_english(CORPUS_LANGUAGE, part.corpus.lng)
-                    sFormat = choice_english(CORPUS_FORMAT, get['format'])
-
                     # Updating options
                     bUpdateOnly = 'updateonly' in get
                     bDeleteFirst = 'deletefirst' in get
+                    bNoDeleting = not bDeleteFirst
+                    options = {'nodeleting': bNoDeleting, 'updating': bUpdateOnly, 'update_field': 'words'}
 
-                    # Use the appropriate synchronisation object that contains all relevant information
-                    oStatus.set("contacting", msg="Obtaining data from /crpp")
-
-                    # Get the data from the CRPP api: this only returns a JOBID
-                    crpp_texts = get_crpp_texts(sLng, sPart, sFormat, oStatus)
-
-                    # Check what we get here
-                    if 'status' in crpp_texts and crpp_texts['status'] == 'error':
-                        # There is an error
-                        data['status'] = 'error'
-                        data['msg'] = json.dumps(crpp_texts)
-                        oStatus.set("error", msg=data['msg'] )
-                    else:
-                        # Seem to have a good response
-
-                        # Create a new synchronisation object that contains all relevant information
-                        oStatus.set("loading", msg="Updating the existing models with this new information")
-
-                        # Update the models with the /crpp/txtlist information
-                        bNoDeleting = not bDeleteFirst
-                        options = {'nodeleting': bNoDeleting, 'updating': bUpdateOnly, 'update_field': 'words'}
-                        oResult = process_textlist(crpp_texts, part, sFormat, oStatus, options)
-
-                        # Process the reply from [process_textlist()]
-                        if oResult == None or ('result' in oResult and oResult['result'] == False):
-                            data['status'] = 'error'
-                        elif not 'total' in oResult:
-                            data['status'] = 'error'
-                        elif oResult != None:
-                            data['count'] = oResult
-
-                        # Completely ready
-                        oStatus.set("done", oResult)
+                    # Several parts can be synchronised at the same time, each with its own job
+                    oStatus.set("queued", msg="Waiting to contact /crpp for {}".format(part.name))
+                    run_in_background("sync", sync_texts, oStatus.id, part.id, get['format'], options, iWorkers=SYNC_WORKERS)
+                    data['status'] = 'started'
 
                 else:
                     # Create a new synchronisation object that contains all relevant information
                     oStatus.set("error", msg="Cannot find [part] information" )
                     data['status'] = 'error'
 
-            elif allow_delete_all and synctype == "alltexts":
-                # Create a new synchronisation object that contains all relevant information
-                oStatus.set("contacting", msg="Obtaining data from /crpp")
-
-                data['count'] = 0
-                oBack = {}
+            elif synctype == "sentences":
+                # Fetch the sentences of all texts in the selected parts/formats in the background
+                lPart = [x for x in get.get('parts', "").split(",") if x != ""]
+                lFormat = [x for x in get.get('formats', "").split(",") if x != ""]
+                lCombi = [(part.id, sFormat) for part in Part.objects.filter(id__in=lPart) for sFormat in lFormat]
+                if len(lCombi) == 0:
+                    oStatus.set("error", msg="Select at least one part and one format")
+                    data['status'] = 'error'
+                else:
+                    oStatus.set("queued", msg="Fetching the sentences of {} part/format combination(s)".format(len(lCombi)))
+                    run_in_background("warmup", warmup_sentences, lCombi, oStatus.id, iWorkers=1)
+                    data['status'] = 'started'
 
-                # ================ IMPORTANT ===========================
-                # Delete everything that is already theres
-                oStatus.set("deleting")
-                Text.objects.all().delete()
-
-                # Only now do we start in full
-                oStatus.set("continuing")
-
-                # We are going to try and update ALL the texts in the entire application
-                for part in Part.objects.all():
-                    sPart = part.dir
-                    sLng = choice_english(CORPUS_LANGUAGE, part.corpus.lng)
-                    # Walk all available text formats
-                    for sFormat in ['folia', 'psdx']:
-                        # Note what we are doing
-                        data['lng'] = sLng
-                        data['part'] = sPart
-                        data['format'] = sFormat
-
-                        # Update the synchronisation object that contains all relevant information
-                        oBack['lng'] = sLng
-                        oBack['part'] = sPart
-                        oBack['format'] = sFormat
-                        oStatus.set("crpp", oBack)
-
-                        # Get the data from the CRPP api
-                        crpp_texts = get_crpp_texts(sLng, sPart, sFormat, oStatus)               
-
-                        # Check the status of what has been returned
-                        if crpp_texts['status'] != "error":
-                            # Status is ok, so continue.
-
-                            # Update the models with the /crpp/txtlist information
-                            oResult = process_textlist(crpp_texts, part, sFormat, oStatus, True)
-
-                            # Process the reply from [process_textlist()]
-                            if oResult == None or oResult['result'] == False:
-                                data.status = 'error'
-                                oStatus.set("error")
-                            elif oResult != None:
-                                data['count'] += oResult['total']
-                                oResult['alltexts'] = data['count']
-                                oStatus.set("okay", oResult)
-                                oBack = oResult
-                # Completely ready
-                oStatus.set("done", oBack)
+            elif allow_delete_all and synctype == "alltexts":
+                # Delete all texts and get them again for all parts and formats in the background
+                oStatus.set("queued", msg="Waiting to contact /crpp")
+                run_in_background("sync", sync_alltexts, oStatus.id, ['folia', 'psdx'], iWorkers=SYNC_WORKERS)
+                data['status'] = 'started'
 
             elif synctype == "clearsentences":
                 # Clear all the Sentence elements
@@ -594,9 +550,17 @@ def sync_crpp_progress(request):
             # Formulate a response
             data['status'] = 'UNKNOWN'
 
-            # Get the appropriate status object
+            # Get the appropriate status object: the job that was started, or else the most recent one
             # sleep(1)
-            oStatus = Status.objects.filter(user=username, type=synctype).first()
+            qs = Status.objects.filter(user=username, type=synctype)
+            if get.get('jobid', "") != "":
+                qs = qs.filter(id=get['jobid'])
+            oStatus = qs.order_by('-id').first()
+
+            # A job that no longer shows any sign of life is finished now
+            if oStatus != None and oStatus.is_stale():
+                Status.release_stale(Status.objects.filter(id=oStatus.id))
+                oStatus.refresh_from_db()
 
             # Check what we received
             if oStatus == None:
@@ -609,6 +573,7 @@ def sync_crpp_progress(request):
                 data['status'] = oStatus.status
                 data['msg'] = oStatus.msg
                 data['count'] = oStatus.count
+                data['jobid'] = oStatus.id
 
         # Return this response
         return JsonResponse(data)
@@ -620,6 +585,42 @@ def sync_crpp_progress(request):
     # Return this response
     return JsonResponse(data)
 
+def sync_crpp_stop(request):
+    """Ask the running /crpp synchronisation(s) of this user and type to stop"""
+
+    oErr = ErrHandle()
+    data = {'status': 'stopping'}
+
+    try:
+        # Get the user
+        username = request.user.username
+        # Get the synchronization type
+        get = request.GET
+        synctype = get.get('synctype', "")
+
+        if synctype == '':
+            # Formulate a response
+            data['status'] = 'error'
+            data['msg'] = "no sync type specified" 
+        else:
+            # The background job checks this between its steps
+            qs = Status.objects.filter(user=username, type=synctype).exclude(status__in=SYNC_FINISHED)
+            if get.get('jobid', "") != "":
+                qs = qs.filter(id=get['jobid'])
+            # Jobs that no longer show any sign of life cannot stop themselves
+            data['count'] = Status.release_stale(qs, "cancelled")
+            data['count'] += qs.update(cancel=True)
+            if data['count'] == 0:
+                data['status'] = 'error'
+                data['msg'] = "There is no running synchronisation for {}/{}".format(username, synctype)
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("sync_crpp_stop error")
+        data = {'status': 'error'}
+
+    # Return this response
+    return JsonResponse(data)
+
 def adapt_search(val):
     # First trim
     val = val.strip()
@@ -903,6 +904,46 @@ class SentenceListView(ListView):
         return self.qs
 
 
+class SentenceSearchView(View):
+    """Search the cached sentences of all texts through the full-text index
+    
+    Parameters: q (the words to look for), part, format and limit (all optional except q).
+    The hits are returned best first, grouped by part and by text.
+    """
+
+    def get(self, request):
+        return self.search(request, request.GET)
+
+    def post(self, request):
+        return self.search(request, request.POST)
+
+    def search(self, request, qd):
+        data = {'status': 'ok', 'count': 0, 'parts': []}
+        if not request.user.is_authenticated:
+            data['status'] = "error"
+            data['msg'] = "Please log in before continuing"
+            return JsonResponse(data)
+        oErr = ErrHandle()
+        try:
+            sQuery = qd.get('q', "").strip()
+            iLimit = get_int_choice(qd, 'limit')
+            if iLimit <= 0:
+                iLimit = 100
+            data['query'] = sQuery
+            if sQuery != "":
+                lPart = Sentence.search_grouped(sQuery, qd.get('part'), qd.get('format'), iLimit)
+                for oPart in lPart:
+                    for oText in oPart['texts']:
+                        oText['url'] = reverse('text_lines', kwargs={'pk': oText['text']})
+                        data['count'] += len(oText['hits'])
+                data['parts'] = lPart
+        except:
+            data['status'] = "error"
+            data['msg'] = oErr.get_error_message()
+            oErr.DoError("SentenceSearchView")
+        return JsonResponse(data)
+
+
 class SentenceDetailView(DetailView):
     """Get and show the details of one sentence"""
 
@@ -1326,44 +1367,17 @@ class TextListView(ListView):
         if 'part' in get and get['part'] != '':
             lstQ.append(Q(part=get['part']))
 
-        # Filter on text Name
-        if 'fileName' in get and get['fileName'] != '':
-            # Allow simple wildcard search
-            val = adapt_search(get['fileName'])
-            lstQ.append(Q(fileName__iregex=val))
-
-        # Filter on text Genre
-        if 'genre' in get and get['genre'] != '':
-            # Allow simple wildcard search
-            val = adapt_search(get['genre'])
-            lstQ.append(Q(genre__iregex=val))
-
-        # Filter on text date
-        if 'date' in get and get['date'] != '':
-            # Allow simple wildcard search
-            val = adapt_search(get['date'])
-            lstQ.append(Q(date__iregex=val))
-
-        # Filter on text Title
-        if 'title' in get and get['title'] != '':
-            # Allow simple wildcard search
-            val = adapt_search(get['title'])
-            lstQ.append(Q(title__iregex=val))
-
-        # Filter on text Author
-        if 'author' in get and get['author'] != '':
-            # Allow simple wildcard search
-            val = adapt_search(get['author'])
-            lstQ.append(Q(author__iregex=val))
-
-        # Filter on text Subtype
-        if 'subtype' in get and get['subtype'] != '':
-            # Allow simple wildcard search
-            val = adapt_search(get['subtype'])
-            lstQ.append(Q(subtype__iregex=val))
-
-        # Make the query set available
-        qs = Text.objects.filter(*lstQ).distinct().select_related().order_by(
+        # Filter on the metadata fields, allowing simple wildcard search
+        oSearch = {}
+        for sField in ['fileName', 'genre', 'date', 'title', 'author', 'subtype']:
+            if sField in get and get[sField] != '':
+                val = adapt_search(get[sField])
+                lstQ.append(Q(**{"{}__iregex".format(sField): val}))
+                oSearch[sField] = get[sField]
+
+        # Make the query set available: the full-text index narrows down the texts the regular expressions check
+        qs = Text.index_filter(Text.objects.filter(*lstQ), oSearch)
+        qs = qs.distinct().select_related().order_by(
             Lower('part__corpus__name'),
             Lower('part__name'),
             Lower('fileName'))
@@ -5,6 +5,7 @@ from django.template import loader, Context
 from django.utils import timezone
 import base64, gzip, zlib
 import io
+import itertools
 # from io import StringIO
 import json
 import xml
@@ -12,9 +13,13 @@ import re
 
 # Application-specific
 from cesar import utils
-from cesar.seeker.models import Construction, ConstructionVariable, ERROR_CODE
+from cesar.seeker.models import Construction, ConstructionVariable, CodeGenerator, ERROR_CODE
 from cesar.settings import PROJECT_DIR
 
+DECOMPRESS_CHUNK_SIZE = 256 * 1024   # Number of base64 characters decoded at a time when streaming
+# Anything that is not part of the base64 alphabet (e.g. line breaks), as b64decode() leaves it out
+base64_ignore = re.compile(r'[^A-Za-z0-9+/~=]')
+
 def ConvertProjectToXquery(oData, basket):
     """Convert the project oData.gateway of type oData.targetType into Xquery suitable for oData.format"""
 
@@ -60,7 +65,12 @@ def ConvertProjectToXquery(oData, basket):
 
             # Search elements are the 'constructions'
             basket.set_status("collecting constructions")
-            constructions = gateway.constructions.all()
+            definition = oData.get('definition')
+            if definition == None:
+                definition = gateway.get_definition(format)
+            constructions = definition.constructions
+            # All function code is generated from the same definition, each function only once
+            generator = CodeGenerator(definition, format)
 
             # the names of the constructions plus their search group and specification
             search_list = gateway.get_search_list()
@@ -78,13 +88,13 @@ def ConvertProjectToXquery(oData, basket):
                 # The data-dependant variables need to be divided over the search elements
                 basket.set_status("converting data-dependant variables")
                 dvar_list = []
-                for var in gateway.get_vardef_list():
+                for var in definition.vardefs:
                     cvar_list = []
                     for cons in constructions:
                         # Determine what the construction variable is
-                        cvar = ConstructionVariable.objects.filter(construction=cons, variable=var).first()
+                        cvar = definition.get_cvar(cons, var)
                         try:
-                            oCode = cvar.get_code(format, method)
+                            oCode = cvar.get_code(format, method, generator)
                             oCvarInfo = {'grp': cons.name, 
                                          'code': oCode['main'],
                                          'type': cvar.type,
@@ -95,17 +105,16 @@ def ConvertProjectToXquery(oData, basket):
                             if 'error' in oCode:
                                 arErr.append("Error in the definition of variable {} for search element {}: {}".format(
                                     var.name,cons.name, oCode['error']))
-                            # Check for possible error(s)
-                            errors = gateway.get_errors()
-                            if errors != "" and errors != "[]":
-                                return "", ERROR_CODE
-                            else:
-                                cvar_list.append(oCvarInfo)
+                            cvar_list.append(oCvarInfo)
                         except:
                             iStop = True
                     # Add the cvar_list to the dvar_list
                     oDvarInfo = {'name': var.name, 'cvar_list': cvar_list}
                     dvar_list.append(oDvarInfo)
+                # Check for possible error(s) reported by the construction variables
+                errors = gateway.get_errors()
+                if errors != "" and errors != "[]":
+                    return "", ERROR_CODE, arErr
                 dvar_all = ", ".join(["$"+item['name'] for item in dvar_list])
 
                 # Also add the conditions
@@ -116,7 +125,7 @@ def ConvertProjectToXquery(oData, basket):
                     cnd.refresh_from_db()
                     # Double check the include value of this option
                     if cnd.include == "" or cnd.include == "true":
-                        oCode = cnd.get_code(format, method)
+                        oCode = cnd.get_code(format, method, generator)
                         sCode = oCode['main']
                         if sCode != "":
                             cond_list.append(sCode)
@@ -136,7 +145,7 @@ def ConvertProjectToXquery(oData, basket):
                     ft.refresh_from_db()
                     # Double check the include value of this option
                     if ft.include == "" or ft.include == "true" or ft.include == "yes":
-                        oCode = ft.get_code(format, method)
+                        oCode = ft.get_code(format, method, generator)
                         sCode = oCode['main']
                         if sCode != "":
                             feature_list.append({
@@ -197,7 +206,7 @@ def ConvertProjectToCrpx(basket):
         gateway = research.gateway
 
         # Get the name of the project
-        sCrpxName = research.name
+        sCrpxName = basket.get_crpx_name()
 
         # The format of what we process
         # Options: Xquery-Psdx, Folia-Xml, Negra-Tig, Alpino-Xml, Dbase
@@ -312,4 +321,62 @@ def decompressSafe(sInput, bKeepGzip = False, bUtf8 = False, bUsePlain = False):
     except:
         pass
     # Return the result
-    return data
\ No newline at end of file
+    return data
+
+def decompress_stream(sInput, bKeepGzip = False, bUtf8 = False, bUsePlain = False, iChunkSize = DECOMPRESS_CHUNK_SIZE):
+    """Generator version of decompressSafe(): yield the converted data in chunks
+    
+    Base64 decoding, zlib decompression and gzip compression are done per chunk of [iChunkSize]
+    characters, so that the whole result is never held in memory more than once.
+    Since the output is already UTF-8, it is passed on as bytes without decoding it.
+    Errors are logged and raised again, so that a download that has already started is
+    broken off instead of ending as a truncated file.
+    """
+
+    oErr = utils.ErrHandle()
+    iChunkSize = max(4, iChunkSize - iChunkSize % 4)
+    bDecompress = (bUtf8 and bKeepGzip)
+    bCompress = (bDecompress and not bUsePlain)
+    decompressor = zlib.decompressobj() if bDecompress else None
+    # Gzip compression: the same as gzip.compress(), but incremental
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31) if bCompress else None
+    # Characters that do not count (e.g. line breaks) are left out per chunk: base64 is decoded per 
+    # multiple of four characters that do count, and the rest is carried over to the next chunk
+    sRest = ""
+    try:
+        for iStart in range(0, len(sInput) + 1, iChunkSize):
+            sChunk = sRest + base64_ignore.sub("", sInput[iStart:iStart+iChunkSize])
+            if iStart + iChunkSize < len(sInput):
+                iUse = len(sChunk) - len(sChunk) % 4
+            else:
+                # The last chunk: whatever is left must be valid
+                iUse = len(sChunk)
+            sRest = sChunk[iUse:]
+            if iUse == 0:
+                continue
+            data = base64.b64decode(sChunk[:iUse], "~/", validate=True)
+            if decompressor != None:
+                data = decompressor.decompress(data)
+            if compressor != None:
+                data = compressor.compress(data)
+            if len(data) > 0:
+                yield data
+        # Flush whatever is left
+        data = decompressor.flush() if decompressor != None else b""
+        if compressor != None:
+            data = compressor.compress(data) + compressor.flush()
+        if len(data) > 0:
+            yield data
+    except:
+        oErr.DoError("decompress_stream")
+        raise
+
+def start_decompress_stream(sInput, bKeepGzip = False, bUtf8 = False, bUsePlain = False, iChunkSize = DECOMPRESS_CHUNK_SIZE):
+    """Start decompress_stream() and convert its first chunk right away
+    
+    Errors in the input (e.g. a bad zlib header) are raised here, before anything has been sent.
+    """
+
+    stream = decompress_stream(sInput, bKeepGzip, bUtf8, bUsePlain, iChunkSize)
+    first = next(stream, b"")
+    return itertools.chain([first], stream)
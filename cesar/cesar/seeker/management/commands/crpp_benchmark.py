@@ -0,0 +1,215 @@
+"""
+End-to-end benchmark of the seeker pipeline against the /crpp emulator
+
+    python manage.py crpp_benchmark --texts 1000 --hits 50 --pages 20
+
+The phases that are timed:
+    sync        (optional) /crpp/txtlist + process_textlist() to load the texts of the part
+    execute     Research.execute(): conversion to Xquery/CRPX, /crpp/crpset and /crpp/exe
+    progress    Basket.get_progress() until /crpp reports the search as completed
+    quantor     Basket.set_quantor() + create_kwic_objects(): ingesting the results
+    kwic_cold   KwicListView paging with an empty dbinfo cache
+    kwic_warm   KwicListView paging over the same pages again
+
+Everything is done in a temporary test database, into which the field choices of the
+configured database are copied. Use --configured-db to run in the configured database instead.
+"""
+
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from cesar.browser.models import Metavar, Corpus, Part, Text, Status, FieldChoice, choice_value, process_textlist, CORPUS_FORMAT
+from cesar.browser.services import crpp_client, CrppPoller, get_crpp_texts
+from cesar.seeker.emulator import CrppEmulator, SyntheticCorpus, EMULATOR_EXT
+from cesar.seeker.models import Gateway, Construction, SearchMain, Research, Basket, QCline
+from cesar.seeker.views import paginateEntries
+
+BENCHMARK_NAME = "crpp_benchmark"
+BENCHMARK_DIR = "BENCH"
+
+
+class Command(BaseCommand):
+    help = "Time Research.execute, progress, set_quantor and KWIC paging against a local /crpp emulator"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--texts', type=int, default=200, help="Number of texts in the benchmark part")
+        parser.add_argument('--hits', type=int, default=20, help="Average number of hits per text")
+        parser.add_argument('--qcs', type=int, default=1, help="Number of QC lines")
+        parser.add_argument('--subcats', type=int, default=3, help="Number of sub-categories per QC line")
+        parser.add_argument('--duration', type=float, default=1.0, help="Seconds that the emulated search takes")
+        parser.add_argument('--pages', type=int, default=10, help="Number of KWIC pages to visit")
+        parser.add_argument('--repeat', type=int, default=1, help="Number of runs")
+        parser.add_argument('--port', type=int, default=0, help="Port of the emulator (default: any free port)")
+        parser.add_argument('--sync', action='store_true', help="Load the texts through /crpp/txtlist")
+        parser.add_argument('--configured-db', action='store_true', 
+                            help="Run in the configured database instead of a temporary test database")
+        parser.add_argument('--keep', action='store_true', help="With --configured-db: keep the benchmark corpus and project")
+        parser.add_argument('--serve', action='store_true', help="Only run the emulator (until interrupted)")
+
+    def handle(self, *args, **options):
+        corpus = SyntheticCorpus(texts=options['texts'], hits=options['hits'],
+                                 qcs=options['qcs'], subcats=options['subcats'])
+        emulator = CrppEmulator(corpus, duration=options['duration'], port=options['port'])
+        if options['serve']:
+            self.stdout.write("Serving /crpp emulator on port {} (Ctrl-C to stop)".format(options['port']))
+            try:
+                emulator.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            return
+
+        sOldName = None
+        if not options['configured_db']:
+            # Never write into the configured (possibly production) database
+            lChoice = list(FieldChoice.objects.all())
+            sOldName = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            FieldChoice.objects.bulk_create(lChoice)
+            self.stdout.write("Using the temporary test database {}".format(connection.settings_dict['NAME']))
+        sHome = crpp_client.home
+        emulator.start()
+        crpp_client.home = emulator.home
+        part = None
+        research = None
+        try:
+            self.stdout.write("Emulator at {}: {} texts, ~{} hits per text, {} QC line(s)".format(
+                emulator.home, options['texts'], options['hits'], options['qcs']))
+            lRun = []
+            for iRun in range(options['repeat']):
+                oTimes = {}
+                part = self.get_part(corpus, options['sync'], oTimes)
+                research = self.get_research()
+                self.run_once(research, part, options['pages'], oTimes)
+                lRun.append(oTimes)
+                self.report(iRun + 1, oTimes)
+            if options['repeat'] > 1:
+                self.report("best", {sKey: min(oRun.get(sKey, 0) for oRun in lRun) for sKey in lRun[0]})
+            self.stdout.write("/crpp requests: {}".format(emulator.requests))
+            for sCommand, oStat in sorted(crpp_client.get_stats().items()):
+                self.stdout.write("  {:10} count={count:5} avg={avg_ms:8.1f}ms max={max_ms:8.1f}ms errors={errors}".format(
+                    sCommand, **oStat))
+        finally:
+            if sOldName != None:
+                connection.creation.destroy_test_db(sOldName, verbosity=0)
+            elif not options['keep']:
+                self.clean_up(research, part)
+            crpp_client.home = sHome
+            emulator.stop()
+
+    def get_part(self, corpus, bSync, oTimes):
+        """Get the benchmark part, making sure it has the texts that the emulator serves"""
+
+        metavar = Metavar.objects.filter(name=BENCHMARK_NAME).first()
+        if metavar == None:
+            metavar = Metavar.objects.create(name=BENCHMARK_NAME)
+        crp = Corpus.objects.filter(name=BENCHMARK_NAME).first()
+        if crp == None:
+            crp = Corpus.objects.create(name=BENCHMARK_NAME, lng="0", eth="0", metavar=metavar, status="0")
+        part = Part.objects.filter(corpus=crp, dir=BENCHMARK_DIR).first()
+        if part == None:
+            part = Part.objects.create(name=BENCHMARK_NAME, dir=BENCHMARK_DIR, corpus=crp, metavar=metavar)
+        format_choice = choice_value(CORPUS_FORMAT, EMULATOR_EXT)
+        qs = Text.objects.filter(part=part, format=format_choice)
+        lText = corpus.get_part(BENCHMARK_DIR)
+        if bSync:
+            fStart = time.time()
+            oStatus = Status.objects.create(type="crpp", user=BENCHMARK_NAME, status="contacting")
+            oTexts = get_crpp_texts(crp.get_lng_display(), BENCHMARK_DIR, EMULATOR_EXT, oStatus)
+            if oTexts.get('status') == "error":
+                raise Exception("Sync failed: {}".format(oTexts.get('code')))
+            process_textlist(oTexts, part, EMULATOR_EXT, oStatus, {'nodeleting': False, 'updating': False})
+            oStatus.delete()
+            oTimes['sync'] = time.time() - fStart
+        elif qs.count() != len(lText):
+            qs.delete()
+            Text.objects.bulk_create([Text(fileName=oText['name'], format=format_choice, part=part,
+                                           lines=oText['size'], words=oText['words'], title=oText['title'],
+                                           date=oText['date'], author=oText['author'],
+                                           genre=corpus.genres[oText['genre']],
+                                           subtype=corpus.subtypes[oText['subtype']]) for oText in lText])
+        return part
+
+    def get_research(self):
+        """Create a fresh benchmark project: a word search without variables"""
+
+        owner = User.objects.filter(username=BENCHMARK_NAME).first()
+        if owner == None:
+            owner = User.objects.create_user(username=BENCHMARK_NAME)
+        for research in Research.objects.filter(owner=owner, name=BENCHMARK_NAME):
+            research.delete()
+        gateway = Gateway.objects.create(name=BENCHMARK_NAME)
+        search = SearchMain.create_item("word-group", "hit*", 'groupmatches')
+        Construction.objects.create(name="hit", search=search, gateway=gateway)
+        return Research.objects.create(name=BENCHMARK_NAME, purpose="Benchmark", targetType="w",
+                                       gateway=gateway, owner=owner)
+
+    def run_once(self, research, part, iPages, oTimes):
+        basket = Basket.objects.create(research=research, part=part, format=EMULATOR_EXT,
+                                       status="created", jobid="")
+
+        fStart = time.time()
+        oBack = research.execute(basket)
+        oTimes['execute'] = time.time() - fStart
+        if oBack['status'] == "error":
+            raise Exception("Execute failed: {}".format(oBack.get('msg')))
+
+        fStart = time.time()
+        poller = CrppPoller(timeout=600)
+        while True:
+            oProgress = basket.get_progress()
+            if oProgress['commandstatus'] == "error":
+                raise Exception("Progress failed: {}".format(oProgress.get('msg')))
+            if oProgress.get('status') == "completed":
+                break
+            if not poller.wait(oProgress):
+                raise Exception("The search did not finish in time")
+        oTimes['progress'] = time.time() - fStart
+        oTimes['polls'] = poller.poll_count
+
+        fStart = time.time()
+        oBack = basket.set_quantor(oProgress)
+        if oBack['status'] == "error":
+            raise Exception("set_quantor failed: {}".format(oBack.get('msg')))
+        basket.create_kwic_objects()
+        oTimes['quantor'] = time.time() - fStart
+        # The number of text x subcategory counts stored in the matrices
+        oTimes['counts'] = sum(len(qcline.get_matrix().counts) for qcline in QCline.objects.filter(quantor__basket=basket))
+
+        # Page through the results of the first QC line as a logged-in user would
+        client = Client(HTTP_USER_AGENT=BENCHMARK_NAME, HTTP_HOST="localhost")
+        client.force_login(research.owner)
+        url = reverse('kwic_list', kwargs={'object_id': basket.id})
+        kwic = basket.get_kwic(1)
+        iPages = min(iPages, (kwic.hitcount + paginateEntries - 1) // paginateEntries) if kwic != None else 0
+        basket.clear_dbinfo()
+        for sPass in ['kwic_cold', 'kwic_warm']:
+            fStart = time.time()
+            for iPage in range(1, iPages + 1):
+                r = client.post(url, {'selected_qc': 1, 'page': iPage})
+                if r.status_code != 200 or r.json().get('status') != "ok":
+                    raise Exception("KWIC page {} failed".format(iPage))
+            oTimes[sPass] = time.time() - fStart
+        oTimes['pages'] = iPages
+
+    def report(self, sRun, oTimes):
+        lPhase = ["{}={:.3f}s".format(x, oTimes[x]) for x in ['sync', 'execute', 'progress', 'quantor',
+                                                              'kwic_cold', 'kwic_warm'] if x in oTimes]
+        sRate = ""
+        if oTimes.get('quantor', 0) > 0:
+            sRate = " ({:.0f} counts/s)".format(oTimes.get('counts', 0) / oTimes['quantor'])
+        self.stdout.write("Run {}: {}{}; {} polls, {} pages".format(
+            sRun, " ".join(lPhase), sRate, oTimes.get('polls', 0), oTimes.get('pages', 0)))
+
+    def clean_up(self, research, part):
+        if research != None:
+            research.delete()
+        if part != None:
+            crp = part.corpus
+            Text.objects.filter(part=part).delete()
+            part.delete()
+            if crp.corpus_parts.count() == 0:
+                crp.delete()
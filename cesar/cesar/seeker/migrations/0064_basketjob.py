@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seeker', '0063_auto_20210610_1318'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BasketJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jobtype', models.CharField(max_length=50, verbose_name='Job type')),
+                ('status', models.CharField(default='queued', max_length=50, verbose_name='Status')),
+                ('msg', models.TextField(blank=True, null=True, verbose_name='Message')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('basket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='basketjobs', to='seeker.Basket')),
+            ],
+            options={
+                'unique_together': {('basket', 'jobtype')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seeker', '0064_basketjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basket',
+            name='codehash',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Code hash'),
+        ),
+    ]
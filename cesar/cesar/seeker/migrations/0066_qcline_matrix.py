@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seeker', '0065_basket_codehash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='qcline',
+            name='matrix',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Hit matrix'),
+        ),
+        migrations.AddField(
+            model_name='qcline',
+            name='textids',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Text ids'),
+        ),
+        migrations.AddField(
+            model_name='qcline',
+            name='textnames',
+            field=models.TextField(blank=True, default='', verbose_name='Text names'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seeker', '0066_qcline_matrix'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuantorSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50, verbose_name='Kind')),
+                ('qc', models.IntegerField(default=1, verbose_name='QC number')),
+                ('name', models.CharField(blank=True, default='', max_length=200, verbose_name='Name')),
+                ('hits', models.IntegerField(default=0, verbose_name='Number of hits')),
+                ('texts', models.IntegerField(default=0, verbose_name='Texts with hits')),
+                ('lines', models.IntegerField(default=0, verbose_name='Number of lines')),
+                ('words', models.IntegerField(default=0, verbose_name='Number of words')),
+                ('quantor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='seeker.Quantor')),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seeker', '0067_quantorsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BasketGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(default='created', max_length=200, verbose_name='Status')),
+                ('options', models.TextField(blank=True, verbose_name='Search options')),
+                ('merged', models.TextField(blank=True, verbose_name='Merged summary')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('saved', models.DateTimeField(blank=True, null=True)),
+                ('research', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='basketgroups', to='seeker.Research')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='groupbaskets', to='seeker.BasketGroup'),
+        ),
+    ]
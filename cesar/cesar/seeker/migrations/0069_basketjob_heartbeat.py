@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seeker', '0068_basketgroup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basketjob',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='basketjob',
+            name='progress',
+            field=models.TextField(default='{}', verbose_name='Progress'),
+        ),
+    ]
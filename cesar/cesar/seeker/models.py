@@ -3,26 +3,43 @@
 The seeker helps users define and execute searches through the texts that
 are available at the back end
 """
-from django.db import models, transaction
-from django.db.models import Q, Aggregate, Sum
+from django.core.cache import cache
+from django.db import models, transaction, IntegrityError, close_old_connections, connection
+from django.db.models import Q, Aggregate, Count, Sum
 from django.contrib.auth.models import User, Group
 from django.urls import reverse
 from django.utils import timezone
-from datetime import datetime
+from datetime import datetime, timedelta
 from cesar.utils import *
-from cesar.settings import APP_PREFIX
+from cesar.settings import APP_PREFIX, KWIC_PREFETCH_DEPTH, KWIC_PREFETCH_WORKERS, FANOUT_WORKERS
 from cesar.browser.models import build_choice_list, build_abbr_list, \
                                  get_help, choice_value, choice_abbreviation, get_instance_copy, \
                                  copy_m2m, copy_fk, Part, CORPUS_FORMAT, Text, get_format_name
+from cesar.browser.services import CrppPoller
 from cesar.seeker.services import crpp_exe, crpp_send_crp, crpp_status, crpp_dbinfo, crpp_stop
 import sys
 import copy
+import hashlib
 import json
 import math
 import re
+import threading
+import time
+import zlib
+from array import array
+from concurrent.futures import wait, FIRST_COMPLETED
 
 MAX_NAME_LEN = 50
 MAX_TEXT_LEN = 200
+QUANTOR_BATCH_SIZE = 5000       # Number of text x subcat counts between two progress reports of set_quantor
+QUANTOR_WORKERS = 2             # Number of background threads ingesting completed search results into quantors
+BASKET_JOB_STALE = 600          # Seconds without a sign of life after which a queued/running basket job is taken over
+BASKET_JOB_HEARTBEAT = 60       # Seconds between two signs of life of a basket job that waits to be ingested
+WATCH_INTERVAL = 0.2            # Seconds between two rounds of the basket watcher over the searches it follows
+DBINFO_CACHE_SIZE = 500         # Number of /crpp/dbinfo replies (KWIC pages) kept in memory
+CRPX_CACHE_SIZE = 100           # Number of generated CRPX texts kept in memory
+MATRIX_CACHE_SIZE = 10          # Number of decoded QC line matrices kept in memory
+BASKET_STATUS_INTERVAL = 2.0    # Seconds between database writes of coalesced basket progress
     
 SEARCH_FUNCTION = "search.function"                 # woordgroep
 SEARCH_OPERATOR = "search.operator"                 # groeplijktop
@@ -61,6 +78,48 @@ STYPE_CHOICES = (
 # ============================= LOCAL CLASSES ======================================
 errHandle = ErrHandle()
 integer_format = re.compile(r'^\-?[0-9]+$')
+# Replies of /crpp/dbinfo for finished baskets, keyed on (basket id, jobid, qc, filter, start, count)
+dbinfo_cache = LruCache(DBINFO_CACHE_SIZE)
+# Generated CRPX texts, keyed on (basket id, codehash, project settings)
+crpx_cache = LruCache(CRPX_CACHE_SIZE)
+# Decoded QuantorMatrix objects, keyed on QCline id and a checksum of the stored matrix
+matrix_cache = LruCache(MATRIX_CACHE_SIZE)
+# Keys of the KWIC pages that are being fetched ahead
+dbinfo_pending = set()
+dbinfo_pending_lock = threading.Lock()
+
+def fetch_dbinfo(sKey, sUser, sCrpName, sPart, iQcNum, iStart, iCount, filter=None, sort=None):
+    """Ask /crpp/dbinfo for one page, and keep the reply in the cache if the results are complete"""
+
+    oData = crpp_dbinfo(sUser, sCrpName, iQcNum, iStart, iCount, filter=filter, sort=sort, sPart=sPart)
+    # Only keep replies for results that are complete
+    oStatus = oData.get('status')
+    sCode = oStatus.get('code') if isinstance(oStatus, dict) else oData.get('code')
+    if oData.get('commandstatus') == "ok" and sCode == "completed":
+        dbinfo_cache.set(sKey, oData)
+    return oData
+
+def prefetch_dbinfo(sKey, *args, **kwargs):
+    """Background job: fetch one KWIC page into the cache"""
+
+    try:
+        if dbinfo_cache.get(sKey) == None:
+            fetch_dbinfo(sKey, *args, **kwargs)
+    finally:
+        with dbinfo_pending_lock:
+            dbinfo_pending.discard(sKey)
+
+def raw_delete(qs):
+    """Delete the rows of [qs] in one statement, without first reading them (no signals, no cascading)"""
+    return qs._raw_delete(qs.db)
+
+def get_progress_code(oProgress):
+    """Get the status code from a /crpp progress reply (see Basket.get_progress)"""
+
+    sCode = oProgress.get('code', "")
+    if isinstance(oProgress.get('status'), dict):
+        sCode = oProgress['status'].get('code', sCode)
+    return sCode
 
 def is_integer(sInput):
     if sInput == None:
@@ -340,6 +399,215 @@ class GatewayManager(models.Manager):
         return gateway
 
 
+class GatewayDefinition():
+    """The definition tree of one gateway, loaded with a fixed number of queries
+
+    Constructions, data-dependant variables, construction variables, functions, arguments
+    and function codings are each fetched in one query and linked to each other in memory,
+    so that walking the constructions x variables does not cost a query per combination.
+    """
+
+    def __init__(self, gateway, format=None):
+        self.gateway = gateway
+        self.format = format
+        # Constructions and data-dependant variables
+        self.constructions = list(gateway.constructions.all().select_related('search'))
+        self.vardefs = list(gateway.get_vardef_list())
+        cons_dict = {}
+        for cons in self.constructions:
+            cons.gateway = gateway
+            cons_dict[cons.id] = cons
+        var_dict = {}
+        for var in self.vardefs:
+            var.gateway = gateway
+            var_dict[var.id] = var
+
+        # All the functions and their arguments
+        lstQ = Q(root__construction__gateway=gateway) | Q(rootcond__gateway=gateway) | Q(rootfeat__gateway=gateway)
+        self.functions = {}
+        self.root_functions = {}
+        for func in Function.objects.filter(lstQ).select_related('functiondef').order_by('line', 'id'):
+            self.functions[func.id] = func
+            if func.root_id != None:
+                self.root_functions.setdefault(func.root_id, []).append(func)
+        self.arguments = {}
+        qs = Argument.objects.filter(function__in=list(self.functions.keys())).select_related(
+            'argumentdef', 'gvar', 'cvar', 'dvar', 'raxis', 'rcond', 'rconst').order_by('argumentdef__order', 'id')
+        for arg in qs:
+            arg.function = self.functions[arg.function_id]
+            self.arguments.setdefault(arg.function_id, []).append(arg)
+
+        # The Xquery code of the function definitions that are used
+        self.codings = {}
+        lstQ = Q(functiondef__in=set(func.functiondef_id for func in self.functions.values()))
+        if format != None:
+            lstQ &= Q(format=format)
+        for code in FunctionCode.objects.filter(lstQ).order_by('id'):
+            self.codings.setdefault((code.functiondef_id, code.format), code)
+
+        # The construction variables for each construction/variable combination
+        self.cvars = {}
+        for cvar in ConstructionVariable.objects.filter(construction__gateway=gateway).select_related('gvar').order_by('id'):
+            if cvar.construction_id in cons_dict and cvar.variable_id in var_dict:
+                cvar.construction = cons_dict[cvar.construction_id]
+                cvar.variable = var_dict[cvar.variable_id]
+                if cvar.function_id != None and cvar.function_id in self.functions:
+                    cvar.function = self.functions[cvar.function_id]
+                self.cvars.setdefault((cvar.construction_id, cvar.variable_id), cvar)
+
+    def get_cvar(self, cons, var):
+        """Get the construction variable for this construction/variable combination (or None)"""
+        return self.cvars.get((cons.id, var.id))
+
+    def get_root_functions(self, cvar):
+        """Get all functions that have [cvar] as their root"""
+        return self.root_functions.get(cvar.id, [])
+
+    def add_function(self, func):
+        """Add [func], which was not loaded with the gateway, together with its arguments and function coding"""
+
+        if func.id in self.functions:
+            return self.functions[func.id]
+        self.functions[func.id] = func
+        qs = Argument.objects.filter(function=func).select_related(
+            'argumentdef', 'gvar', 'cvar', 'dvar', 'raxis', 'rcond', 'rconst').order_by('argumentdef__order', 'id')
+        for arg in qs:
+            arg.function = func
+            self.arguments.setdefault(func.id, []).append(arg)
+        if not any(key[0] == func.functiondef_id for key in self.codings):
+            lstQ = Q(functiondef=func.functiondef_id)
+            if self.format != None:
+                lstQ &= Q(format=self.format)
+            for code in FunctionCode.objects.filter(lstQ).order_by('id'):
+                self.codings.setdefault((code.functiondef_id, code.format), code)
+        return func
+
+    def get_content(self):
+        """Get the field values of everything in this definition, e.g. to calculate a hash over them
+        
+        Only the global variables, conditions and features are not part of the definition;
+        they are read here with one query each.
+        """
+
+        def get_values(obj):
+            return [getattr(obj, field.attname) for field in obj._meta.concrete_fields]
+
+        gateway = self.gateway
+        oContent = {}
+        oContent['constructions'] = [get_values(cons) + get_values(cons.search) for cons in self.constructions]
+        oContent['vardefs'] = [get_values(var) for var in self.vardefs]
+        oContent['cvars'] = [get_values(self.cvars[key]) for key in sorted(self.cvars.keys())]
+        oContent['functions'] = [get_values(self.functions[key]) for key in sorted(self.functions.keys())]
+        oContent['arguments'] = [[get_values(arg) for arg in self.arguments[key]] for key in sorted(self.arguments.keys())]
+        oContent['codings'] = [get_values(code) for code in self.codings.values()]
+        oContent['gvars'] = list(gateway.globalvariables.all().order_by('id').values_list())
+        oContent['conditions'] = list(gateway.conditions.all().order_by('id').values_list())
+        oContent['features'] = list(gateway.features.all().order_by('id').values_list())
+        return oContent
+
+
+class CodeGenerator():
+    """Generate the Xquery of the functions of one gateway for one format
+
+    Function codings, arguments and argument definitions come from a GatewayDefinition
+    and a single count query. The code of each function subtree is generated only once,
+    and the argument placeholders of a function are replaced in a single pass.
+    """
+
+    arg_pattern = re.compile(r'\$__?arg\[(\d+)\]')
+
+    def __init__(self, definition, format):
+        self.definition = definition
+        self.gateway = definition.gateway
+        self.format = format
+        self.codes = {}
+        # The function that belongs to each 'func' argument (the first one, as in Argument.get_code)
+        self.arg_functions = {}
+        for func_id in sorted(definition.functions.keys()):
+            func = definition.functions[func_id]
+            if func.parent_id != None:
+                self.arg_functions.setdefault(func.parent_id, func)
+        # The number of argument definitions of each function definition
+        lFuncDef = set(func.functiondef_id for func in definition.functions.values())
+        qs = ArgumentDef.objects.filter(function__in=lFuncDef).values('function').annotate(argdefs=Count('id'))
+        self.argdef_count = {item['function']: item['argdefs'] for item in qs}
+
+    def get_function(self, function_id):
+        return self.definition.functions.get(function_id)
+
+    def add_function(self, arg, func):
+        """Add [func], the function of 'func' argument [arg] that is not in the definition"""
+
+        self.definition.add_function(func)
+        self.arg_functions[arg.id] = func
+        if func.functiondef_id not in self.argdef_count:
+            self.argdef_count[func.functiondef_id] = ArgumentDef.objects.filter(function=func.functiondef_id).count()
+        return func
+
+    def get_vardefs_before(self, iOrder):
+        """Get the data-dependant variables that precede the one with order [iOrder]"""
+        return [var for var in self.definition.vardefs if var.order < iOrder]
+
+    def get_function_code(self, function, method="recursive"):
+        """Create and return the required Xquery for [function] (see Function.get_code)"""
+
+        sKey = (function.id, method)
+        if sKey in self.codes:
+            return self.codes[sKey]
+        oErr = ErrHandle()
+        sCode = ""
+        oBack = {'code': ''}
+        try:
+            code = self.definition.codings.get((function.functiondef_id, self.format))
+            if code == None:
+                # SOmething went wrong, so I am not able to get the code for this function
+                self.gateway.error_add("Cannot get the Xquery translation for function [{}]".format(function.functiondef.name))
+            else:
+                arg_list = self.definition.arguments.get(function.id, [])
+                # Check: compare the number of arguments
+                iArgNumDef = self.argdef_count.get(function.functiondef_id, 0)
+                if iArgNumDef != len(arg_list):
+                    oBack['error'] = "Function {} expects {} arguments, but gets {}".format(
+                        function.functiondef.name, iArgNumDef, len(arg_list))
+                lArgCode = []
+                for idx, arg in enumerate(arg_list):
+                    # Check this argument for validity
+                    sArgErr = arg.get_argument_error()
+                    if sArgErr != "":
+                        oBack['error'] = "Function {} reports an error in argument {}: {}".format(
+                            function.functiondef.name, idx+1, sArgErr)
+                    lArgCode.append(self.get_argument_code(arg, method))
+
+                # Replace both $__arg[n] and $_arg[n] in one go
+                def get_arg(match):
+                    iArg = int(match.group(1))
+                    return lArgCode[iArg-1] if 0 < iArg <= len(lArgCode) else match.group(0)
+                sCode = self.arg_pattern.sub(get_arg, code.xquery)
+
+                # If plain method, add assignment
+                if method == "plain":
+                    sCode = "let $__line{} := {}".format(function.get_line(), sCode)
+            oBack['code'] = sCode
+        except:
+            oErr.DoError("CodeGenerator/get_function_code error")
+            oBack['error'] = "function/get_code error: $ERROR_FUNCTION_{}".format(function.id)
+        self.codes[sKey] = oBack
+        return oBack
+
+    def get_argument_code(self, arg, method="recursive"):
+        """Create and return the Xquery for one argument (see Argument.get_code)"""
+
+        if arg.argtype == "func" and method == "recursive":
+            argfunction = self.arg_functions.get(arg.id)
+            if argfunction == None:
+                # Not part of the loaded definition: load it with its own arguments, or the code would be wrong
+                argfunction = arg.functionparent.all().select_related('functiondef').order_by('id').first()
+                if argfunction != None:
+                    self.add_function(arg, argfunction)
+            return "" if argfunction == None else self.get_function_code(argfunction)['code']
+        return arg.get_code(self.format, method)
+
+
 class Gateway(models.Model):
     """One gateway is one possible search definition
     
@@ -890,6 +1158,10 @@ class Gateway(models.Model):
             response = None
         return response
 
+    def get_definition(self, format=None):
+        """Load the definition tree of this gateway in one go"""
+        return GatewayDefinition(self, format)
+
     def get_vardef_list(self):
 
         # Get a list of all variables for this gateway
@@ -943,14 +1215,19 @@ class Gateway(models.Model):
             # Step 1: Add combination[s] of vardef/construction if it doesn't yet exist
             with transaction.atomic():
                 # Step 1: add CVAR for all Construction/Vardef combinations
-                for vardef in self.get_vardef_list():
+                existing = set(ConstructionVariable.objects.filter(construction__gateway=self).values_list(
+                    'variable_id', 'construction_id'))
+                construction_ids = list(self.constructions.values_list('id', flat=True))
+                cvar_new = []
+                for vardef_id in self.definitionvariables.values_list('id', flat=True):
                     # Walk all constructions
-                    for construction in self.constructions.all():
+                    for construction_id in construction_ids:
                         # Check if a cvar exists
-                        cvar = ConstructionVariable.objects.filter(variable=vardef, construction=construction).first()
-                        if cvar == None:
+                        if (vardef_id, construction_id) not in existing:
                             # Doesn't exist: create it
-                            cvar = ConstructionVariable.objects.create(variable=vardef, construction=construction)
+                            cvar_new.append(ConstructionVariable(variable_id=vardef_id, construction_id=construction_id))
+                if len(cvar_new) > 0:
+                    ConstructionVariable.objects.bulk_create(cvar_new)
 
             # Step 2: Find CVAR that do not belong to a gateway
             gateway_pk_list = [x['id'] for x in Gateway.objects.all().values("id")]
@@ -1009,11 +1286,12 @@ class Gateway(models.Model):
         oErr = ErrHandle()
         try:
             # Check all cvars
-            for cns in self.constructions.all():
-                for dvar in self.definitionvariables.all():
-                    cvar = ConstructionVariable.objects.filter(construction=cns, variable=dvar).first()
+            definition = self.get_definition()
+            for cns in definition.constructions:
+                for dvar in definition.vardefs:
+                    cvar = definition.get_cvar(cns, dvar)
                     if cvar != None:
-                        oCvarStatus = cvar.argcheck()
+                        oCvarStatus = cvar.argcheck(definition.get_root_functions(cvar))
                         if oCvarStatus != None and 'status' in oCvarStatus and oCvarStatus['status'] != "ok":
                             # Adapt the status
                             oStatus['status'] = "error"
@@ -1481,8 +1759,10 @@ class Function(models.Model):
             oBack['msg'] = oErr.get_error_message()
             return oBack
 
-    def get_code(self, format, method="recursive"):
+    def get_code(self, format, method="recursive", generator=None):
         """Create and return the required Xquery"""
+        if generator != None:
+            return generator.get_function_code(self, method)
         oErr = ErrHandle()
         sCode = ""
         oBack = {'code': ''}
@@ -2510,13 +2790,18 @@ class ConstructionVariable(models.Model):
         sVariable = self.variable.name
         return "[{}|{}]".format(sConstruction, sVariable)
 
-    def argcheck(self):
-        """Check the argument-compatibility of this function"""
+    def argcheck(self, function_list=None):
+        """Check the argument-compatibility of this function
+
+        If the cvar comes from a GatewayDefinition, its root functions can be passed
+        as [function_list]: the cvar has then just been loaded and need not be refreshed.
+        """
 
         # Assume the best
         oStatus = {'status': "ok", 'msg': ''}
         # Check if status needs to be calculated
-        self.refresh_from_db()
+        if function_list == None:
+            self.refresh_from_db()
         myStatus = json.loads(self.status)
         if not 'status' in myStatus or myStatus['status'] != "ok":
             # first check if we have a function or not
@@ -2524,7 +2809,8 @@ class ConstructionVariable(models.Model):
                 func_this = self.function
                 if func_this != None:
                     # Get all functions that have this cvar as root
-                    function_list = Function.objects.filter(root=self)
+                    if function_list == None:
+                        function_list = Function.objects.filter(root=self)
                     # Assume all is well
                     bArgCheck = True
                     for func in function_list:
@@ -2630,7 +2916,7 @@ class ConstructionVariable(models.Model):
         # Return the new copy
         return new_copy
 
-    def get_code(self, format, method):
+    def get_code(self, format, method, generator=None):
         """Provide Xquery 'main' and 'def' code for this cns var"""
 
         oErr = ErrHandle()
@@ -2661,12 +2947,15 @@ class ConstructionVariable(models.Model):
                     sMain = "'{}'".format(sValue.replace("'", "''"))
             elif self.type == "calc":
                 # Find out which definition variables are available for me
-                lstQ = []
-                lstQ.append(Q(gateway=self.construction.gateway))
-                lstQ.append(Q(order__lt=self.variable.order))
-                qs = VarDef.objects.filter(*lstQ).order_by('order')
+                if generator != None:
+                    qs = generator.get_vardefs_before(self.variable.order)
+                else:
+                    lstQ = []
+                    lstQ.append(Q(gateway=self.construction.gateway))
+                    lstQ.append(Q(order__lt=self.variable.order))
+                    qs = list(VarDef.objects.filter(*lstQ).order_by('order'))
                 oBack['dvars'] = ", ".join( ["$" + item.name for item in qs])
-                oBack['dvarnum'] = qs.count()
+                oBack['dvarnum'] = len(qs)
                 # Check if a function has been defined
                 if self.function == None:
                     # This is not good: no function specified
@@ -2674,7 +2963,7 @@ class ConstructionVariable(models.Model):
                       self.variable.name, self.construction.name))
                     return ERROR_CODE
                 elif method == "recursive":
-                    oMain = self.function.get_code(format, method)
+                    oMain = self.function.get_code(format, method, generator)
                     sMain = oMain['code']
                     if 'error' in oMain:
                         oBack['error'] = oMain['error']
@@ -2889,7 +3178,7 @@ class Condition(models.Model):
         # Return the new copy
         return new_copy
 
-    def get_code(self, format, method):
+    def get_code(self, format, method, generator=None):
         """Create and return the required Xquery for main and def"""
 
         oBack = {'main': "", 'def': "", 'dvars': []}
@@ -2905,7 +3194,10 @@ class Condition(models.Model):
         elif self.condtype == "func":
             if method == "recursive":
                 # REturn the code of this function
-                oMain = self.function.get_code(format, method)
+                function = generator.get_function(self.function_id) if generator != None else None
+                if function == None:
+                    function = self.function
+                oMain = function.get_code(format, method, generator)
                 sMain = oMain['code']
                 if 'error' in oMain:
                     oBack['error'] = oMain['error']
@@ -3123,7 +3415,7 @@ class Feature(models.Model):
         # Return the new copy
         return new_copy
 
-    def get_code(self, format, method):
+    def get_code(self, format, method, generator=None):
         """Create and return the required Xquery"""
 
         oBack = {'main': "", 'def': "", 'dvars': []}
@@ -3138,7 +3430,10 @@ class Feature(models.Model):
         elif self.feattype == "func":
             if method == "recursive":
                 # REturn the code of this function
-                oMain = self.function.get_code(format, method)
+                function = generator.get_function(self.function_id) if generator != None else None
+                if function == None:
+                    function = self.function
+                oMain = function.get_code(format, method, generator)
                 sMain = oMain['code']
                 if 'error' in oMain:
                     oBack['error'] = oMain['error']
@@ -3375,8 +3670,9 @@ class Research(models.Model):
                 grp.delete()
 
             # Delete all Basket objects (=RESULTS) pointing to me
-            for bsk in self.baskets.all():
-                bsk.delete()
+            for basket_id in self.baskets.values_list('id', flat=True):
+                dbinfo_cache.delete_where(lambda key: key[0] == basket_id)
+            Basket.purge_results(self.baskets.all(), bDeleteBaskets=True)
         except:
             sMsg = oErr.get_error_message()
 
@@ -3670,6 +3966,28 @@ class Research(models.Model):
         """Reset project"""
         pass
 
+    def get_codehash(self, sFormat, definition=None):
+        """Calculate a hash over everything the Xquery code for [sFormat] is generated from
+        
+        This covers the gateway (variables, constructions, functions, arguments, conditions
+        and features), the target type and the function code for this format, as loaded
+        in the GatewayDefinition [definition].
+        """
+
+        oErr = ErrHandle()
+        sHash = ""
+        try:
+            if definition == None:
+                definition = self.gateway.get_definition(sFormat)
+            oContent = dict(targetType=self.targetType, format=sFormat, gateway=definition.get_content())
+            sContent = json.dumps(oContent, sort_keys=True, default=str)
+            sHash = hashlib.sha256(sContent.encode("utf-8")).hexdigest()
+        except:
+            # The code is then generated afresh, but this should not go unnoticed
+            oErr.DoError("Research/get_codehash error")
+            sHash = ""
+        return sHash
+
     def to_xquery(self, partId, sFormat, bRefresh, basket):
         """Translate project into Xquery"""
 
@@ -3684,7 +4002,20 @@ class Research(models.Model):
             # Prepare data
             oData = {'targetType': self.targetType,
                      'format': sFormat,
-                     'gateway': self.gateway}
+                     'gateway': self.gateway,
+                     'definition': self.gateway.get_definition(sFormat)}
+
+            # Code generated earlier from exactly the same gateway content can be re-used
+            sHash = self.get_codehash(sFormat, oData['definition'])
+            if bRefresh and sHash != "":
+                source = Basket.objects.filter(codehash=sHash, format=sFormat).exclude(
+                    codedef="").exclude(codeqry="").exclude(status="error").order_by('-saved').first()
+                if source != None:
+                    basket.codedef = source.codedef
+                    basket.codeqry = source.codeqry
+                    basket.codehash = sHash
+                    basket.save()
+                    bRefresh = False
 
             # Check if we have Xquery code and there is no 'error' status
             if bRefresh or basket.codedef == "" or basket.codeqry == "" or basket.get_status() == "error":
@@ -3700,6 +4031,7 @@ class Research(models.Model):
                     errHandle.Status("Error in to_xquery: {}".format(errors))
                     return None
                 # Save the basket
+                basket.codehash = sHash
                 basket.save()
 
 
@@ -3785,7 +4117,14 @@ class Research(models.Model):
         # Create CRPX project
         basket.set_status("create_crpx")
         try:
-            sCrpxName, sCrpxText = ConvertProjectToCrpx(basket)
+            sKey = (basket.id, basket.codehash, basket.part_id, self.name, self.purpose, self.owner_id)
+            oCrpx = crpx_cache.get(sKey) if basket.codehash != "" else None
+            if oCrpx == None:
+                sCrpxName, sCrpxText = ConvertProjectToCrpx(basket)
+                if sCrpxName != "" and basket.codehash != "":
+                    crpx_cache.set(sKey, (sCrpxName, sCrpxText))
+            else:
+                sCrpxName, sCrpxText = oCrpx
             oBack['crpx_text'] = sCrpxText
             oBack['crpx_name'] = sCrpxName
         except:
@@ -3847,6 +4186,10 @@ class Research(models.Model):
         else:
             oOptions = json.loads(basket.options)
 
+        # Any earlier background jobs and cached results of this basket no longer apply
+        basket.clear_jobs()
+        basket.clear_dbinfo()
+
         # Convert the project
         basket.set_status("creating crpx")
         oBack = self.to_crpx(partId, sFormat, basket)
@@ -3953,6 +4296,222 @@ class Research(models.Model):
         return oBack
 
 
+class BasketGroup(models.Model):
+    """A group of baskets that execute one research project over several corpus parts
+    
+    One background job converts the baskets, sends them to /crpp and starts them one after
+    the other; other background threads follow them at /crpp and ingest the results, at most
+    FANOUT_WORKERS at a time. When all of them are finished, the summaries of their quantors are merged.
+    """
+
+    # [1] The status of the group: created, running, completed, error, stopped
+    status = models.CharField("Status", max_length=MAX_TEXT_LEN, default="created")
+    # [0-1] Options (in JSON string) for the searches in this group
+    options = models.TextField("Search options", blank=True)
+    # [0-1] The merged summary (in JSON string) over all the baskets
+    merged = models.TextField("Merged summary", blank=True)
+    # [0-1] create date and lastsave date
+    created = models.DateTimeField(default=timezone.now)
+    saved = models.DateTimeField(null=True, blank=True)
+    # [1] Each group is linked to one research project
+    research = models.ForeignKey(Research, blank=False, null=False, on_delete=models.CASCADE, related_name="basketgroups")
+
+    def __str__(self):
+        return "{}_group{}: {}".format(self.research.name, self.id, self.status)
+
+    def save(self, force_insert = False, force_update = False, using = None, update_fields = None):
+        # Adapt the save date
+        self.saved = timezone.now()
+        response = super(BasketGroup, self).save(force_insert, force_update, using, update_fields)
+        return response
+
+    def create(research, lPartFormat, oOptions = None):
+        """Create or reuse the group for [research] with a basket per (part, format) in [lPartFormat]
+        
+        The group of an earlier multi-part execution is reused: its baskets for the same (part, format)
+        are kept, so that their /crpp projects are overwritten instead of added. The results of its
+        other baskets, and any older groups, are deleted. A group that is still running is returned as it is.
+        """
+
+        sOptions = json.dumps(oOptions) if oOptions != None else ""
+        with transaction.atomic():
+            group = BasketGroup.objects.select_for_update().filter(research=research).order_by('-id').first()
+            if group != None and group.status in ["running", "merging"]:
+                return group
+            if group == None:
+                group = BasketGroup.objects.create(research=research, options=sOptions)
+            else:
+                group.options = sOptions
+                group.merged = ""
+                group.status = "created"
+                group.save()
+            # The baskets of older groups, and those of this group that are not needed anymore, go
+            lWanted = [(part.id, sFormat) for part, sFormat in lPartFormat]
+            lOld = [id for id, group_id, part_id, sFormat in Basket.objects.filter(
+                        research=research, group__isnull=False).values_list('id', 'group_id', 'part_id', 'format')
+                    if group_id != group.id or not (part_id, sFormat) in lWanted]
+            Basket.purge_results(Basket.objects.filter(id__in=lOld), bDeleteBaskets=True)
+            BasketGroup.objects.filter(research=research).exclude(id=group.id).delete()
+            # Keep the baskets of the same part/format and add the missing ones
+            lKeep = []
+            for basket in group.groupbaskets.all():
+                basket.clear_dbinfo()
+                lKeep.append((basket.part_id, basket.format))
+            group.groupbaskets.update(status="prepared", jobid="", options=sOptions, saved=timezone.now())
+            Basket.objects.bulk_create([Basket(research=research, part=part, format=sFormat, group=group,
+                                               status="prepared", jobid="", options=sOptions, saved=timezone.now()) 
+                                        for part, sFormat in lPartFormat if not (part.id, sFormat) in lKeep])
+        return group
+
+    def set_status(self, sStatus):
+        self.status = sStatus
+        BasketGroup.objects.filter(id=self.id).update(status=sStatus, saved=timezone.now())
+        return True
+
+    def start(self):
+        """Queue all baskets of this group for execution; returns False if the group is already running"""
+
+        # Only one request (in whatever process) may start the group
+        if BasketGroup.objects.filter(id=self.id).exclude(status__in=["running", "merging"]).update(
+            status="running", merged="", saved=timezone.now()) == 0:
+            return False
+        self.status = "running"
+        self.merged = ""
+        run_in_background("fanout_start", self.run_group, iWorkers=FANOUT_WORKERS)
+        return True
+
+    def stop(self):
+        """Stop the baskets that are still running at /crpp"""
+
+        self.set_status("stopped")
+        for basket in self.groupbaskets.exclude(jobid=""):
+            if basket.get_status() not in ["completed", "error", "stopped"]:
+                self.research.stop_execute(basket)
+        return True
+
+    def run_group(self):
+        """Background job: start the baskets at /crpp one after the other
+        
+        Each basket that has been started is followed by a thread of its own. A next basket is
+        only started when fewer than FANOUT_WORKERS baskets are being followed.
+        """
+
+        oErr = ErrHandle()
+        lFuture = set()
+        for basket in self.groupbaskets.all().select_related('part', 'part__corpus').order_by('part__name', 'id'):
+            try:
+                while len(lFuture) >= FANOUT_WORKERS:
+                    done, lFuture = wait(lFuture, return_when=FIRST_COMPLETED)
+                if self.get_status() == "stopped":
+                    basket.set_status("stopped")
+                    continue
+                oBack = self.research.execute(basket)
+                if oBack['status'] == "error":
+                    basket.set_status("error")
+                else:
+                    lFuture.add(run_in_background("fanout", self.run_basket, basket.id, iWorkers=FANOUT_WORKERS))
+            except:
+                oErr.DoError("BasketGroup/run_group")
+                basket.set_status("error")
+        # Baskets that did not get to /crpp may be the last ones to finish
+        self.check_finished()
+        return True
+
+    def run_basket(self, basket_id):
+        """Background job: wait for /crpp to finish one basket and ingest the results"""
+
+        oErr = ErrHandle()
+        basket = Basket.objects.filter(id=basket_id).first()
+        if basket == None:
+            return None
+        try:
+            # Follow the search and ingest the results (unless a progress request already started that)
+            job, bStart = BasketJob.claim(basket, "quantor")
+            if bStart:
+                job.watch(fn_stop=lambda: self.get_status() == "stopped")
+            else:
+                poller = CrppPoller(initial=1.0)
+                while job.is_active() and poller.wait():
+                    job.refresh_from_db()
+            sCode = get_progress_code(job.get_progress())
+            if self.get_status() == "stopped" or job.msg == "stopped":
+                basket.set_status("stopped")
+            elif job.status == "done" and sCode == "completed":
+                basket.set_status("completed")
+            else:
+                basket.set_status("error")
+        except:
+            oErr.DoError("BasketGroup/run_basket")
+            basket.set_status("error")
+        self.check_finished()
+        return basket.status
+
+    def get_status(self):
+        sStatus = BasketGroup.objects.filter(id=self.id).values_list('status', flat=True).first()
+        if sStatus != None:
+            self.status = sStatus
+        return self.status
+
+    def get_progress(self):
+        """Get the status of all baskets: a list of {basket, part, status} and the number finished"""
+
+        lBasket = []
+        iFinished = 0
+        for basket in self.groupbaskets.all().select_related('part').order_by('part__name'):
+            sStatus = basket.get_status()
+            if sStatus in ["completed", "error", "stopped"]:
+                iFinished += 1
+            lBasket.append(dict(basket=basket.id, part=basket.part.name, status=sStatus))
+        return dict(status=self.get_status(), baskets=lBasket, finished=iFinished, total=len(lBasket))
+
+    def check_finished(self):
+        """Merge the results once the last basket has finished"""
+
+        with transaction.atomic():
+            lStatus = list(Basket.objects.filter(group=self).values_list('status', flat=True))
+            if any(sStatus not in ["completed", "error", "stopped"] for sStatus in lStatus):
+                return False
+            # Only one thread may do the merge
+            sPrevious = self.get_status()
+            if sPrevious not in ["running", "stopped"] or \
+               BasketGroup.objects.filter(id=self.id, status=sPrevious).update(status="merging") == 0:
+                return False
+        self.merge()
+        if sPrevious == "stopped":
+            self.set_status("stopped")
+        else:
+            self.set_status("completed" if all(sStatus == "completed" for sStatus in lStatus) else "error")
+        return True
+
+    def merge(self):
+        """Sum the summaries of the quantors of all baskets into one merged summary"""
+
+        lRow = QuantorSummary.objects.filter(quantor__basket__group=self).values('qc', 'kind', 'name').annotate(
+            sum_hits=Sum('hits'), sum_texts=Sum('texts'), sum_lines=Sum('lines'), sum_words=Sum('words')
+            ).order_by('qc', 'kind', 'name')
+        lMerged = [dict(qc=row['qc'], kind=row['kind'], name=row['name'], hits=row['sum_hits'], 
+                        texts=row['sum_texts'], lines=row['sum_lines'], words=row['sum_words']) for row in lRow]
+        self.merged = json.dumps(lMerged)
+        BasketGroup.objects.filter(id=self.id).update(merged=self.merged)
+        return lMerged
+
+    def get_summary(self):
+        """Get the merged summary in the same layout as Quantor.get_summary()"""
+
+        lBack = []
+        oQc = None
+        lMerged = json.loads(self.merged) if self.merged != "" else []
+        for row in lMerged:
+            if oQc == None or oQc['qc'] != row['qc']:
+                oQc = {'qc': row['qc'], 'total': None, 'subcat': [], 'genre': [], 'subtype': []}
+                lBack.append(oQc)
+            if row['kind'] == "total":
+                oQc['total'] = row
+            else:
+                oQc[row['kind']].append(row)
+        return lBack
+
+
 class Basket(models.Model):
     """A basket of material needed for the transformation and execution of a research project"""
 
@@ -3969,6 +4528,8 @@ class Basket(models.Model):
     status = models.CharField("Status", max_length=MAX_TEXT_LEN)
     # [0-1] The jobid generated by /crpp
     jobid = models.CharField("Job identifier", max_length=MAX_NAME_LEN, blank=True)
+    # [0-1] Hash of the gateway content from which codedef and codeqry have been generated
+    codehash = models.CharField("Code hash", max_length=64, blank=True)
     # [0-1] Options (in JSON string) for this particular search
     options = models.TextField("Search options", blank=True)
     # [0-1] create date and lastsave date
@@ -3976,20 +4537,52 @@ class Basket(models.Model):
     saved = models.DateTimeField(null=True, blank=True)
     # [1] Each basket is linked to one research project
     research = models.ForeignKey(Research, blank=False, null=False, on_delete=models.CASCADE, related_name="baskets")
+    # [0-1] A basket may be part of a multi-part search
+    group = models.ForeignKey(BasketGroup, blank=True, null=True, on_delete=models.SET_NULL, related_name="groupbaskets")
 
     def __str__(self):
         # COmbine: research project name, research id, processing status
         return "{}_{}: {}".format(self.research.name, self.id, self.status)
 
     def delete(self, using = None, keep_parents = False):
-        # Delete all Quantor objects associated with me
-        for q in self.myquantor.all():
-            q.delete()
-        # Delete all  kwiclines
-        for k in self.kwiclines.all():
-            k.delete()
+        # Cached KWIC pages of this basket are no longer valid
+        self.clear_dbinfo()
+        # Delete all Quantor, Kwic and job objects associated with me
+        Basket.purge_results(Basket.objects.filter(id=self.id))
         return super(Basket, self).delete(using, keep_parents)
 
+    def delete_in_background(self):
+        """Delete this basket and its results in a background job"""
+
+        self.clear_dbinfo()
+        self.set_status("deleting")
+        return run_in_background("purge", self.run_delete, iWorkers=1)
+
+    def run_delete(self):
+        """Background job of delete_in_background(): if deleting fails, the user can try again"""
+
+        oErr = ErrHandle()
+        try:
+            return Basket.purge_results(Basket.objects.filter(id=self.id), bDeleteBaskets=True)
+        except:
+            oErr.DoError("Basket/run_delete")
+            self.set_status("error: delete failed")
+            return None
+
+    def purge_results(qs, bDeleteBaskets = False):
+        """Remove the quantors, KWIC objects and jobs of the baskets in [qs] with a few set-based statements
+        
+        If [bDeleteBaskets] is set, the baskets themselves are removed too. Returns the number of rows deleted.
+        """
+
+        with transaction.atomic():
+            iCount = Quantor.purge(Quantor.objects.filter(basket__in=qs))
+            iCount += Kwic.purge(Kwic.objects.filter(basket__in=qs))
+            iCount += raw_delete(BasketJob.objects.filter(basket__in=qs))
+            if bDeleteBaskets:
+                iCount += raw_delete(qs)
+        return iCount
+
     def get_delete_url(self):
         """Produce an URL to be called when requesting to delete [self]"""
 
@@ -4001,22 +4594,141 @@ class Basket(models.Model):
         response = super(Basket, self).save(force_insert, force_update, using, update_fields)
         return response
 
-    def set_status(self, sStatus):
+    def get_status_key(self):
+        return "basket_status_{}".format(self.id)
+
+    def get_crpx_name(self):
+        """The name of the project at /crpp that this basket is sent as
+        
+        The baskets of a group run at /crpp at the same time, so each of them has its own name.
+        """
+
+        if self.group_id == None:
+            return self.research.name
+        return "{}_b{}".format(self.research.name, self.id)
+
+    def set_status(self, sStatus, phase=None, done=None, total=None):
+        """Set the status of this basket
+
+        Only the status column is written. Progress messages (those with a [phase]) also
+        go to the cache, and are written to the database at most every BASKET_STATUS_INTERVAL
+        seconds, so that long ingestions do not keep the database busy. Messages without a
+        phase, the first message of a phase and its final one (done == total) are always written.
+        """
+
         oErr = ErrHandle()
         self.status = sStatus
-        self.save()
-        oErr.Status("Basket status="+sStatus)
+        sKey = self.get_status_key()
+        fNow = time.time()
+        oProgress = cache.get(sKey)
+        bStore = True
+        if phase != None and oProgress != None and oProgress.get('phase') == phase and (done == None or done != total):
+            # Coalesce: only store when the previous write was long enough ago
+            bStore = (fNow - oProgress.get('stored_at', 0) >= BASKET_STATUS_INTERVAL)
+        oNew = dict(status=sStatus, phase=phase, done=done, total=total, time=fNow, stored=bStore,
+                    stored_at=fNow if bStore else oProgress.get('stored_at', 0))
+        cache.set(sKey, oNew, None)
+        if bStore:
+            Basket.objects.filter(id=self.id).update(status=sStatus, saved=timezone.now())
+            oErr.Status("Basket status="+sStatus)
         return True
 
     def get_status(self):
-        self.refresh_from_db()
+        """Get the most recent status, without reloading the whole basket"""
+
+        oProgress = cache.get(self.get_status_key())
+        oRow = Basket.objects.filter(id=self.id).values('status', 'saved').first()
+        if oProgress != None and not oProgress['stored'] and (oRow == None or oRow['saved'] == None or oProgress['time'] > oRow['saved'].timestamp()):
+            # The most recent progress message has not yet been written to the database
+            self.status = oProgress['status']
+        elif oRow != None:
+            # The cache may hold a message of this process that is older than the status
+            # written since, e.g. by another process
+            self.status = oRow['status']
         return self.status
 
+    def get_progress_info(self):
+        """Get the structured progress: status, phase, done, total"""
+
+        oProgress = cache.get(self.get_status_key())
+        if oProgress == None or oProgress['status'] != self.get_status():
+            oProgress = dict(status=self.status, phase=None, done=None, total=None)
+        return dict(status=oProgress['status'], phase=oProgress['phase'], 
+                    done=oProgress['done'], total=oProgress['total'])
+
     def set_jobid(self, jobid):
         self.jobid = jobid
         self.save()
         return True
 
+    def clear_jobs(self):
+        """Remove the background jobs of an earlier execution"""
+        self.basketjobs.all().delete()
+        return True
+
+    def clear_dbinfo(self):
+        """Remove the cached /crpp/dbinfo replies of this basket"""
+        basket_id = self.id
+        return dbinfo_cache.delete_where(lambda key: key[0] == basket_id)
+
+    def get_dbinfo_key(self, iQcNum, iStart, iCount, filter=None, sort=None):
+        return (self.id, self.jobid, int(iQcNum), json.dumps(filter, sort_keys=True), 
+                json.dumps(sort, sort_keys=True), iStart, iCount)
+
+    def get_dbinfo(self, iQcNum, iStart, iCount, filter=None, sort=None):
+        """Get the /crpp/dbinfo reply for one KWIC page, preferably from the cache
+
+        The results of a finished basket do not change, so a successful reply is kept
+        until the basket is executed again or deleted.
+        """
+
+        sKey = self.get_dbinfo_key(iQcNum, iStart, iCount, filter, sort)
+        oData = dbinfo_cache.get(sKey)
+        if oData == None:
+            oData = fetch_dbinfo(sKey, self.research.owner.username, self.get_crpx_name(), self.part.dir,
+                                 iQcNum, iStart, iCount, filter=filter, sort=sort)
+        return oData
+
+    def prefetch_dbinfo(self, iQcNum, iPage, iPageSize, iHitCount, filter=None, sort=None, iDepth=None):
+        """Fetch the KWIC pages around [iPage] into the cache in the background
+        
+        Pages that are cached or already being fetched are skipped. At most KWIC_PREFETCH_WORKERS
+        requests go to /crpp at the same time, and no more than a few pages per worker are queued.
+        """
+
+        if iDepth == None:
+            iDepth = KWIC_PREFETCH_DEPTH
+        iPages = (iHitCount + iPageSize - 1) // iPageSize
+        iQueued = 0
+        sUser = self.research.owner.username
+        sCrpName = self.get_crpx_name()
+        sPart = self.part.dir
+        for iOffset in range(1, iDepth + 1):
+            for iOther in (iPage + iOffset, iPage - iOffset):
+                if iOther < 1 or iOther > iPages:
+                    continue
+                iStart = (iOther - 1) * iPageSize
+                sKey = self.get_dbinfo_key(iQcNum, iStart, iPageSize, filter, sort)
+                if dbinfo_cache.get(sKey) != None:
+                    continue
+                with dbinfo_pending_lock:
+                    if sKey in dbinfo_pending or len(dbinfo_pending) >= 4 * KWIC_PREFETCH_WORKERS:
+                        continue
+                    dbinfo_pending.add(sKey)
+                run_in_background("kwic_prefetch", prefetch_dbinfo, sKey, sUser, sCrpName, sPart, 
+                                  iQcNum, iStart, iPageSize, filter=filter, sort=sort, 
+                                  iWorkers=KWIC_PREFETCH_WORKERS)
+                iQueued += 1
+        return iQueued
+
+    def get_watch_job(self):
+        """Get the background job that follows the search at /crpp and ingests its results, starting it if needed"""
+
+        job, bStart = BasketJob.claim(self, "quantor")
+        if bStart:
+            job.follow()
+        return job
+
     def get_progress(self):
         """Issue a progress request for this job and return the status"""
 
@@ -4057,17 +4769,24 @@ class Basket(models.Model):
         # And then we return what we have
         return oBack
 
-    def set_quantor(self, oResults):
-        """Get or create a quantor and put all the results from [oResults] into it"""
+    def set_quantor(self, oResults, iBatchSize = None):
+        """Get or create a quantor and put all the results from [oResults] into it
+
+        The counts per text and subcategory are only stored in the compact matrix of each QC line:
+        a Qsubinfo row is made when a user opens one cell (see QCline.get_qsubinfo).
+        Progress is reported after every [iBatchSize] counts (default: QUANTOR_BATCH_SIZE)
+        """
 
         oErr = ErrHandle()
         oBack = {'status': 'ok'}
+        if iBatchSize == None or iBatchSize <= 0:
+            iBatchSize = QUANTOR_BATCH_SIZE
         try:
             self.set_status("creating quantor")
             # Get all quantors (if any) still attached to me
             qs = Quantor.objects.filter(basket=self)
             # Remove them
-            qs.delete()
+            Quantor.purge(qs)
 
             # Preparation: get necessary instances
             instPart = self.part
@@ -4083,6 +4802,23 @@ class Basket(models.Model):
             quantor = Quantor(basket=self, searchTime=oResults['searchTime'],
                                 total=iFiles, qcNum=iNumQc)
             quantor.save()
+            # Load the texts of this part/format once: {fileName: (id, lines, words)}
+            text_index = Text.get_text_index(instPart, instFormat)
+            # Check if there are any texts
+            if len(text_index) == 0:
+                msg = "set_quantor error: there are no texts of type {} in part {}".format(
+                    get_format_name(instFormat), instPart )
+                oBack['status'] = 'error'
+                oBack['msg'] = msg
+                return oBack
+            # The file names of the hits without extension (the same files return in each QC line)
+            file_names = {}
+            # Text information for the summary: {id: (lines, words, genre, subtype)}
+            text_info = {oText[0]: oText[1:] for oText in text_index.values()}
+            lstSummary = []
+            # Keep track of the ingestion speed
+            iRowsTotal = 0
+            fStart = time.time()
             # Get or create the required QC lines
             for idx in range(0, iNumQc):
                 # Access the result information for this QC
@@ -4091,91 +4827,89 @@ class Basket(models.Model):
                 qc = idx + 1
                 qcline = QCline(quantor=quantor, qc=qc, count=oQcResults['total'])
                 qcline.save()
-                # Create all the necessary subcategories
+                # Create all the necessary subcategories in one go
                 numsubcats = len(oQcResults['subcats'])
-                subcats = []
-                with transaction.atomic():
-                    for subnum in range(0, numsubcats):
-                        # Get or create this subject
-                        qsubcat = Qsubcat(qcline=qcline, 
-                                            name=oQcResults['subcats'][subnum],
-                                            count=oQcResults['counts'][subnum])
-                        qsubcat.save()
-                        subcats.append(qsubcat)
-                last_file = ""
-                text = None
+                lstSubcat = []
+                for subnum in range(0, numsubcats):
+                    lstSubcat.append(Qsubcat(qcline=qcline, 
+                                             name=oQcResults['subcats'][subnum],
+                                             count=oQcResults['counts'][subnum]))
+                Qsubcat.objects.bulk_create(lstSubcat)
+                # Re-read the subcategories, since not every database backend returns the id's from bulk_create
+                subcats = list(Qsubcat.objects.filter(qcline=qcline).order_by('id'))
                 # Get the number of documents that contain 0 or more hits
-                hits = len(oQcResults['hits'])
+                hit_list = oQcResults['hits']
+                hits = len(hit_list)
 
-                # Divide this into packages of 1000 hits, after which a real 'save' happens
                 idx = 0
-                iChunkSize = 10000
-                iShowSize = 1000
                 iNumLines = 0
                 iNumWords = 0
-                # Sort the hitlist
-                # hit_list = oQcResults['hits'].sort(key=lambda x: x['file'])
-                hit_list = sorted(oQcResults['hits'], key=lambda hit: hit['file'])
-                # Sort texts
-                text_list = Text.sorted_texts(instPart, instFormat)
-                # Check if there are any results
-                if len(text_list) == 0:
-                    msg = "set_quantor error: there are no texts of type {} in part {}".format(
-                        get_format_name(instFormat), instPart )
-                    oBack['status'] = 'error'
-                    oBack['msg'] = msg
-                    return oBack
-                # Get the first text
-                text_list_iter = text_list.iterator()
-                text = next(text_list_iter)
-                if text != None:
-                    chunks = math.ceil( hits / iChunkSize)
-                    for chunk in range(chunks):
-                        # Set the max idx
-                        max_idx = (chunk + 1) * iChunkSize
-                        with transaction.atomic():
-                            while idx < max_idx and idx < hits:
-                                if idx % iShowSize == 0:
-                                    sMsg = "set_quantor hits: {} / {}".format(idx, hits)
-                                    oErr.Status(sMsg)
-                                hit = hit_list[idx]
-
-                                # Get the file name
-                                file = Text.strip_ext( hit['file'])
-
-                                # Check if we have the right file
-                                while file != text.fileName:
-                                    # text = next(text_list.iterator())
-                                    try:
-                                        text = next(text_list_iter)
-                                    except StopIteration as e:
-                                        # This is the normal 'end' of the iteration.
-                                        # But getting here means that the 'file' has not been found within [text_list_iter]
-                                        # WHY ??? - Is it not in [text_list]?? Double check...
-                                        print(e)
-                                        break
-
-                                # Keep track of the number of words and lines
-                                iNumLines += text.lines
-                                iNumWords += text.words
-
-                                # Process the sub categories
-                                for subnum in range(0, numsubcats):
-                                    # Get this Qsubcat and the count for it
-                                    qsubcat = subcats[subnum]
-                                    subcount = hit['subs'][subnum]
-                                    # Add the appropriate Qsubinfo
-                                    qsubinfo = Qsubinfo(subcat = qsubcat, 
-                                                        text= text,
-                                                        count = subcount)
-                                    qsubinfo.save()
-                                # Go to the next hit
-                                idx += 1
-
-                    # Put the number of lines and words in the quantor
-                    quantor.lines = iNumLines
-                    quantor.words = iNumWords
-                    quantor.save()
+                lUnmatched = []
+                # The compact store: the texts and a texts x subcats matrix of counts
+                lTextId = []
+                lTextName = []
+                arCounts = array('i')
+                iReported = 0
+                while idx < hits:
+                    hit = hit_list[idx]
+                    idx += 1
+
+                    # Get the file name
+                    sHitFile = hit['file']
+                    file = file_names.get(sHitFile)
+                    if file == None:
+                        file = Text.strip_ext(sHitFile)
+                        file_names[sHitFile] = file
+
+                    # Find the text this hit belongs to
+                    oText = text_index.get(file)
+                    if oText == None:
+                        # This file is not (or no longer) known as a text of this part/format
+                        lUnmatched.append(file)
+                    else:
+                        iTextId, iLines, iWords, sGenre, sSubtype = oText
+
+                        # Keep track of the number of words and lines
+                        iNumLines += iLines
+                        iNumWords += iWords
+
+                        # Process the sub categories
+                        lTextId.append(iTextId)
+                        lTextName.append(file)
+                        arCounts.extend(hit['subs'][subnum] for subnum in range(0, numsubcats))
+
+                    # Report progress after each [iBatchSize] counts
+                    if len(arCounts) - iReported >= iBatchSize or idx == hits:
+                        iRowsTotal += len(arCounts) - iReported
+                        iReported = len(arCounts)
+                        # Report progress, including the number of counts per second
+                        fElapsed = time.time() - fStart
+                        iRate = int(iRowsTotal / fElapsed) if fElapsed > 0 else iRowsTotal
+                        self.set_status("set_quantor QC {}: hits {} / {}, counts {} ({} counts/s)".format(
+                            qc, idx, hits, iRowsTotal, iRate), phase="set_quantor QC {}".format(qc), done=idx, total=hits)
+
+                # Store the compact matrix for this QC line
+                qcline.set_matrix(lTextId, lTextName, arCounts)
+                qcline.save()
+                # Add the summary rows for this QC line
+                lstSummary.extend(QuantorSummary.get_summary_rows(
+                    quantor, qcline, subcats, lTextId, arCounts, text_info, iNumLines, iNumWords))
+
+                # Report any hits whose file could not be found
+                if len(lUnmatched) > 0:
+                    sMsg = "set_quantor QC {}: {} hit file(s) not found among the texts, e.g: {}".format(
+                        qc, len(lUnmatched), ", ".join(lUnmatched[:5]))
+                    oErr.Status(sMsg)
+                    self.set_status(sMsg)
+                    oBack['unmatched'] = oBack.get('unmatched', 0) + len(lUnmatched)
+
+                # Put the number of lines and words in the quantor
+                quantor.lines = iNumLines
+                quantor.words = iNumWords
+                quantor.save()
+
+            # Store the summary of all QC lines
+            QuantorSummary.objects.bulk_create(lstSummary)
                                 
             # Create KWIC material for each QC line
             for idx in range(0, iNumQc):
@@ -4228,7 +4962,7 @@ class Basket(models.Model):
 
             # Get the /crpp/dbinfo count for this QC line
             sUser = self.research.owner.username
-            sCrpName = self.research.name
+            sCrpName = self.get_crpx_name()
             sPartDir = self.part.dir
             oDbInfoBack = crpp_dbinfo(sUser, sCrpName, iQcLine, -1, 0,sPart=sPartDir)
             if oDbInfoBack['commandstatus'] != 'ok':
@@ -4288,6 +5022,290 @@ class Basket(models.Model):
         return kwic.get_features()
     
 
+class BasketJob(models.Model):
+    """A job for one basket that runs in the background, outside of the web request
+
+    The database row makes sure the same job is only started once, even when
+    several web workers are polling the progress of the same basket.
+    """
+
+    # [1] The type of job (e.g. 'quantor')
+    jobtype = models.CharField("Job type", max_length=MAX_NAME_LEN)
+    # [1] The status of the job: queued, running, done, error
+    status = models.CharField("Status", max_length=MAX_NAME_LEN, default="queued")
+    # [0-1] Message explaining the status (e.g. an error)
+    msg = models.TextField("Message", blank=True, null=True)
+    # [1] The most recent /crpp progress reply (stringified JSON, without the hits per text)
+    progress = models.TextField("Progress", default="{}")
+    # [0-1] create date and finish date
+    created = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(null=True, blank=True)
+    # [0-1] The last time the job showed that it is alive
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    # [1] Each job belongs to one basket
+    basket = models.ForeignKey(Basket, blank=False, null=False, on_delete=models.CASCADE, related_name="basketjobs")
+
+    class Meta:
+        unique_together = ('basket', 'jobtype')
+
+    def __str__(self):
+        return "{}_{}: {}".format(self.basket.id, self.jobtype, self.status)
+
+    def claim(basket, sJobType):
+        """Get the job [sJobType] for [basket], creating it if it is not there, failed before, or 
+        stopped showing signs of life (e.g. because its process has been restarted)
+
+        Returns the job and a boolean telling whether the caller should start it
+        """
+
+        job = BasketJob.objects.filter(basket=basket, jobtype=sJobType).first()
+        if job == None:
+            try:
+                with transaction.atomic():
+                    job = BasketJob.objects.create(basket=basket, jobtype=sJobType, heartbeat=timezone.now())
+                return job, True
+            except IntegrityError:
+                # Someone else has just created it
+                job = BasketJob.objects.filter(basket=basket, jobtype=sJobType).first()
+                return job, False
+        elif job.status == "error" or (job.is_stale() and not basket_watcher.has_job(job.id)):
+            # Only one caller may restart a failed or abandoned job (not one that this process still has)
+            iCount = BasketJob.objects.filter(id=job.id, status=job.status, heartbeat=job.heartbeat).update(
+                status="queued", msg="", finished=None, heartbeat=timezone.now())
+            job.refresh_from_db()
+            return job, (iCount == 1)
+        return job, False
+
+    def is_active(self):
+        return self.status == "queued" or self.status == "running"
+
+    def is_stale(self):
+        """Is this job queued or running, without any sign of life for BASKET_JOB_STALE seconds?"""
+
+        if not self.is_active():
+            return False
+        # Storing basket progress (e.g. during ingestion) also counts as a sign of life
+        saved = Basket.objects.filter(id=self.basket_id).values_list('saved', flat=True).first()
+        lLast = [x for x in [self.heartbeat, self.created, saved] if x != None]
+        return max(lLast) < timezone.now() - timedelta(seconds=BASKET_JOB_STALE)
+
+    def set_status(self, sStatus, msg = None):
+        """Set the status; returns False if the job no longer exists (e.g. the project is executed again)"""
+
+        self.status = sStatus
+        if msg != None:
+            self.msg = msg
+        if sStatus == "done" or sStatus == "error":
+            self.finished = timezone.now()
+        self.heartbeat = timezone.now()
+        iCount = BasketJob.objects.filter(id=self.id).update(
+            status=self.status, msg=self.msg, finished=self.finished, heartbeat=self.heartbeat)
+        return iCount > 0
+
+    def set_progress(self, oProgress):
+        """Keep the /crpp progress reply [oProgress]; returns False if the job no longer exists"""
+
+        oProgress = copy.copy(oProgress)
+        if 'table' in oProgress:
+            # The hits per text are only needed for the quantor, not for showing the progress
+            oProgress['table'] = [{k: v for k, v in oQc.items() if k != 'hits'} for oQc in oProgress['table']]
+        self.progress = json.dumps(oProgress)
+        self.heartbeat = timezone.now()
+        iCount = BasketJob.objects.filter(id=self.id).update(progress=self.progress, heartbeat=self.heartbeat)
+        return iCount > 0
+
+    def keep_alive(self):
+        """Show that the job is alive while it waits (e.g. for a thread to ingest the results)"""
+
+        now = timezone.now()
+        if self.heartbeat == None or (now - self.heartbeat).total_seconds() >= BASKET_JOB_HEARTBEAT:
+            self.heartbeat = now
+            BasketJob.objects.filter(id=self.id).update(heartbeat=now)
+
+    def get_progress(self):
+        """The progress of the search, as Basket.get_progress() returns it, but without contacting /crpp"""
+
+        oProgress = json.loads(self.progress) if self.progress else {}
+        if self.status == "error" and get_progress_code(oProgress) != "completed":
+            return {'commandstatus': 'error', 'msg': self.msg if self.msg else "Could not follow the search"}
+        if len(oProgress) == 0:
+            return dict(commandstatus="ok", status="preparing", code="preparing", message="Waiting for /crpp")
+        return oProgress
+
+    def follow(self):
+        """Let the basket watcher of this process follow my search at /crpp
+        
+        Following the search does not take a thread of the "quantor" pool: only the ingestion of 
+        the completed results does (see BasketWatcher).
+        """
+
+        if self.set_status("running"):
+            basket_watcher.add(self)
+        return self
+
+    def check_progress(self, fn_stop = None):
+        """Ask /crpp once for the progress of the search of my basket and store it in the job
+
+        Returns ("wait", reply) while the search runs, ("ingest", reply) when it is completed,
+        and ("end", reply) when following it ends (error, stopped, or the job has been removed).
+        """
+
+        oProgress = self.basket.get_progress()
+        if not self.set_progress(oProgress):
+            # The job has been removed: the project is being executed again
+            return "end", oProgress
+        sCode = get_progress_code(oProgress)
+        if oProgress['commandstatus'] == "error" or sCode == "error":
+            # /crpp reports the error: it is shown as part of the progress
+            self.set_status("done", "")
+            return "end", oProgress
+        elif sCode == "completed":
+            return "ingest", oProgress
+        elif self.basket.get_status() == "stopped" or (fn_stop != None and fn_stop()):
+            self.set_status("done", "stopped")
+            return "end", oProgress
+        return "wait", oProgress
+
+    def watch(self, fn_stop = None):
+        """Follow the search of my basket at /crpp until it is finished, and then ingest its results
+        
+        This keeps the calling thread busy until the end (see follow() for following without it). 
+        The watch ends early when the basket is stopped, or when [fn_stop] returns True.
+        """
+
+        oErr = ErrHandle()
+        try:
+            if not self.set_status("running"):
+                return None
+            poller = CrppPoller()
+            while True:
+                sNext, oProgress = self.check_progress(fn_stop)
+                if sNext == "ingest":
+                    self.run_quantor(oProgress)
+                    break
+                elif sNext == "end":
+                    break
+                elif not poller.wait(oProgress):
+                    self.set_status("error", "The search did not finish within {} seconds".format(poller.timeout))
+                    break
+        except:
+            msg = oErr.get_error_message()
+            oErr.DoError("BasketJob/watch")
+            self.set_status("error", msg)
+        return self.status
+
+    def run_quantor(self, oResults):
+        """Ingest the completed /crpp results [oResults] into the quantor of my basket"""
+
+        oErr = ErrHandle()
+        try:
+            self.set_status("running")
+            oQset = self.basket.set_quantor(oResults)
+            if oQset['status'] == 'ok':
+                self.set_status("done", "")
+            else:
+                msg = oQset['msg'] if 'msg' in oQset else "Could not set quantor"
+                self.set_status("error", msg)
+        except:
+            msg = oErr.get_error_message()
+            oErr.DoError("BasketJob/run_quantor")
+            self.set_status("error", msg)
+        return self.status
+
+
+class BasketWatcher():
+    """Follow the searches of the basket jobs of this process at /crpp, all in one thread
+
+    Each search is asked for its progress when its CrppPoller says so. Completed results are 
+    ingested in the "quantor" pool; while a job waits for a thread there, the watcher keeps 
+    its heartbeat up, so that no other process takes the job over.
+    """
+
+    def __init__(self):
+        self.jobs = {}          # The searches being followed: {job id: [job, poller, time of the next poll]}
+        self.ingesting = {}     # The jobs queued or running in the "quantor" pool: {job id: (job, future)}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, job):
+        """Start following the search of [job]; returns False if it is already followed"""
+
+        with self.lock:
+            if job.id in self.jobs or job.id in self.ingesting:
+                return False
+            self.jobs[job.id] = [job, CrppPoller(), 0]
+            if self.thread == None:
+                self.thread = threading.Thread(target=self.run, name="basket_watcher", daemon=True)
+                self.thread.start()
+        return True
+
+    def has_job(self, job_id):
+        with self.lock:
+            return job_id in self.jobs or job_id in self.ingesting
+
+    def run(self):
+        """The watcher thread: it ends when there is nothing left to follow"""
+
+        oErr = ErrHandle()
+        try:
+            while True:
+                close_old_connections()
+                with self.lock:
+                    if len(self.jobs) == 0 and len(self.ingesting) == 0:
+                        self.thread = None
+                        return
+                    lDue = [item for item in self.jobs.values() if item[2] <= time.time()]
+                    lIngest = list(self.ingesting.values())
+                for job, poller, fNext in lDue:
+                    self.check_job(job, poller)
+                for job, future in lIngest:
+                    job.keep_alive()
+                time.sleep(WATCH_INTERVAL)
+        except:
+            oErr.DoError("BasketWatcher/run")
+            with self.lock:
+                self.thread = None
+        finally:
+            connection.close()
+
+    def end_ingest(self, job_id):
+        with self.lock:
+            self.ingesting.pop(job_id, None)
+
+    def check_job(self, job, poller):
+        """Ask /crpp for the progress of the search of [job] and decide what comes next"""
+
+        oErr = ErrHandle()
+        sNext = "end"
+        try:
+            sNext, oProgress = job.check_progress()
+            if sNext == "ingest":
+                future = run_in_background("quantor", job.run_quantor, oProgress, iWorkers=QUANTOR_WORKERS)
+                with self.lock:
+                    self.ingesting[job.id] = (job, future)
+                future.add_done_callback(lambda x: self.end_ingest(job.id))
+            elif sNext == "wait":
+                fDelay = poller.next_delay(oProgress)
+                if fDelay == None:
+                    job.set_status("error", "The search did not finish within {} seconds".format(poller.timeout))
+                    sNext = "end"
+                else:
+                    with self.lock:
+                        self.jobs[job.id][2] = time.time() + fDelay
+        except:
+            msg = oErr.get_error_message()
+            oErr.DoError("BasketWatcher/check_job")
+            job.set_status("error", msg)
+            sNext = "end"
+        if sNext != "wait":
+            with self.lock:
+                self.jobs.pop(job.id, None)
+
+
+# The basket watcher of this process
+basket_watcher = BasketWatcher()
+
+
 class Kwic(models.Model):
     """Keyword-in-context results
     
@@ -4312,16 +5330,22 @@ class Kwic(models.Model):
         return "{}".format(self.qc)
 
     def delete(self, using = None, keep_parents = False):
-        # Delete the quantor and all under it
-        with transaction.atomic():
-            # (1) Walk all the kwicfilters
-            self.kwicfilters.all().delete()
-            # (2) Walk all the kwicresults
-            self.kwicresults.all().delete()
+        # Delete the kwic and all under it
+        Kwic.purge(Kwic.objects.filter(id=self.id), bSelf=False)
         # Remove myself
         response = super(Kwic, self).delete(using, keep_parents)
         return response
 
+    def purge(qs, bSelf = True):
+        """Remove the Kwic objects in [qs] (if [bSelf]) and everything under them in one statement per table"""
+
+        with transaction.atomic():
+            iCount = raw_delete(KwicFilter.objects.filter(kwic__in=qs))
+            iCount += raw_delete(KwicResult.objects.filter(kwic__in=qs))
+            if bSelf:
+                iCount += raw_delete(qs)
+        return iCount
+
     def add_filter(self, sField, sValue):
         # Add this to the set of filters belonging to this Kwic object
         obj = KwicFilter(kwic=self, field=sField, value=sValue)
@@ -4338,24 +5362,37 @@ class Kwic(models.Model):
         lFeatures = json.loads(self.features)
         return lFeatures
 
-    def apply_filter(self, oFilter=None):
+    def apply_filter(self, oFilter=None, oDbInfo=None):
+        """Make the stored filters equal to [oFilter] and set the hitcount to the number of hits with it
+
+        If [oDbInfo] is the /crpp/dbinfo reply for a page with this filter, the size is taken
+        from there; otherwise it is asked for (or taken from the dbinfo cache).
+        The filters and the hitcount are only saved (together) once the hits have been counted,
+        so that a failing count is tried again on the next request.
+        """
+
         oErr = ErrHandle()
         # Combine all filters into a JSON object to be sent
         if oFilter == None:
             oFilter = self.get_filter()
-        # Send to /crpp/dbinfo to get the correct amounts
-        sUser = self.basket.research.owner.username
-        sCrpName = self.basket.research.name
-        sPartDir = self.basket.part.dir
-        iQcLine = self.qc
-        oDbInfoBack = crpp_dbinfo(sUser, sCrpName, iQcLine, -1, 0, filter=oFilter, sPart=sPartDir)
-        if oDbInfoBack['commandstatus'] != 'ok':
+        if oDbInfo != None and oDbInfo.get('commandstatus') == 'ok' and 'Size' in oDbInfo:
+            oDbInfoBack = oDbInfo
+        else:
+            # Send to /crpp/dbinfo to get the correct amounts
+            oDbInfoBack = self.basket.get_dbinfo(self.qc, -1, 0, filter=oFilter)
+        if oDbInfoBack['commandstatus'] != 'ok' or 'Size' not in oDbInfoBack:
             oErr.DoError("apply_filter: didn't get a positive reply from /crpp/dbinfo")
             # Cannot get a positive reply
             return False
-        # Adapt the hitcount
-        self.hitcount = oDbInfoBack['Size']
-        self.save()
+        with transaction.atomic():
+            # Only rewrite the filters when they have changed
+            if oFilter != self.get_filter():
+                self.kwicfilters.all().delete()
+                KwicFilter.objects.bulk_create([KwicFilter(kwic=self, field=sField, value=sValue) for sField, sValue in oFilter.items()])
+            # Adapt the hitcount
+            if self.hitcount != oDbInfoBack['Size']:
+                self.hitcount = oDbInfoBack['Size']
+                self.save(update_fields=['hitcount'])
         # REturn positively
         return True
       
@@ -4500,31 +5537,107 @@ class Quantor(models.Model):
 
     def delete(self, using = None, keep_parents = False):
         # Delete the quantor and all under it
-        with transaction.atomic():
-            # (1) Walk all its qclines
-            for qcline in self.qclines.all():
-                # (2) Each qcline has qsubcats
-                for qsubcat in qcline.qsubcats.all():
-                    # (3) Remove all the related qsubinfo elements
-                    qsubcat.qsubinfos.all().delete()
-                # Now we can remove the qsubcats
-                qcline.qsubcats.all().delete()
-            # Now remove the qclines
-            self.qclines.all().delete()
+        Quantor.purge(Quantor.objects.filter(id=self.id), bSelf=False)
         # Remove myself
         response = super(Quantor, self).delete(using, keep_parents)
         return response
 
+    def purge(qs, bSelf = True):
+        """Remove the quantors in [qs] (if [bSelf]) and everything under them in one statement per table"""
+
+        with transaction.atomic():
+            iCount = raw_delete(Qsubinfo.objects.filter(subcat__qcline__quantor__in=qs))
+            iCount += raw_delete(Qsubcat.objects.filter(qcline__quantor__in=qs))
+            iCount += raw_delete(QCline.objects.filter(quantor__in=qs))
+            iCount += raw_delete(QuantorSummary.objects.filter(quantor__in=qs))
+            if bSelf:
+                iCount += raw_delete(qs)
+        return iCount
+
+    def get_summary(self, qc=None):
+        """Get the pre-calculated summary as a list of QC lines, each with its rows per kind
+        
+        Returns e.g: [{'qc': 1, 'total': row, 'subcat': [row, ...], 'genre': [...], 'subtype': [...]}]
+        With [qc], only that QC line is returned.
+        """
+
+        lBack = []
+        oQc = None
+        qs = self.summaries.all() if qc == None else self.summaries.filter(qc=qc)
+        for row in qs.order_by('qc', 'kind', 'name'):
+            if oQc == None or oQc['qc'] != row.qc:
+                oQc = {'qc': row.qc, 'total': None, 'subcat': [], 'genre': [], 'subtype': []}
+                lBack.append(oQc)
+            if row.kind == "total":
+                oQc['total'] = row
+            else:
+                oQc[row.kind].append(row)
+        return lBack
+
+    def get_total(self, qc):
+        """Get the number of hits and of texts with hits for QC line [qc]
+        
+        These come from the pre-calculated summary; without it they are counted in the compact matrix,
+        and only older results are counted in the Qsubinfo table.
+        """
+
+        row = self.summaries.filter(qc=qc, kind="total").first()
+        if row != None:
+            return {'hits': row.hits, 'texts': row.texts}
+        qcline = self.qclines.filter(qc=qc).first()
+        if qcline == None:
+            return None
+        matrix = qcline.get_matrix()
+        if matrix != None:
+            iTexts = len([x for x in matrix.get_text_totals() if x > 0])
+        else:
+            iTexts = Qsubinfo.objects.filter(subcat__qcline=qcline, count__gt=0).values('text').distinct().count()
+        return {'hits': qcline.count, 'texts': iTexts}
+
+    def get_text_numbers(self):
+        """Count the lines and words of the texts in the compact matrices (None for older results)"""
+
+        lTextId = set()
+        for qcline in self.qclines.all():
+            matrix = qcline.get_matrix()
+            if matrix == None:
+                return None
+            lTextId.update(matrix.textids)
+        if len(lTextId) == 0:
+            return None
+        oBack = {'lines': 0, 'words': 0}
+        text_index = Text.get_text_index(self.basket.part, choice_value(CORPUS_FORMAT, self.basket.format))
+        for oText in text_index.values():
+            if oText[0] in lTextId:
+                oBack['lines'] += oText[1]
+                oBack['words'] += oText[2]
+        return oBack
+
     def get_lines(self):
         """Return or retrieve the number of lines in the texts that have been searched"""
 
         iCount = -1
         if self.lines == None:
-            oCount = Qsubinfo.objects.filter(Q(subcat__qcline__quantor=self)).values("text").annotate(num_lines=Sum('text__lines')).aggregate(Sum('num_lines'))
-            if 'num_lines__sum' in oCount:
-                iCount = oCount['num_lines__sum']
+            row = self.summaries.filter(kind="total").order_by('qc').first()
+            oNumbers = self.get_text_numbers() if row == None else None
+            if row != None:
+                # Take the number from the pre-calculated summary
+                iCount = row.lines
+                self.lines = iCount
+                self.save()
+            elif oNumbers != None:
+                # Count the lines of the texts in the compact matrices
+                iCount = oNumbers['lines']
                 self.lines = iCount
                 self.save()
+            else:
+                # Older results: count the lines of the texts in the Qsubinfo table (each text once)
+                lstText = Qsubinfo.objects.filter(subcat__qcline__quantor=self).values("text")
+                oCount = Text.objects.filter(id__in=lstText).aggregate(num_lines=Sum('lines'))
+                if oCount['num_lines'] != None:
+                    iCount = oCount['num_lines']
+                    self.lines = iCount
+                    self.save()
         else:
             iCount = self.lines
         # Return what we have
@@ -4535,17 +5648,149 @@ class Quantor(models.Model):
 
         iCount = -1
         if self.words == None:
-            oCount = Qsubinfo.objects.filter(Q(subcat__qcline__quantor=self)).values("text").annotate(num_words=Sum('text__words')).aggregate(Sum('num_words'))
-            if 'num_words__sum' in oCount:
-                iCount = oCount['num_words__sum']
+            row = self.summaries.filter(kind="total").order_by('qc').first()
+            oNumbers = self.get_text_numbers() if row == None else None
+            if row != None:
+                # Take the number from the pre-calculated summary
+                iCount = row.words
                 self.words = iCount
                 self.save()
+            elif oNumbers != None:
+                # Count the words of the texts in the compact matrices
+                iCount = oNumbers['words']
+                self.words = iCount
+                self.save()
+            else:
+                # Older results: count the words of the texts in the Qsubinfo table (each text once)
+                lstText = Qsubinfo.objects.filter(subcat__qcline__quantor=self).values("text")
+                oCount = Text.objects.filter(id__in=lstText).aggregate(num_words=Sum('words'))
+                if oCount['num_words'] != None:
+                    iCount = oCount['num_words']
+                    self.words = iCount
+                    self.save()
         else:
             iCount = self.words
         # Return what we have
         return iCount
 
 
+class QuantorRow():
+    """One text/subcategory combination taken from a QuantorMatrix (looks like a Qsubinfo)"""
+
+    def __init__(self, id, text_id, text_name, subcat, count):
+        self.id = id
+        self.text = Text(id=text_id, fileName=text_name)
+        self.subcat = subcat
+        self.count = count
+
+
+class QuantorRows():
+    """The selected rows of a QuantorMatrix, as positions in the matrix
+
+    Only the rows of a slice (e.g. one page) are turned into QuantorRow objects.
+    """
+
+    def __init__(self, matrix, positions):
+        self.matrix = matrix
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.matrix.get_rows(self.positions[key])
+        return self.matrix.get_rows([self.positions[key]])[0]
+
+
+class QuantorMatrix():
+    """The compact texts x subcats count matrix of one QCline
+    
+    The matrix is decoded and its texts are sorted once (see matrix_cache); the positions
+    of a selection are only calculated when it is made.
+    """
+
+    def __init__(self, qcline):
+        self.qcline = qcline
+        self.subcats = list(qcline.qsubcats.order_by('id'))
+        self.textids = array('q')
+        self.textids.frombytes(zlib.decompress(bytes(qcline.textids)))
+        self.textnames = qcline.textnames.split("\n") if len(self.textids) > 0 else []
+        self.counts = array('i')
+        self.counts.frombytes(zlib.decompress(bytes(qcline.matrix)))
+        # The order of the subcategories and texts, and the positions of each subcategory in that order
+        self.subnum_order = sorted(range(len(self.subcats)), key=lambda x: self.subcats[x].name.lower())
+        self.textnum_order = array('i', sorted(range(len(self.textids)), key=lambda x: self.textnames[x].lower()))
+        # The text numbers that match a text name selection: {regular expression: array}
+        self.textname_matches = LruCache(20)
+
+    def get_count(self, subcat_id, text_id):
+        """The number of hits of one cell (or None if the matrix does not have it)"""
+
+        lSubnum = [subnum for subnum, subcat in enumerate(self.subcats) if subcat.id == subcat_id]
+        if len(lSubnum) == 0 or not text_id in self.textids:
+            return None
+        return self.counts[self.textids.index(text_id) * len(self.subcats) + lSubnum[0]]
+
+    def get_subcat_totals(self):
+        """Total number of hits per subcategory"""
+        iSubcats = len(self.subcats)
+        return [sum(self.counts[subnum::iSubcats]) for subnum in range(iSubcats)]
+
+    def get_text_totals(self):
+        """Total number of hits per text"""
+        iSubcats = len(self.subcats)
+        return [sum(self.counts[textnum*iSubcats:(textnum+1)*iSubcats]) for textnum in range(len(self.textids))]
+
+    def select(self, subcat=None, textname=None, minhits=None):
+        """Select rows, ordered by subcategory name and text name
+
+        subcat:     id of one Qsubcat
+        textname:   regular expression the text name must match (case-insensitive)
+        minhits:    minimum number of hits
+        """
+
+        lSubnum = self.subnum_order
+        if subcat != None:
+            lSubnum = [x for x in lSubnum if str(self.subcats[x].id) == str(subcat)]
+        lTextnum = None
+        if textname != None:
+            lTextnum = self.textname_matches.get(textname)
+            if lTextnum == None:
+                reName = re.compile(textname, re.IGNORECASE)
+                lTextnum = array('i', [x for x in self.textnum_order if reName.search(self.textnames[x])])
+                self.textname_matches.set(textname, lTextnum)
+        if lTextnum == None:
+            lTextnum = self.textnum_order
+        iSubcats = len(self.subcats)
+        counts = self.counts
+        positions = array('i')
+        for subnum in lSubnum:
+            if minhits == None:
+                positions.extend(textnum * iSubcats + subnum for textnum in lTextnum)
+            else:
+                positions.extend(pos for pos in (textnum * iSubcats + subnum for textnum in lTextnum) 
+                                 if counts[pos] >= minhits)
+        return QuantorRows(self, positions)
+
+    def get_rows(self, positions):
+        """Turn matrix positions into QuantorRow objects, with the id of the Qsubinfo (if any)"""
+
+        iSubcats = len(self.subcats)
+        lRow = []
+        for pos in positions:
+            textnum, subnum = divmod(pos, iSubcats)
+            lRow.append((self.textids[textnum], self.textnames[textnum], self.subcats[subnum], self.counts[pos]))
+        # Look up the Qsubinfo rows of cells that have been opened before in one go
+        dictId = {}
+        lstQ = [Q(subcat__in=set(row[2] for row in lRow)), Q(text_id__in=set(row[0] for row in lRow))]
+        if len(lRow) > 0:
+            for subcat_id, text_id, id in Qsubinfo.objects.filter(*lstQ).values_list('subcat_id', 'text_id', 'id'):
+                dictId[(subcat_id, text_id)] = id
+        return [QuantorRow(dictId.get((subcat.id, text_id)), text_id, text_name, subcat, count) 
+                for text_id, text_name, subcat, count in lRow]
+
+
 class QCline(models.Model):
 
     # [1] A subcategory belongs to a particular QC of the quantor
@@ -4554,10 +5799,48 @@ class QCline(models.Model):
     count = models.IntegerField("Number of hits", default=0)
     # [1] Every QCline is linked to a Quantor with results
     quantor = models.ForeignKey(Quantor, blank=False, null=False, on_delete=models.CASCADE, related_name="qclines")
+    # [0-1] Compact counts: the ids and names of the texts, and the texts x subcats matrix of hits
+    textids = models.BinaryField("Text ids", null=True, blank=True)
+    textnames = models.TextField("Text names", blank=True, default="")
+    matrix = models.BinaryField("Hit matrix", null=True, blank=True)
 
     def __str__(self):
         return "{}".format(self.qc)
 
+    def set_matrix(self, lTextId, lTextName, arCounts):
+        """Store the hits per text (rows) and subcategory (columns) as packed arrays"""
+
+        self.textids = zlib.compress(array('q', lTextId).tobytes())
+        self.textnames = "\n".join(lTextName)
+        self.matrix = zlib.compress(arCounts.tobytes())
+
+    def has_matrix(self):
+        return self.matrix != None and len(self.matrix) > 0
+
+    def get_matrix(self):
+        """Get the compact counts as a QuantorMatrix (or None for older results)"""
+
+        if not self.has_matrix():
+            return None
+        key = (self.id, zlib.crc32(bytes(self.matrix)))
+        matrix = matrix_cache.get(key)
+        if matrix == None:
+            matrix = QuantorMatrix(self)
+            matrix_cache.set(key, matrix)
+        return matrix
+
+    def get_qsubinfo(self, subcat, text_id):
+        """Get the Qsubinfo of one cell: for results with a matrix it is only made when a user opens the cell"""
+
+        item = Qsubinfo.objects.filter(subcat=subcat, text_id=text_id).first()
+        if item == None:
+            matrix = self.get_matrix()
+            iCount = None if matrix == None else matrix.get_count(subcat.id, text_id)
+            if iCount == None:
+                return None
+            item = Qsubinfo.objects.create(subcat=subcat, text_id=text_id, count=iCount)
+        return item
+
     def get_qcline(quantor, qcnum):
         # CHeck if this exists
         item = QCline.objects.filter(qc=qcnum, quantor=quantor).first()
@@ -4626,6 +5909,64 @@ class Qsubinfo(models.Model):
         self.save()
 
 
+class QuantorSummary(models.Model):
+    """Pre-calculated numbers of a quantor: per QC line in total, per subcat, per genre and per subtype"""
+
+    # [1] The kind of row: total, subcat, genre, subtype
+    kind = models.CharField("Kind", max_length=MAX_NAME_LEN)
+    # [1] The QC line this row is about
+    qc = models.IntegerField("QC number", default=1)
+    # [0-1] The name of the subcat, genre or subtype
+    name = models.CharField("Name", max_length=MAX_TEXT_LEN, blank=True, default="")
+    # [1] The number of hits
+    hits = models.IntegerField("Number of hits", default=0)
+    # [1] The number of texts with at least one hit
+    texts = models.IntegerField("Texts with hits", default=0)
+    # [1] The number of lines and words in the texts searched (for subcat rows: all texts)
+    lines = models.IntegerField("Number of lines", default=0)
+    words = models.IntegerField("Number of words", default=0)
+    # [1] Every summary row belongs to a Quantor
+    quantor = models.ForeignKey(Quantor, blank=False, null=False, on_delete=models.CASCADE, related_name="summaries")
+
+    def __str__(self):
+        return "{}:{}:{}".format(self.qc, self.kind, self.name)
+
+    def get_summary_rows(quantor, qcline, subcats, lTextId, arCounts, text_info, iNumLines, iNumWords):
+        """Calculate the summary rows of one QC line from its count matrix
+
+        text_info:  dictionary {text id: (lines, words, genre, subtype)}
+        """
+
+        iSubcats = len(subcats)
+        lRow = []
+        # Total hits per text, and the texts with at least one hit
+        lTextTotal = [sum(arCounts[textnum*iSubcats:(textnum+1)*iSubcats]) for textnum in range(len(lTextId))]
+        iTexts = len([x for x in lTextTotal if x > 0])
+        lRow.append(QuantorSummary(quantor=quantor, qc=qcline.qc, kind="total", hits=qcline.count,
+                                   texts=iTexts, lines=iNumLines, words=iNumWords))
+        # Per subcat
+        for subnum, subcat in enumerate(subcats):
+            lSubCount = arCounts[subnum::iSubcats]
+            lRow.append(QuantorSummary(quantor=quantor, qc=qcline.qc, kind="subcat", name=subcat.name,
+                                       hits=sum(lSubCount), texts=len([x for x in lSubCount if x > 0]),
+                                       lines=iNumLines, words=iNumWords))
+        # Per genre and per subtype
+        for sKind, iInfo in [("genre", 2), ("subtype", 3)]:
+            oGroup = {}
+            for textnum, iTextId in enumerate(lTextId):
+                oInfo = text_info[iTextId]
+                sName = oInfo[iInfo] if oInfo[iInfo] != None else ""
+                oSum = oGroup.setdefault(sName, [0, 0, 0, 0])
+                oSum[0] += lTextTotal[textnum]
+                oSum[1] += 1 if lTextTotal[textnum] > 0 else 0
+                oSum[2] += oInfo[0]
+                oSum[3] += oInfo[1]
+            for sName, oSum in oGroup.items():
+                lRow.append(QuantorSummary(quantor=quantor, qc=qcline.qc, kind=sKind, name=sName[:MAX_TEXT_LEN],
+                                           hits=oSum[0], texts=oSum[1], lines=oSum[2], words=oSum[3]))
+        return lRow
+
+
 class ShareGroup(models.Model):
     """Group witch which a project is shared"""
 
@@ -7,7 +7,7 @@ import zlib
 import urllib
 
 # Specific for Cesar
-from cesar.settings import CRPP_HOME
+from cesar.browser.services import crpp_client
 
 # ------------------------------------------------------------------------
 # See also: 2015_CrpStudioAPI_v1-3b.docx
@@ -182,13 +182,11 @@ def crpp_hitinfo(sUser, sCrpName, sLng, iQcNum, iStart, iCount, filter=None, sor
     return crpp_command("dbinfo", oToCrpp)
 
 def crpp_command(sCommand, oToCrpp):
-    # Set the correct URL
-    url = CRPP_HOME + '/'+sCommand
     # Default reply
     oBack = {}
     # Get the data from the CRPP api
     try:
-        r = requests.post(url, json=oToCrpp)
+        r = crpp_client.post(sCommand, oToCrpp)
     except:
         # Getting an exception here probably means that the back-end is not reachable (down)
         oBack['commandstatus'] = 'error'
@@ -4269,6 +4269,105 @@ var ru = (function ($, ru) {
         }
       },
       
+      /**
+       * search_fanout
+       *   Start the search in all parts of the corpus of the selected part
+       *
+       */
+      search_fanout: function(elStart) {
+        var sDivProgress = "#research_progress",
+            ajaxurl = "",
+            frm = null,
+            data = [];
+
+        try {
+          // Clear the errors
+          private_methods.errClear();
+          ajaxurl = $(elStart).attr("ajaxurl");
+          // Gather the information
+          frm = $(elStart).closest("form");
+          if (frm !== undefined) { data = $(frm).serializeArray(); }
+          $(sDivProgress).html("Contacting the search server");
+          $("#research_results").addClass("hidden");
+          $.post(ajaxurl, data, function (response) {
+            if (response.status === undefined || !("group_progress" in response)) {
+              if (response.status === "error" && "error_list" in response) {
+                $(sDivProgress).html("<span style=\"color: darkred;\">" + response['error_list'] + "</span>");
+              } else {
+                private_methods.errMsg("Bad fanout response");
+                $(sDivProgress).html("Bad execute response");
+              }
+            } else {
+              $(sDivProgress).html(response.html);
+              // Disable both start buttons, and allow stopping the group
+              $("#research_start").prop("disabled", true);
+              $(elStart).prop("disabled", true);
+              $("#research_group_stop").attr("ajaxurl", response.group_stop);
+              $("#research_group_stop").removeClass("hidden");
+              setTimeout(function () { ru.cesar.seeker.group_progress(response.group_progress, data); }, 1000);
+            }
+          });
+        } catch (ex) {
+          private_methods.errMsg("search_fanout", ex);
+        }
+      },
+
+      /**
+       * group_progress
+       *   Show the progress of a multi-part search until it has finished
+       *
+       */
+      group_progress: function(ajaxurl, data) {
+        var sDivProgress = "#research_progress";
+
+        try {
+          $.post(ajaxurl, data, function (response) {
+            if (response.status === undefined || response.status === "error") {
+              private_methods.errMsg("Bad group progress response");
+              return;
+            }
+            $(sDivProgress).html(response.html);
+            switch (response.group_status) {
+              case "completed":
+              case "error":
+              case "stopped":
+                // Allow starting again
+                $("#research_start").prop("disabled", false);
+                $("#research_fanout").prop("disabled", false);
+                $("#research_group_stop").addClass("hidden");
+                break;
+              default:
+                setTimeout(function () { ru.cesar.seeker.group_progress(ajaxurl, data); }, 2000);
+                break;
+            }
+          });
+        } catch (ex) {
+          private_methods.errMsg("group_progress", ex);
+        }
+      },
+
+      /**
+       * group_stop
+       *   Stop a multi-part search
+       *
+       */
+      group_stop: function(el) {
+        var frm = null,
+            data = [];
+
+        try {
+          frm = $("#research_fanout").closest("form");
+          if (frm !== undefined) { data = $(frm).serializeArray(); }
+          $.post($(el).attr("ajaxurl"), data, function (response) {
+            if (response.status !== undefined && "html" in response) {
+              $("#research_progress").html(response.html);
+            }
+          });
+        } catch (ex) {
+          private_methods.errMsg("group_stop", ex);
+        }
+      },
+
       /**
        * search_stop
        *   Stop an already going search
@@ -4326,6 +4425,7 @@ var ru = (function ($, ru) {
                   switch (response.statuscode) {
                     case "working":
                     case "preparing":
+                    case "ingesting":
                       // Prevent error progression
                       if (loc_bExeErr) return;
                       // Show the status of the project
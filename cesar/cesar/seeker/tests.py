@@ -6,7 +6,15 @@ Replace this with more appropriate tests for your application.
 """
 
 import django
+from django.contrib.auth.models import User
 from django.test import TestCase
+from unittest.mock import patch
+
+from cesar.browser.models import FieldChoice, Metavar, Corpus, Part, Text, CORPUS_FORMAT
+from cesar.browser.services import crpp_client, CrppPoller
+from cesar.seeker.emulator import CrppEmulator, SyntheticCorpus, EMULATOR_EXT
+from cesar.seeker.management.commands.crpp_benchmark import Command, BENCHMARK_DIR
+from cesar.seeker.models import Gateway, Research, Basket, Quantor, Qsubcat, Qsubinfo, QUANTOR_BATCH_SIZE
 
 # TODO: Configure your database in settings.py and sync before running tests.
 
@@ -26,3 +34,173 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class SetQuantorTest(TestCase):
+    """Basket.set_quantor stores the same counts as the former row-by-row code wrote in Qsubinfo rows"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for idx, sFormat in enumerate(['psdx', 'folia']):
+            FieldChoice.objects.create(field=CORPUS_FORMAT, english_name=sFormat, dutch_name=sFormat,
+                                       abbr=sFormat, machine_value=idx)
+        metavar = Metavar.objects.create(name="test")
+        corpus = Corpus.objects.create(name="test", lng="0", eth="0", metavar=metavar, status="0")
+        cls.part = Part.objects.create(name="test", dir="TEST", corpus=corpus, metavar=metavar)
+        Text.objects.bulk_create([Text(fileName="text{:04}".format(idx), format="0", part=cls.part, 
+                                       lines=10 + idx, words=100 + idx) for idx in range(400)])
+        owner = User.objects.create_user(username="test")
+        gateway = Gateway.objects.create(name="test")
+        cls.research = Research.objects.create(name="test", purpose="test", targetType="w",
+                                               gateway=gateway, owner=owner)
+
+    def get_results(self, iTexts):
+        """Search results for [iTexts] texts (in reverse order) with three subcategories, plus one unknown file"""
+
+        lHit = [{'file': "unknown.psdx", 'count': 1, 'subs': [1, 0, 0]}]
+        for idx in range(iTexts - 1, -1, -1):
+            lHit.append({'file': "text{:04}.psdx".format(idx), 'count': 3 * idx, 
+                         'subs': [idx, idx % 3, 2 * idx - idx % 3]})
+        return {'searchTime': 1, 
+                'table': [{'qc': 1, 'subcats': ['b', 'a', 'c'], 'counts': [1, 2, 3], 'total': 9, 'hits': lHit}]}
+
+    def get_expected(self, oResults):
+        """The rows (subcat, text, count) and the lines/words that the row-by-row code produced"""
+
+        dictText = {text.fileName: text for text in Text.objects.filter(part=self.part)}
+        oQc = oResults['table'][0]
+        lRow = []
+        iLines = 0
+        iWords = 0
+        for hit in oQc['hits']:
+            text = dictText.get(Text.strip_ext(hit['file']))
+            if text == None:
+                continue
+            iLines += text.lines
+            iWords += text.words
+            for subnum, sName in enumerate(oQc['subcats']):
+                lRow.append((sName, text.fileName, hit['subs'][subnum]))
+        return sorted(lRow), iLines, iWords
+
+    def check_quantor(self, iTexts, iBatchSize):
+        basket = Basket.objects.create(research=self.research, part=self.part, format="psdx", status="test")
+        oResults = self.get_results(iTexts)
+        with patch.object(Basket, 'set_kwic', return_value=True):
+            oBack = basket.set_quantor(oResults, iBatchSize=iBatchSize)
+        self.assertEqual(oBack['status'], 'ok')
+        self.assertEqual(oBack.get('unmatched'), 1)
+
+        lRow, iLines, iWords = self.get_expected(oResults)
+        quantor = Quantor.objects.get(basket=basket)
+        self.assertEqual((quantor.lines, quantor.words), (iLines, iWords))
+        # The counts are only kept in the matrix
+        self.assertFalse(Qsubinfo.objects.filter(subcat__qcline__quantor=quantor).exists())
+        qcline = quantor.qclines.get(qc=1)
+        lCell = [(row.subcat.name, row.text.fileName, row.count) for row in qcline.get_matrix().select()[:]]
+        self.assertEqual(sorted(lCell), lRow)
+        self.assertEqual(sorted(Qsubcat.objects.filter(qcline__quantor=quantor).values_list('name', 'count')),
+                         [('a', 2), ('b', 1), ('c', 3)])
+
+    def test_summary(self):
+        """The numbers taken from the summary equal those counted in the matrix"""
+        basket = Basket.objects.create(research=self.research, part=self.part, format="psdx", status="test")
+        with patch.object(Basket, 'set_kwic', return_value=True):
+            basket.set_quantor(self.get_results(25))
+        quantor = Quantor.objects.get(basket=basket)
+        oTotal = quantor.get_total(1)
+        Quantor.objects.filter(id=quantor.id).update(lines=None, words=None)
+        quantor.refresh_from_db()
+        iLines, iWords = quantor.get_lines(), quantor.get_words()
+
+        # Without the summary, as for older results
+        quantor.summaries.all().delete()
+        Quantor.objects.filter(id=quantor.id).update(lines=None, words=None)
+        quantor.refresh_from_db()
+        self.assertEqual(quantor.get_total(1), oTotal)
+        self.assertEqual((quantor.get_lines(), quantor.get_words()), (iLines, iWords))
+        self.assertEqual(oTotal, {'hits': 9, 'texts': 24})
+
+    def test_open_cell(self):
+        """A Qsubinfo is only made for the cell that is opened"""
+        basket = Basket.objects.create(research=self.research, part=self.part, format="psdx", status="test")
+        with patch.object(Basket, 'set_kwic', return_value=True):
+            basket.set_quantor(self.get_results(25))
+        qcline = Quantor.objects.get(basket=basket).qclines.get(qc=1)
+        subcat = qcline.qsubcats.get(name="c")
+        text = Text.objects.get(part=self.part, fileName="text0007")
+        qsubinfo = qcline.get_qsubinfo(subcat, text.id)
+        self.assertEqual((qsubinfo.text_id, qsubinfo.count), (text.id, 13))
+        self.assertEqual(qcline.get_qsubinfo(subcat, text.id).id, qsubinfo.id)
+        self.assertEqual(Qsubinfo.objects.filter(subcat__qcline=qcline).count(), 1)
+        # The row of that cell now links to it
+        row = qcline.get_matrix().select(subcat=subcat.id, textname="text0007")[0]
+        self.assertEqual(row.id, qsubinfo.id)
+
+    def test_small_batches(self):
+        """Batches that do not line up with the hits of a text"""
+        self.check_quantor(25, 7)
+
+    def test_large_batch(self):
+        """More rows in one batch than SQLite accepts in one INSERT"""
+        self.check_quantor(400, QUANTOR_BATCH_SIZE)
+
+
+class EmulatorRunTest(TestCase):
+    """A search from start to finish against the /crpp emulator: execute, progress and set_quantor"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for idx, sFormat in enumerate(['psdx', 'folia']):
+            FieldChoice.objects.create(field=CORPUS_FORMAT, english_name=sFormat, dutch_name=sFormat,
+                                       abbr=sFormat, machine_value=idx)
+
+    def setUp(self):
+        self.corpus = SyntheticCorpus(texts=30, hits=5)
+        self.emulator = CrppEmulator(self.corpus, duration=0.3)
+        self.emulator.start()
+        self.home = crpp_client.home
+        crpp_client.home = self.emulator.home
+
+    def tearDown(self):
+        crpp_client.home = self.home
+        self.emulator.stop()
+
+    def test_run(self):
+        command = Command()
+        part = command.get_part(self.corpus, False, {})
+        research = command.get_research()
+        basket = Basket.objects.create(research=research, part=part, format=EMULATOR_EXT, status="created", jobid="")
+
+        oBack = research.execute(basket)
+        self.assertEqual(oBack['status'], "ok")
+        basket.refresh_from_db()
+        self.assertNotEqual(basket.jobid, "")
+
+        # The emulated search takes a while: /crpp reports that it is working first
+        lStatus = []
+        poller = CrppPoller(timeout=30)
+        while True:
+            oProgress = basket.get_progress()
+            self.assertEqual(oProgress['commandstatus'], "ok")
+            lStatus.append(oProgress.get('status'))
+            if oProgress.get('status') == "completed":
+                break
+            self.assertTrue(poller.wait(oProgress), "The search did not finish in time")
+        self.assertGreater(len(lStatus), 1)
+
+        oBack = basket.set_quantor(oProgress)
+        self.assertEqual(oBack['status'], "ok")
+        self.assertEqual(oBack.get('unmatched', 0), 0)
+
+        oTable = self.corpus.get_table(BENCHMARK_DIR)[0]
+        quantor = Quantor.objects.get(basket=basket)
+        self.assertEqual(sorted(Qsubcat.objects.filter(qcline__quantor=quantor).values_list('name', 'count')),
+                         sorted(zip(oTable['subcats'], oTable['counts'])))
+        qcline = quantor.qclines.get(qc=1)
+        lCell = [(row.subcat.name, row.text.fileName, row.count) for row in qcline.get_matrix().select()[:]]
+        lExpected = []
+        for hit in oTable['hits']:
+            for sName, iCount in zip(oTable['subcats'], hit['subs']):
+                lExpected.append((sName, Text.strip_ext(hit['file']), iCount))
+        self.assertEqual(sorted(lCell), sorted(lExpected))
+        self.assertEqual(quantor.get_total(1)['hits'], oTable['total'])
@@ -8,7 +8,7 @@ from django.db.models import Q
 from django.db.models.functions import Lower
 from django.forms import formset_factory
 from django.forms import inlineformset_factory, BaseInlineFormSet, modelformset_factory
-from django.http import JsonResponse, HttpResponseRedirect, HttpResponse
+from django.http import JsonResponse, HttpResponseRedirect, HttpResponse, StreamingHttpResponse, Http404
 from django.shortcuts import get_object_or_404, render, redirect
 from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
@@ -37,7 +37,7 @@ from cesar.basic.views import BasicList
 from cesar.seeker.forms import *
 from cesar.seeker.models import *
 from cesar.seeker.models import SIMPLENAME
-from cesar.seeker.convert import decompressSafe, get_crpp_date
+from cesar.seeker.convert import decompressSafe, start_decompress_stream, get_crpp_date
 from cesar.browser.models import Part, Corpus, Sentence
 from cesar.browser.views import get_item_list, adapt_search, user_is_ingroup
 from cesar.browser.services import get_crpp_sent_info
@@ -51,6 +51,17 @@ paginateEntries = 20
 RelatedFormset = formset_factory(RelatedForm, can_delete=True, extra=0, min_num=0)
 
 
+class CountPaginator(Paginator):
+    """Paginator for a result set at /crpp of which only the number of hits is known
+
+    The hits are represented by a range() object, so that page boundaries are calculated
+    without having a list of [hit_count] numbers in memory.
+    """
+
+    def __init__(self, hit_count, per_page, orphans=0, allow_empty_first_page=True):
+        super(CountPaginator, self).__init__(range(1, hit_count + 1), per_page, orphans, allow_empty_first_page)
+
+
 def check_arguments(arg_formset, functiondef, qs_gvar, qs_cvar, qs_dvar, target):
 
     oErr = ErrHandle()
@@ -884,6 +895,53 @@ class ResearchExe(View):
                             sStatusCode = "preparing" 
                         else:
                             self.arErr.append("No corpus part to be searched has been selected")
+                    elif self.action == "fanout":
+                        # Execute the research project on a number of parts at the same time
+                        research = self.obj
+                        select_format = self.qd.get("searchFormat")
+                        oOptions = { 'search_type': self.qd.get("search_type"), 
+                                     'search_count': self.qd.get("search_count")}
+                        # The parts are either listed, or all parts of one corpus (by default that of the selected part)
+                        lPartId = self.qd.getlist("select_parts")
+                        select_corpus = self.qd.get("select_corpus", "")
+                        select_part = self.qd.get("select_part", "")
+                        if len(lPartId) == 0 and select_corpus == "" and select_part != "":
+                            select_corpus = Part.objects.filter(id=select_part).values_list('corpus__id', flat=True).first()
+                        if len(lPartId) == 0 and select_corpus != None and select_corpus != "":
+                            qs = Part.objects.filter(corpus__id=select_corpus)
+                        else:
+                            qs = Part.objects.filter(id__in=lPartId)
+                        # Check if format adaptation is needed per part
+                        lPartFormat = [(part, get_best_format(part, select_format)) for part in qs.order_by('name')]
+                        if len(lPartFormat) == 0:
+                            self.arErr.append("No corpus parts to be searched have been selected")
+                        else:
+                            group = BasketGroup.create(research, lPartFormat, oOptions)
+                            group.start()
+                            self.data['group_id'] = group.id
+                            self.data['group_status'] = group.status
+                            self.data['group_progress'] = reverse("search_group_progress", kwargs={'object_id': group.id})
+                            self.data['group_stop'] = reverse("search_group_stop", kwargs={'object_id': group.id})
+                            context['group'] = group.get_progress()
+                            sStatusCode = "fanout"
+                            context['statuscode'] = sStatusCode
+                        context['statuscode'] = sStatusCode
+                    elif self.action == "groupprogress":
+                        # NOTE: the self.obj now is the BASKETGROUP
+                        group = self.obj
+                        context['group'] = group.get_progress()
+                        self.data['group_status'] = group.status
+                        if group.status in ["completed", "error", "stopped"]:
+                            group.refresh_from_db(fields=['merged'])
+                            context['summary'] = group.get_summary()
+                        sStatusCode = "fanout"
+                        context['statuscode'] = sStatusCode
+                    elif self.action == "groupstop":
+                        self.obj.stop()
+                        context['group'] = self.obj.get_progress()
+                        self.data['group_status'] = self.obj.status
+                        sStatusCode = "fanout"
+                        context['statuscode'] = sStatusCode
                     elif self.action == "watch":
                         # Get the basket
                         basket = self.obj
@@ -951,8 +1009,13 @@ class ResearchExe(View):
 
                         # Need to get the status of the project
                         # NOTE: the self.obj now is the BASKET!!
-                        self.obj.set_status("loading current status")
-                        oBack = self.obj.get_progress()
+                        #   Once /crpp has a job, a background job follows it: here we only read its state
+                        job = None
+                        if self.obj.jobid == None or self.obj.jobid == "":
+                            oBack = self.obj.get_progress()
+                        else:
+                            job = self.obj.get_watch_job()
+                            oBack = job.get_progress()
                         if oBack['commandstatus'] == "error":
                             self.arErr.append(oBack['msg'])
                             context['statuscode'] = "error"
@@ -1034,11 +1097,17 @@ class ResearchExe(View):
                                 context['searchTime'] = context['searchTime'] / 1000
 
                                 # Final action: make all the information available into a Quantor for this basket
-                                oQset = self.obj.set_quantor(oBack)
-                                if oQset['status'] != 'ok':
+                                #   The background job does this; the progress requests only look at its state
+                                if job.status == "error":
                                     msg = "Could not set quantor"
-                                    if 'msg' in oQset: msg = oQset['msg']
+                                    if job.msg: msg = job.msg
                                     self.arErr.append(msg)
+                                elif job.status != "done":
+                                    # The results are still being processed
+                                    sStatusCode = "ingesting"
+                                    context['statuscode'] = sStatusCode
+                                    context['prep_status'] = self.obj.get_status()
+                                    context['progress'] = self.obj.get_progress_info()
                     elif self.action == "download":
                         if "select_part" in self.qd:
                             # Find out which corpus/part has been chosen
@@ -1165,7 +1234,9 @@ class ResearchExe(View):
         lstQ.append(Q(research=research))
         lstQ.append(Q(format=sFormat))
         lstQ.append(Q(part=part))
-        basket = Basket.objects.filter(*lstQ).first()
+        # Baskets of a multi-part search (BasketGroup) belong to that group
+        lstQ.append(Q(group__isnull=True))
+        basket = Basket.objects.filter(*lstQ).order_by('-id').first()
         if basket == None:
             # Create a new basket
             basket = Basket(research=research, part=part, format=sFormat, status="created", jobid="")
@@ -1218,10 +1289,13 @@ class ResearchExe(View):
         # Copy any object id
         self.object_id = object_id
         # if self.action == "start" or self.action == "download":
-        if self.action == "prepare" or self.action == "download" or \
+        if self.action == "prepare" or self.action == "download" or self.action == "fanout" or \
             self.action == "downloadjson" or self.action == "downloadfunction":
             # Get the instance of the Main Model object
             self.obj =  self.MainModel.objects.get(pk=object_id)
+        elif self.action == "groupprogress" or self.action == "groupstop":
+            # A multi-part search
+            self.obj = BasketGroup.objects.get(pk=object_id)
         else:
             # In all other cases we are looking at a Basket object
             self.obj = Basket.objects.get(pk=object_id)
@@ -1243,6 +1317,22 @@ class ResearchPrepare(ResearchExe):
     template_name = "seeker/exe_status.html"
 
 
+class ResearchFanout(ResearchExe):
+    MainModel = Research
+    action = "fanout"
+    template_name = "seeker/exe_status.html"
+
+
+class ResearchGroupProgress(ResearchExe):
+    action = "groupprogress"
+    template_name = "seeker/exe_status.html"
+
+
+class ResearchGroupStop(ResearchExe):
+    action = "groupstop"
+    template_name = "seeker/exe_status.html"
+
+
 class ResearchWatch(ResearchExe):
     MainModel = Basket
     action = "watch"
@@ -1441,7 +1531,7 @@ class ResearchPart(View):
                 # We are being asked to download something
                 if self.dtype != "" and self.qcTarget and self.qcTarget > 0:
                     # Get the name of the CRP, starting from basket
-                    sCrpName = self.basket.research.name
+                    sCrpName = self.basket.get_crpx_name()
                     sUserName = self.basket.research.owner.username
                     sPartDir = self.basket.part.dir
                     oBack = {'status': 'ok'}
@@ -1470,7 +1560,6 @@ class ResearchPart(View):
                         # Decode the data and compress it using gzip
                         bUtf8 = (self.dtype != "db")
                         bUsePlain = (self.dtype == "xlsx" or self.dtype == "csv")
-                        compressed_content = decompressSafe(sData, True, bUtf8, bUsePlain)
                         # Get the name and the contents
                         sLng = self.basket.part.corpus.get_lng_display()
                         sGz = "" if (bUsePlain) else ".gz"
@@ -1484,11 +1573,22 @@ class ResearchPart(View):
                         # Excel needs additional conversion
                         if self.dtype == "xlsx":
                             # Convert 'compressed_content' to an Excel worksheet
+                            compressed_content = decompressSafe(sData, True, bUtf8, bUsePlain)
                             response = HttpResponse(content_type=sContentType)
                             response['Content-Disposition'] = 'attachment; filename="{}"'.format(sDbName)    
                             response = csv_to_excel(compressed_content, response)
                         else:
-                            response = HttpResponse(compressed_content, content_type=sContentType)
+                            # Decode and decompress while sending, chunk by chunk
+                            try:
+                                stream = start_decompress_stream(sData, True, bUtf8, bUsePlain)
+                            except:
+                                # The data cannot be converted: tell the user, instead of sending an empty file
+                                context = self.add_to_context(context)
+                                self.arErr.append("The data from /crpp cannot be decoded: {}".format(self.oErr.get_error_message()))
+                                context['error_list'] = [str(item) for item in self.arErr]
+                                context['errors'] = self.arErr
+                                return render(request, self.template_name, context)
+                            response = StreamingHttpResponse(stream, content_type=sContentType)
                             response['Content-Disposition'] = 'attachment; filename="{}"'.format(sDbName)    
 
                         # Continue for all formats
@@ -3670,7 +3770,7 @@ class ObjectDeleteMixin:
         # Note: deleting is only possible through a POST request
         obj = get_object_or_404(self.model, id=object_id)
         try:
-            obj.delete()
+            self.delete_object(obj)
         except:
             lInfo = sys.exc_info()
             if len(lInfo) == 1:
@@ -3682,6 +3782,9 @@ class ObjectDeleteMixin:
         # Return the information
         return JsonResponse(self.data)
 
+    def delete_object(self, obj):
+        obj.delete()
+
 
 class ResearchDelete(ObjectDeleteMixin, View):
     """Delete one 'Research' object"""
@@ -3693,6 +3796,10 @@ class ResultDelete(ObjectDeleteMixin, View):
 
     model = Basket
 
+    def delete_object(self, obj):
+        # Large results may take a while: do not let the user wait
+        obj.delete_in_background()
+
 
 class ResearchResultDetail(View):
     """Show details (all) of one result"""
@@ -3817,37 +3924,31 @@ class KwicListView(View):
                 page = int(page)
             kwic_object = self.basket.kwiclines.filter(qc=qcNumber).first()
 
-            # Filtering
-            kwic_object.kwicfilters.all().delete()
+            # Filtering: the stored filters are only rewritten when they have changed
+            oFilter = {}
             for item in self.arFilter:
-                field = item['field']
-                id = item['id']
-                if self.qd.get(id) != "":
-                    kwic_object.add_filter(field, self.qd.get(id))
-            # Get the filter myself
-            oFilter = kwic_object.get_filter()
-            # Apply the filter
-            kwic_object.apply_filter(oFilter)
+                sValue = self.qd.get(item['id'])
+                if sValue != None and sValue != "":
+                    oFilter[item['field']] = sValue
+            bFilterChanged = (oFilter != kwic_object.get_filter())
 
+            # Set the number of items to be fetched
+            iCount = self.paginate_by
+            iStart = (page-1) * self.paginate_by
+            # Fetch the data for this page
+            oData = self.basket.get_dbinfo(qcNumber, iStart, iCount, filter=oFilter)
+            if bFilterChanged:
+                # Store the filters with the new hitcount, preferably using the size in the page that has just been fetched
+                kwic_object.apply_filter(oFilter, oData)
 
             # Pagination
             hit_count = kwic_object.hitcount
-            result_number_list = list(range(1, hit_count))
-            paginator = Paginator(result_number_list, self.paginate_by)
+            paginator = CountPaginator(hit_count, self.paginate_by)
             self.page_obj = paginator.page(page)
 
-            # Set the number of items to be fetched
-            iCount = self.paginate_by
-            iStart = (page-1) * self.paginate_by
-            # Fetch the data for this page
-            oData = crpp_dbinfo(self.basket.research.owner.username, 
-                                self.basket.research.name,
-                                qcNumber, 
-                                iStart,
-                                iCount,
-                                filter=oFilter,
-                                sPart=self.basket.part.dir)
             if oData['commandstatus'] == "ok" and oData['status']['code'] == "completed":
+                # Have the adjacent pages ready for the next click
+                self.basket.prefetch_dbinfo(qcNumber, page, iCount, hit_count, filter=oFilter)
                 # Provide all the information needed to create the Html presentation of the data
                 context['result_list'] = oData['Results']
                 context['feature_list'] = oData['Features']
@@ -3990,8 +4091,11 @@ class ResultDetailView(DetailView):
         # BEWARE: perhaps quantor is empty?
         if self.quantor == None:
             context['qclines'] = []
+            context['summary'] = []
         else:
             context['qclines'] = self.quantor.qclines.all()
+            # The pre-calculated numbers (not available for older results)
+            context['summary'] = self.quantor.get_summary()
 
         # Return the calculated context
         return context
@@ -4062,17 +4166,22 @@ class QuantorListView(ListView):
         lstQ = []
         lstQ.append(Q(subcat__qcline=self.qcline))
 
+        # The compact matrix (if available) is filtered on the same criteria
+        oMatrixFilter = {}
+
         # Filter on subcat
         if 'subcategory' in get and get['subcategory'] != '':
             val = get['subcategory']
             # The subcat value is an id
             lstQ.append(Q(subcat=val))
+            oMatrixFilter['subcat'] = val
 
         # Filter on text Name
         if 'textname' in get and get['textname'] != '':
             # Allow simple wildcard search
             val = adapt_search(get['textname'])
             lstQ.append(Q(text__fileName__iregex=val))
+            oMatrixFilter['textname'] = val
 
         # Filter on the minimum number of hits
         if 'minhits' in get and get['minhits'] != '':
@@ -4081,15 +4190,21 @@ class QuantorListView(ListView):
             try:
                 iVal = int(val)-1
                 lstQ.append(Q(count__gt=iVal))
+                oMatrixFilter['minhits'] = iVal + 1
             except:
                 iDoNothing = 1
 
         # Set and order the selection
-        self.qs = Qsubinfo.objects.filter(*lstQ).distinct().select_related().order_by(
-            Lower('subcat__name'),
-            Lower('text__fileName'))
-
-        self.entrycount = self.qs.count()
+        matrix = self.qcline.get_matrix()
+        if matrix != None:
+            # Select from the compact texts x subcats matrix
+            self.qs = matrix.select(**oMatrixFilter)
+            self.entrycount = len(self.qs)
+        else:
+            self.qs = Qsubinfo.objects.filter(*lstQ).distinct().select_related().order_by(
+                Lower('subcat__name'),
+                Lower('text__fileName'))
+            self.entrycount = self.qs.count()
 
         # Return the resulting filtered and sorted queryset
         return self.qs
@@ -4139,6 +4254,7 @@ class ResultPart1(ResearchPart):
         context['entrycount'] = self.entrycount
         context['qsubcats'] = self.qcline.qsubcats.all()
         context['filter_list'] = self.basket.get_filter_list(self.qcTarget)
+        context['qc_total'] = self.quantor.get_total(self.qcTarget)
 
         # Add pagination information
         context['object_list'] = self.page_obj
@@ -4165,17 +4281,22 @@ class ResultPart1(ResearchPart):
         lstQ = []
         lstQ.append(Q(subcat__qcline=self.qcline))
 
+        # The compact matrix (if available) is filtered on the same criteria
+        oMatrixFilter = {}
+
         # Filter on subcat
         if 'subcategory' in self.qd and self.qd['subcategory'] != '':
             val = self.qd['subcategory']
             # The subcat value is an id
             lstQ.append(Q(subcat=val))
+            oMatrixFilter['subcat'] = val
 
         # Filter on text Name
         if 'textname' in self.qd and self.qd['textname'] != '':
             # Allow simple wildcard search
             val = adapt_search(self.qd['textname'])
             lstQ.append(Q(text__fileName__iregex=val))
+            oMatrixFilter['textname'] = val
 
         # Filter on the minimum number of hits
         if 'minhits' in self.qd and self.qd['minhits'] != '':
@@ -4184,19 +4305,26 @@ class ResultPart1(ResearchPart):
             try:
                 iVal = int(val)-1
                 lstQ.append(Q(count__gt=iVal))
+                oMatrixFilter['minhits'] = iVal + 1
             except:
                 iDoNothing = 1
         # Filter on zero hits
         elif 'hide_empty' in self.qd and self.qd['hide_empty'] == 'true':
             # make sure the count is larger than zero
             lstQ.append(Q(count__gt=0))
+            oMatrixFilter['minhits'] = 1
 
         # Set and order the selection
-        self.qs = Qsubinfo.objects.filter(*lstQ).distinct().select_related().order_by(
-            Lower('subcat__name'),
-            Lower('text__fileName'))
-
-        self.entrycount = self.qs.count()
+        matrix = self.qcline.get_matrix()
+        if matrix != None:
+            # Select from the compact texts x subcats matrix
+            self.qs = matrix.select(**oMatrixFilter)
+            self.entrycount = len(self.qs)
+        else:
+            self.qs = Qsubinfo.objects.filter(*lstQ).distinct().select_related().order_by(
+                Lower('subcat__name'),
+                Lower('text__fileName'))
+            self.entrycount = self.qs.count()
 
         # Return the resulting filtered and sorted queryset
         return self.qs
@@ -4249,13 +4377,7 @@ class ResultPart14(ResearchPart):
             iCount = 100
             page = 1
             # Fetch the data for this page
-            oData = crpp_dbinfo(self.basket.research.owner.username, 
-                                self.basket.research.name,
-                                qc, 
-                                iStart,
-                                iCount,
-                                filter=oFilter,
-                                sPart=self.basket.part.dir)
+            oData = self.basket.get_dbinfo(qc, iStart, iCount, filter=oFilter)
             if oData['commandstatus'] == "ok" and oData['code'] == "completed":
                 self.result_list = oData['Results']
                 self.feature_list = oData['Features']
@@ -4280,6 +4402,17 @@ class ResultPart14(ResearchPart):
         return context
 
 
+class ResultPart14Cell(ResultPart14):
+    """Fetch all hits within a document for one cell of the compact matrix: its Qsubinfo is made on opening"""
+
+    def post(self, request, subcat_id=None, text_id=None):
+        subcat = get_object_or_404(Qsubcat, id=subcat_id)
+        qsubinfo = subcat.qcline.get_qsubinfo(subcat, int(text_id))
+        if qsubinfo == None:
+            raise Http404("This text has no results for this category")
+        return super(ResultPart14Cell, self).post(request, object_id=qsubinfo.id)
+
+
 class ResultPart2(ResearchPart):
     MainModel = Basket
     template_name = 'seeker/result_part_2.html'
@@ -4325,8 +4458,7 @@ class ResultPart2(ResearchPart):
         else:
             # Pagination
             self.hit_count = self.kwic_object.hitcount
-            result_number_list = list(range(1, self.hit_count))
-            paginator = Paginator(result_number_list, self.paginate_by)
+            paginator = CountPaginator(self.hit_count, self.paginate_by)
             self.page_obj = paginator.page(page)
 
             # Get the filter myself
@@ -4337,31 +4469,29 @@ class ResultPart2(ResearchPart):
                 self.result_list = [json.loads(item.result) for item in self.kwic_object.kwicresults.all()]
                 self.feature_list = self.kwic_object.get_features()
             else:
+                # Set the number of items to be fetched
+                iCount = self.paginate_by
+                iStart = (page-1) * self.paginate_by
+                # Fetch the data for this page
+                oData = self.basket.get_dbinfo(qc, iStart, iCount, filter=oFilter)
+
+                bCounted = True
                 if not self.kwic_object.has_filter(oFilter):
-                    # Apply the filter
-                    self.kwic_object.apply_filter(oFilter)
+                    # Apply the filter, preferably using the size in the page that has just been fetched
+                    bCounted = self.kwic_object.apply_filter(oFilter, oData)
                     # Now re-calculate the numbers
                     self.hit_count = self.kwic_object.hitcount
-                    result_number_list = list(range(1, self.hit_count))
-                    paginator = Paginator(result_number_list, self.paginate_by)
+                    paginator = CountPaginator(self.hit_count, self.paginate_by)
                     self.page_obj = paginator.page(page)
 
-                # Set the number of items to be fetched
-                iCount = self.paginate_by
-                iStart = (page-1) * self.paginate_by
-                # Fetch the data for this page
-                oData = crpp_dbinfo(self.basket.research.owner.username, 
-                                    self.basket.research.name,
-                                    qc, 
-                                    iStart,
-                                    iCount,
-                                    filter=oFilter,
-                                    sPart=self.basket.part.dir)
                 if oData['commandstatus'] == "ok" and oData['code'] == "completed":
+                    # Have the adjacent pages ready for the next click
+                    self.basket.prefetch_dbinfo(qc, page, iCount, self.hit_count, filter=oFilter)
                     self.result_list = oData['Results']
                     self.feature_list = oData['Features']
-                    # Also add the results as objects
-                    self.kwic_object.add_result_list(oData['Results'], page)
+                    # Also add the results as objects (unless the count must be tried again)
+                    if bCounted:
+                        self.kwic_object.add_result_list(oData['Results'], page)
                 else:
                     # Some error has occurred
                     self.data['status'] = "error"
@@ -4374,6 +4504,8 @@ class ResultPart2(ResearchPart):
         context['original'] = research
         context['entrycount'] = self.entrycount
         context['basket'] = self.basket
+        quantor = self.basket.myquantor.first()
+        context['qc_total'] = None if quantor == None else quantor.get_total(self.qcline)
         if self.kwic_object == None:
             context['kwic_id'] = None
         else:
@@ -4709,7 +4841,7 @@ def research_edit(request, object_id=None):
                 partchoice = basket.part.id
         else:
             # There already is a search: find its associated part
-            basket = Basket.objects.filter(research=obj).order_by('-saved').first()
+            basket = Basket.objects.filter(research=obj, group__isnull=True).order_by('-saved', '-id').first()
             if basket != None:
                 partchoice = basket.part.id
             # Reset the basket, because it is not used in this call
@@ -4792,7 +4924,7 @@ def research_simple(request, pk=None):
                 obj.save()
             else:
                 # There already is a search: find its associated part
-                basket = Basket.objects.filter(research=obj).order_by('-saved').first()
+                basket = Basket.objects.filter(research=obj, group__isnull=True).order_by('-saved', '-id').first()
                 if basket != None:
                     partchoice = basket.part.id
             # Create a form based on this research object
@@ -5227,7 +5359,7 @@ def research_simple_save(request):
         # Double check to see if the search has run
         if obj != None:
             # There already is a search: find its associated part
-            basket = Basket.objects.filter(research=obj).order_by('-saved').first()
+            basket = Basket.objects.filter(research=obj, group__isnull=True).order_by('-saved', '-id').first()
             if basket != None:
                 # This search has run recently, so that is good
                 object_id = obj.id
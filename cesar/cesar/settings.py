@@ -32,6 +32,15 @@ MEDIA_ROOT = MEDIA_DIR
 
 # Surfsara VM:
 CRPP_HOME = 'http://corpus-studio-web.cttnww-meertens.surf-hosted.nl/crpp'
+# Number of KWIC pages before/after the current one fetched ahead, and the threads doing so
+KWIC_PREFETCH_DEPTH = 1
+KWIC_PREFETCH_WORKERS = 2
+# Number of baskets of a multi-part search that run at /crpp at the same time
+FANOUT_WORKERS = 3
+# Number of /crpp/txt requests at the same time when the sentences of a part are fetched ahead
+SENTENCE_WARMUP_WORKERS = 4
+# Number of part/format combinations whose texts are synchronised with /crpp at the same time
+SYNC_WORKERS = 3
 PROJECT_DIR = '/etc/project'
 
 APP_PREFIX = "dd/"
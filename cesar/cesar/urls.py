@@ -91,6 +91,7 @@ urlpatterns = [
     url(r'^text/list/$', cesar.browser.views.TextListView.as_view(), name='text_list'),
     url(r'^text/view/(?P<pk>\d+)', TextDetailView.as_view(), name='text_view'),
     url(r'^text/lines/(?P<pk>\d+)/$', SentenceListView.as_view(), name='text_lines'),
+    url(r'^text/lines/search/$', SentenceSearchView.as_view(), name='text_lines_search'),
     url(r'^text/line/(?P<pk>\d+)/$', SentenceDetailView.as_view(), name='text_line'),
     url(r'^text/syntax/download/(?P<pk>\d+)/$', SentenceDetailView.as_view(), name='syntax_download'),
 
@@ -174,6 +175,7 @@ urlpatterns = [
     url(r'^seek/result/(?P<pk>\d+)/$', ResultDetailView.as_view(), name='result_details'),
     url(r'^seek/result/docs/(?P<object_id>\d+)/$', ResultPart1.as_view(), name='result_part_1'),
     url(r'^seek/result/dochits/(?P<object_id>\d+)/$', ResultPart14.as_view(), name='result_part_14'),
+    url(r'^seek/result/dochits/(?P<subcat_id>\d+)/(?P<text_id>\d+)/$', ResultPart14Cell.as_view(), name='result_part_14_cell'),
     url(r'^seek/result/sents/(?P<object_id>\d+)/$', ResultPart2.as_view(), name='result_part_2'),
     url(r'^seek/result/filter/(?P<object_id>\d+)/$', ResultPart3.as_view(), name='result_part_3'),
     url(r'^seek/result/hit/(?P<object_id>\d+)/$', ResultPart4.as_view(), name='result_part_4'),
@@ -190,6 +192,7 @@ urlpatterns = [
     url(r'^sync/crpp$', cesar.browser.views.sync_crpp, name='crpp'),
     url(r'^sync/crpp/start/$', cesar.browser.views.sync_crpp_start, name='sync_start'),
     url(r'^sync/crpp/progress/$', cesar.browser.views.sync_crpp_progress, name='sync_progress'),
+    url(r'^sync/crpp/stop/$', cesar.browser.views.sync_crpp_stop, name='sync_stop'),
 
     url(r'^ajax/prepare(?:/(?P<object_id>\d+))?/$', ResearchPrepare.as_view(), name='search_prepare'),
     url(r'^ajax/watch(?:/(?P<object_id>\d+))?/$', ResearchWatch.as_view(), name='search_watch'),
@@ -198,6 +201,9 @@ urlpatterns = [
     url(r'^ajax/download/crpx/(?P<object_id>\d+)/$', ResearchDownload.as_view(), name='search_download'),
     url(r'^ajax/download/json/(?P<object_id>\d+)/$', ResearchDownloadJson.as_view(), name='search_json'),
     url(r'^ajax/progress(?:/(?P<object_id>\d+))?/$', ResearchProgress.as_view(), name='search_progress'),
+    url(r'^ajax/fanout(?:/(?P<object_id>\d+))?/$', ResearchFanout.as_view(), name='search_fanout'),
+    url(r'^ajax/group/progress(?:/(?P<object_id>\d+))?/$', ResearchGroupProgress.as_view(), name='search_group_progress'),
+    url(r'^ajax/group/stop(?:/(?P<object_id>\d+))?/$', ResearchGroupStop.as_view(), name='search_group_stop'),
     url(r'^ajax/researchfield(?:/(?P<object_id>\d+))?/$', ResearchField.as_view(), name='research_field'),
     url(r'^ajax/researchpart1/$', ResearchPart1.as_view(), name='research_new'),
     url(r'^ajax/researchpart1(?:/(?P<object_id>\d+))?/$', ResearchPart1.as_view(), name='research_part_1'),
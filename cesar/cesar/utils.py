@@ -1,8 +1,16 @@
 import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 from django import http
+from django.db import close_old_connections, connection
 from cesar.basic.models import Address
 
+# Thread pools for background jobs, one per purpose (created on first use)
+background_pools = {}
+background_lock = threading.Lock()
+
 class ErrHandle:
     """Error handling"""
 
@@ -57,6 +65,79 @@ class ErrHandle:
         return " ".join(self.loc_errStack)
 
 
+def get_background_pool(sPool, iWorkers = 2):
+    """Get (or create) the thread pool named [sPool] with [iWorkers] threads"""
+
+    with background_lock:
+        pool = background_pools.get(sPool)
+        if pool == None:
+            pool = ThreadPoolExecutor(max_workers=iWorkers, thread_name_prefix="cesar_{}".format(sPool))
+            background_pools[sPool] = pool
+    return pool
+
+def run_in_background(sPool, fn, *args, iWorkers = 2, **kwargs):
+    """Run fn(*args, **kwargs) in the background thread pool [sPool], outside of the web request
+
+    Each job gets its own database connection, which is closed when the job is done.
+    Returns a Future for the job.
+    """
+
+    def job_wrapper():
+        oErr = ErrHandle()
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        except:
+            oErr.DoError("run_in_background [{}]".format(sPool))
+            return None
+        finally:
+            connection.close()
+
+    return get_background_pool(sPool, iWorkers).submit(job_wrapper)
+
+
+class LruCache():
+    """In-process cache that holds at most [size] items, dropping the least recently used one"""
+
+    def __init__(self, size = 500):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default = None):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def delete_where(self, fn):
+        """Remove all items whose key satisfies fn(key); returns the number removed"""
+        with self.lock:
+            lst_key = [key for key in self.items if fn(key)]
+            for key in lst_key:
+                del self.items[key]
+        return len(lst_key)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+
 class BlockedIpMiddleware(object):
 
     bot_list = ['googlebot', 'bot.htm', 'bot.com', '/petalbot', 'crawler.com', 'robot', 'crawler',